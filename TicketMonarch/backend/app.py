@@ -1,15 +1,50 @@
-from flask import Flask, request, jsonify
+import os
+
+import click
+from flask import Blueprint, Flask, Response, current_app, request, jsonify, stream_with_context
 from flask_cors import CORS
-from database import init_database, save_order
+import metrics
+from database import (DATABASE_PATH, OrderRejected, init_database, save_order, export_to_csv,
+                      export_watermark, iter_checkouts_csv, set_order_index)
+from order_index import OrderIndex
+from velocity import VelocityTracker, exceeded, parse_limits
+
+api = Blueprint('api', __name__)
+
 
-app = Flask(__name__)
-# Enable CORS for Vite frontend (default port 5173)
-CORS(app, origins=["http://localhost:5173", "http://localhost:3000"])
+def create_app():
+    """
+    Build the Flask app. The schema is not touched here; create it once with
+    `flask --app app init-db` (or by running app.py directly).
+    """
+    app = Flask(__name__)
+    # Enable CORS for Vite frontend (default port 5173)
+    CORS(app, origins=["http://localhost:5173", "http://localhost:3000"])
+    metrics.init_app(app)
+    # Checkout velocity signals; CHECKOUT_VELOCITY_LIMITS (e.g.
+    # "ip_1m=10,email_1h=5") rejects checkouts over a limit, empty = record only
+    app.config['CHECKOUT_VELOCITY_LIMITS'] = parse_limits(os.getenv('CHECKOUT_VELOCITY_LIMITS', ''))
+    app.extensions['velocity'] = VelocityTracker.from_env()
+    metrics.register_stats('velocity', app.extensions['velocity'].stats)
+    # Duplicate-order / card-reuse signals; CHECKOUT_ORDER_LIMITS (e.g.
+    # "card_emails=3,order_seen=0") rejects orders over a limit with a 409
+    app.config['CHECKOUT_ORDER_LIMITS'] = parse_limits(os.getenv('CHECKOUT_ORDER_LIMITS', ''))
+    app.extensions['orders'] = OrderIndex.from_env()
+    app.extensions['orders'].load_in_background(DATABASE_PATH)
+    set_order_index(app.extensions['orders'])
+    metrics.register_stats('order_index', app.extensions['orders'].stats)
+    app.register_blueprint(api)
 
-# Initialize database when app starts
-init_database()
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create the checkouts table if it does not exist"""
+        init_database()
+        click.echo('Initialized the checkouts database')
 
-@app.route('/api/checkout', methods=['POST'])
+    return app
+
+
+@api.route('/api/checkout', methods=['POST'])
 def checkout():
     """Process checkout form submission and save to database"""
     try:
@@ -27,8 +62,27 @@ def checkout():
             'state': data.get('state', '') or '',
             'zip_code': data.get('zip_code', '') or ''
         }
-        
-        order_id = save_order(order_data)
+
+        signals = current_app.extensions['velocity'].record(
+            ip=request.remote_addr,
+            email=order_data['email'].strip().lower()
+        )
+        over = exceeded(signals, current_app.config['CHECKOUT_VELOCITY_LIMITS'])
+        if over:
+            return jsonify({
+                'success': False,
+                'error': 'Too many checkout attempts, please try again later',
+                'limits': over
+            }), 429
+
+        try:
+            order_id = save_order(order_data, current_app.config['CHECKOUT_ORDER_LIMITS'])
+        except OrderRejected as e:
+            return jsonify({
+                'success': False,
+                'error': 'This order duplicates a previous one or reuses a card too often',
+                'limits': e.limits
+            }), 409
         
         return jsonify({
             'success': True,
@@ -41,6 +95,52 @@ def checkout():
             'error': str(e)
         }), 500
 
+@api.route('/api/export', methods=['GET'])
+def export_checkouts():
+    """
+    Export checkouts as CSV.
+
+    Query parameters:
+        since: only export orders with an id above this watermark
+        gzip: 1 to gzip the output
+        download: 1 to stream the CSV back in the response instead of
+                  writing it to the data/ folder
+
+    The highest exported id is returned as the watermark for the next
+    incremental export (X-Export-Watermark header when downloading).
+    """
+    try:
+        since = request.args.get('since', 0, type=int)
+        compress = request.args.get('gzip') == '1'
+        watermark = export_watermark()
+
+        if request.args.get('download') == '1':
+            filename = 'checkouts.csv.gz' if compress else 'checkouts.csv'
+            return Response(
+                stream_with_context(iter_checkouts_csv(since, watermark, compress=compress)),
+                mimetype='application/gzip' if compress else 'text/csv',
+                headers={
+                    'Content-Disposition': f'attachment; filename={filename}',
+                    'X-Export-Watermark': str(watermark),
+                    'Access-Control-Expose-Headers': 'X-Export-Watermark'
+                }
+            )
+
+        file_path = export_to_csv(since=since, until=watermark, compress=compress)
+        return jsonify({
+            'success': True,
+            'message': 'Data exported successfully',
+            'file_path': file_path,
+            'watermark': watermark
+        })
+
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 500
+
 if __name__ == '__main__':
-    app.run(debug=True, port=5000)
+    init_database()
+    create_app().run(debug=True, port=5000)
 
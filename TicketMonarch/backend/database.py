@@ -1,20 +1,95 @@
 import sqlite3
 import csv
+import io
 import os
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Future
 from datetime import datetime
 
+from metrics import TimedConnection
+
 # Get base directory and data directory paths
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, 'data')
-DATABASE_PATH = os.path.join(DATA_DIR, 'checkouts.db')
+DATABASE_PATH = os.getenv('CHECKOUTS_DB_PATH', os.path.join(DATA_DIR, 'checkouts.db'))
+
+# Group commit: orders arriving within GROUP_COMMIT_MS of each other share one
+# transaction (and one fsync). Off by default; set CHECKOUT_GROUP_COMMIT=1.
+GROUP_COMMIT = os.getenv('CHECKOUT_GROUP_COMMIT', '0') == '1'
+GROUP_COMMIT_MS = float(os.getenv('CHECKOUT_GROUP_COMMIT_MS', '5'))
+GROUP_COMMIT_MAX = int(os.getenv('CHECKOUT_GROUP_COMMIT_MAX', '256'))
+
+INSERT_ORDER_SQL = '''
+    INSERT INTO checkouts (full_name, email, card_number, card_expiry, card_cvv,
+                          billing_address, city, state, zip_code, timestamp)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
 
 # Ensure data directory exists
 os.makedirs(DATA_DIR, exist_ok=True)
 
+_local = threading.local()
+
+# OrderIndex (order_index.py) that every writer of checkouts keeps current
+_order_index = None
+
+
+class OrderRejected(Exception):
+    """save_order() refused an order because an index signal is over its limit"""
+
+    def __init__(self, limits, signals):
+        super().__init__(f"order over limits: {', '.join(limits)}")
+        self.limits = limits
+        self.signals = signals
+
+
+def set_order_index(index):
+    """Have save_order() and the CSV import record their orders in `index`"""
+    global _order_index
+    _order_index = index
+
+
+def index_orders(orders):
+    """Add already stored orders (dicts with email, card_number, timestamp) to the index"""
+    index = _order_index
+    if index is None:
+        return
+    for order in orders:
+        timestamp = order.get('timestamp')
+        index.add(order.get('email'), order.get('card_number'),
+                  timestamp.timestamp() if isinstance(timestamp, datetime) else None)
+
+
+def get_connection():
+    """Return this thread's persistent connection, opening it on first use"""
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=5.0, factory=TimedConnection)
+        # WAL lets readers run alongside the writer; synchronous=NORMAL only
+        # fsyncs at checkpoints, which is still durable against app crashes
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA busy_timeout=5000')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-16000')
+        _local.conn = conn
+    return conn
+
+
+def close_connection():
+    """Close this thread's persistent connection, if it has one"""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
 
 def init_database():
     """Initialize the database and create the checkouts table"""
-    conn = sqlite3.connect(DATABASE_PATH)
+    conn = get_connection()
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -34,19 +109,10 @@ def init_database():
     ''')
 
     conn.commit()
-    conn.close()
 
 
-def save_order(order_data):
-    """Save submitted form data to the database"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
-
-    cursor.execute('''
-        INSERT INTO checkouts (full_name, email, card_number, card_expiry, card_cvv, 
-                              billing_address, city, state, zip_code, timestamp)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-    ''', (
+def _order_params(order_data):
+    return (
         order_data.get('full_name', ''),
         order_data.get('email', ''),
         order_data.get('card_number', ''),
@@ -57,31 +123,195 @@ def save_order(order_data):
         order_data.get('state', ''),
         order_data.get('zip_code', ''),
         datetime.now().isoformat()
-    ))
+    )
 
-    order_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
+
+class GroupCommitter:
+    """
+    Single writer thread that commits queued orders together.
+
+    If the group's transaction fails, each order is retried in its own
+    transaction, so only the orders that fail on their own get the error.
+    """
+
+    def __init__(self, window_ms=GROUP_COMMIT_MS, max_batch=GROUP_COMMIT_MAX):
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.batches = 0
+        self.orders = 0
+        self._thread = threading.Thread(target=self._run, name='group-commit', daemon=True)
+        self._thread.start()
+
+    def submit(self, params):
+        future = Future()
+        self.queue.put((params, future))
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.monotonic() + self.window_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        conn = get_connection()
+        try:
+            cursor = conn.cursor()
+            ids = []
+            for params, _ in batch:
+                cursor.execute(INSERT_ORDER_SQL, params)
+                ids.append(cursor.lastrowid)
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                self._commit_each(conn, batch)
+            return
+
+        self.batches += 1
+        self.orders += len(batch)
+        for (_, future), order_id in zip(batch, ids):
+            future.set_result(order_id)
+
+    def _commit_each(self, conn, batch):
+        """Fallback after a failed group: one transaction per order"""
+        for params, future in batch:
+            try:
+                cursor = conn.execute(INSERT_ORDER_SQL, params)
+                order_id = cursor.lastrowid
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                future.set_exception(e)
+                continue
+            self.orders += 1
+            future.set_result(order_id)
+        self.batches += 1
+
+
+_committer = None
+_committer_lock = threading.Lock()
+
+
+def _get_committer():
+    global _committer
+    if _committer is None:
+        with _committer_lock:
+            if _committer is None:
+                _committer = GroupCommitter()
+    return _committer
+
+
+def save_order(order_data, limits=None):
+    """
+    Save submitted form data to the database.
+
+    With an order index set, the order is checked against `limits` and
+    recorded in the same step (OrderRejected if a signal is over), and taken
+    back out of the index if the insert fails.
+    """
+    params = _order_params(order_data)
+    index = _order_index
+    if index is not None:
+        signals, over = index.check_and_add(order_data.get('email'), order_data.get('card_number'), limits)
+        if over:
+            raise OrderRejected(over, signals)
+
+    try:
+        if GROUP_COMMIT:
+            return _get_committer().submit(params).result()
+
+        conn = get_connection()
+        try:
+            cursor = conn.execute(INSERT_ORDER_SQL, params)
+            order_id = cursor.lastrowid
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    except Exception:
+        if index is not None:
+            index.discard(order_data.get('email'), order_data.get('card_number'))
+        raise
 
     return order_id
 
 
-def export_to_csv():
-    """Export all checkout data to a CSV file in the data/ folder"""
-    conn = sqlite3.connect(DATABASE_PATH)
-    cursor = conn.cursor()
+def export_watermark():
+    """Return the highest checkout id currently stored (0 if empty)"""
+    row = get_connection().execute('SELECT COALESCE(MAX(id), 0) FROM checkouts').fetchone()
+    return row[0]
 
-    cursor.execute('SELECT * FROM checkouts')
-    rows = cursor.fetchall()
-    columns = [description[0] for description in cursor.description]
 
-    conn.close()
+def iter_checkouts_csv(since=0, until=None, chunk_size=1000, compress=False):
+    """
+    Yield the checkouts table as CSV text, chunk_size rows at a time.
 
-    csv_path = os.path.join(DATA_DIR, 'checkouts.csv')
+    Only rows with since < id <= until are exported, so a caller can pass
+    the previous run's watermark to get just the new orders. With compress
+    set, the chunks are gzip-compressed bytes instead of text.
+    """
+    if until is None:
+        until = export_watermark()
 
-    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        writer = csv.writer(csvfile)
+    # Dedicated connection so a slow client never holds this thread's
+    # connection (or a read snapshot) for the other requests it serves
+    conn = sqlite3.connect(DATABASE_PATH, timeout=5.0, factory=TimedConnection)
+    gzipper = zlib.compressobj(wbits=31) if compress else None
+    try:
+        cursor = conn.execute(
+            'SELECT * FROM checkouts WHERE id > ? AND id <= ? ORDER BY id',
+            (since, until)
+        )
+        columns = [description[0] for description in cursor.description]
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
         writer.writerow(columns)
-        writer.writerows(rows)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            writer.writerows(rows)
+            chunk = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            if gzipper is not None:
+                chunk = gzipper.compress(chunk.encode('utf-8'))
+            if chunk:
+                yield chunk
+            if not rows:
+                break
+        if gzipper is not None:
+            yield gzipper.flush()
+    finally:
+        conn.close()
+
+
+def export_to_csv(csv_path=None, since=0, until=None, compress=False):
+    """
+    Export checkout data to a CSV file in the data/ folder
+
+    Rows are streamed to disk in chunks, so memory use stays flat as the
+    table grows. `since`/`until` bound the exported ids (see
+    iter_checkouts_csv); compress writes a .csv.gz instead.
+    """
+    if csv_path is None:
+        csv_path = os.path.join(DATA_DIR, 'checkouts.csv.gz' if compress else 'checkouts.csv')
+
+    mode = 'wb' if compress else 'w'
+    open_kwargs = {} if compress else {'newline': '', 'encoding': 'utf-8'}
+    with open(csv_path, mode, **open_kwargs) as csvfile:
+        for chunk in iter_checkouts_csv(since, until, compress=compress):
+            csvfile.write(chunk)
 
     return csv_path
@@ -0,0 +1,73 @@
+"""
+Prometheus metrics and the /debug/profiler sampling profiler for TicketMonarch.
+
+The metric types, GET /metrics and the profiler live in
+common/metrics_core.py, shared with the RL-CAPTCHA backend; this module
+re-exports them and adds the sqlite3 and SQLAlchemy hooks that time every
+statement.
+"""
+import os
+import sqlite3
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "common"))
+
+from metrics_core import (Counter, Gauge, Histogram, SamplingProfiler, init_app,  # noqa: E402,F401
+                          profiler, record_query, register_stats, render)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """sqlite3 cursor that records statement time and row counts"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_query(sql, time.perf_counter() - started, self.rowcount)
+
+
+class TimedConnection(sqlite3.Connection):
+    """
+    sqlite3 connection (pass as factory= to sqlite3.connect) whose cursors
+    are TimedCursors. Commits are timed as operation COMMIT, which is where
+    the WAL fsync cost shows up.
+    """
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_query("COMMIT", time.perf_counter() - started, 0)
+
+
+def instrument_engine(engine):
+    """Record statement time for a SQLAlchemy engine (used by models.py)"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("_metrics_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["_metrics_start"].pop()
+        record_query(statement, time.perf_counter() - started, cursor.rowcount)
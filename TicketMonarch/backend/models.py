@@ -1,9 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Float, DateTime
+from sqlalchemy import create_engine, insert, Column, Integer, String, Float, DateTime
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from datetime import datetime
+import csv
 import os
-import pandas as pd
+
+from database import index_orders
+from metrics import instrument_engine
 
 Base = declarative_base()
 
@@ -39,6 +42,7 @@ os.makedirs(DATA_DIR, exist_ok=True)
 DATABASE_PATH = os.path.join(DATA_DIR, 'ticketmonarch.db')
 DATABASE_URL = f'sqlite:///{DATABASE_PATH}'
 engine = create_engine(DATABASE_URL, echo=False)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 def init_db():
@@ -109,13 +113,23 @@ def save_checkout_to_db(checkout_data):
     finally:
         db.close()
 
-def export_checkouts_to_csv(csv_path=None):
+CHECKOUT_CSV_COLUMNS = [
+    'id', 'full_name', 'email', 'card_number', 'card_expiry',
+    'card_cvv', 'billing_address', 'city', 'state', 'zip_code', 'timestamp'
+]
+
+def export_checkouts_to_csv(csv_path=None, since=0, chunk_size=1000):
     """
-    Export all checkout records from database to CSV format
+    Export checkout records from database to CSV format
+    
+    Rows are read with yield_per() and written as they arrive, so memory
+    stays flat no matter how large the table is.
     
     Args:
         csv_path (str, optional): Path to save CSV file. 
                                  If None, saves to data/checkouts.csv
+        since (int): Only export checkouts with an id greater than this
+        chunk_size (int): Number of rows fetched per round trip
                                  
     Returns:
         str: Path to the created CSV file
@@ -125,33 +139,40 @@ def export_checkouts_to_csv(csv_path=None):
     
     db = SessionLocal()
     try:
-        checkouts = db.query(Checkout).all()
-        
-        if not checkouts:
-            # Create empty CSV with headers if no data
-            df = pd.DataFrame(columns=[
-                'id', 'full_name', 'email', 'card_number', 'card_expiry',
-                'card_cvv', 'billing_address', 'city', 'state', 'zip_code', 'timestamp'
-            ])
-            df.to_csv(csv_path, index=False)
-            return csv_path
-        
-        # Convert to list of dictionaries
-        data = [checkout.to_dict() for checkout in checkouts]
-        df = pd.DataFrame(data)
-        df.to_csv(csv_path, index=False)
+        query = (
+            db.query(Checkout)
+            .filter(Checkout.id > since)
+            .order_by(Checkout.id)
+            .yield_per(chunk_size)
+        )
+        with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+            writer = csv.DictWriter(csvfile, fieldnames=CHECKOUT_CSV_COLUMNS)
+            writer.writeheader()
+            for checkout in query:
+                writer.writerow(checkout.to_dict())
         return csv_path
     finally:
         db.close()
 
-def import_checkouts_from_csv(csv_path=None, skip_duplicates=True):
+CHECKOUT_IMPORT_COLUMNS = ['full_name', 'email', 'card_number', 'card_expiry',
+                           'card_cvv', 'billing_address', 'city', 'state', 'zip_code']
+
+def import_checkouts_from_csv(csv_path=None, skip_duplicates=True, chunk_size=10000, progress=None):
     """
     Import checkout records from CSV file to database
     
+    The file is read chunk_size rows at a time. Duplicates are checked
+    against an in-memory set of (email, card_number) keys loaded once up
+    front, and each chunk is written with a single bulk INSERT and commit.
+    
     Args:
         csv_path (str, optional): Path to CSV file. 
                                  If None, reads from data/checkouts.csv
-        skip_duplicates (bool): If True, skip records that already exist (by email and timestamp)
+        skip_duplicates (bool): If True, skip records whose email and card number
+                                already exist (in the database or earlier in the file)
+        chunk_size (int): Number of CSV rows processed per batch
+        progress (callable, optional): Called after each chunk as
+                                       progress(rows_read, imported_count, skipped_count)
                                 
     Returns:
         tuple: (imported_count, skipped_count, errors)
@@ -162,70 +183,74 @@ def import_checkouts_from_csv(csv_path=None, skip_duplicates=True):
     if not os.path.exists(csv_path):
         raise FileNotFoundError(f"CSV file not found: {csv_path}")
     
+    # pandas takes most of a second to import and only this function needs it
+    import pandas as pd
+
+    # Validate required columns
+    header = pd.read_csv(csv_path, nrows=0).columns
+    missing_columns = [col for col in CHECKOUT_IMPORT_COLUMNS if col not in header]
+    if missing_columns:
+        raise ValueError(f"Missing required columns: {missing_columns}")
+    has_timestamp = 'timestamp' in header
+    
     db = SessionLocal()
     imported_count = 0
     skipped_count = 0
+    rows_read = 0
     errors = []
     
     try:
-        df = pd.read_csv(csv_path)
+        seen = set()
+        if skip_duplicates:
+            existing = db.query(Checkout.email, Checkout.card_number).yield_per(chunk_size)
+            seen = {(email, card_number) for email, card_number in existing}
         
-        # Validate required columns
-        required_columns = ['full_name', 'email', 'card_number', 'card_expiry', 
-                          'card_cvv', 'billing_address', 'city', 'state', 'zip_code']
-        missing_columns = [col for col in required_columns if col not in df.columns]
-        if missing_columns:
-            raise ValueError(f"Missing required columns: {missing_columns}")
-        
-        for index, row in df.iterrows():
-            try:
-                # Check for duplicates if skip_duplicates is True
-                if skip_duplicates:
-                    # Parse timestamp if it exists
-                    timestamp = None
-                    if 'timestamp' in row and pd.notna(row['timestamp']):
+        # dtype=str keeps card numbers and zip codes exactly as written
+        for chunk in pd.read_csv(csv_path, dtype=str, keep_default_na=False, chunksize=chunk_size):
+            rows_read += len(chunk)
+            
+            if skip_duplicates:
+                keys = list(zip(chunk['email'], chunk['card_number']))
+                keep = []
+                for key in keys:
+                    duplicate = key in seen
+                    keep.append(not duplicate)
+                    if not duplicate:
+                        seen.add(key)
+                skipped_count += len(keys) - sum(keep)
+                chunk = chunk[keep]
+            
+            records = chunk[CHECKOUT_IMPORT_COLUMNS].to_dict('records')
+            if has_timestamp:
+                # Unparseable or empty timestamps fall back to the column default
+                timestamps = pd.to_datetime(chunk['timestamp'], format='ISO8601', errors='coerce')
+                timestamps = timestamps.fillna(pd.Timestamp(datetime.utcnow()))
+                for record, timestamp in zip(records, timestamps.dt.to_pydatetime()):
+                    record['timestamp'] = timestamp
+            
+            # An empty parameter list would insert one all-NULL row
+            if records:
+                try:
+                    db.execute(insert(Checkout), records)
+                    db.commit()
+                    imported_count += len(records)
+                    index_orders(records)
+                except Exception:
+                    # Fall back to row-by-row so one bad row doesn't sink the chunk
+                    db.rollback()
+                    for index, record in zip(chunk.index, records):
                         try:
-                            timestamp = pd.to_datetime(row['timestamp'])
-                        except:
-                            pass
-                    
-                    # Check if record already exists
-                    existing = db.query(Checkout).filter(
-                        Checkout.email == row['email'],
-                        Checkout.card_number == str(row['card_number'])
-                    ).first()
-                    
-                    if existing:
-                        skipped_count += 1
-                        continue
-                
-                # Create new checkout record
-                checkout = Checkout(
-                    full_name=str(row['full_name']),
-                    email=str(row['email']),
-                    card_number=str(row['card_number']),
-                    card_expiry=str(row['card_expiry']),
-                    card_cvv=str(row['card_cvv']),
-                    billing_address=str(row['billing_address']),
-                    city=str(row['city']),
-                    state=str(row['state']),
-                    zip_code=str(row['zip_code'])
-                )
-                
-                # Set timestamp if provided
-                if 'timestamp' in row and pd.notna(row['timestamp']):
-                    try:
-                        checkout.timestamp = pd.to_datetime(row['timestamp'])
-                    except:
-                        pass  # Use default timestamp
-                
-                db.add(checkout)
-                imported_count += 1
-                
-            except Exception as e:
-                errors.append(f"Row {index + 2}: {str(e)}")  # +2 for header and 0-based index
+                            db.execute(insert(Checkout), [record])
+                            db.commit()
+                            imported_count += 1
+                            index_orders([record])
+                        except Exception as e:
+                            db.rollback()
+                            errors.append(f"Row {index + 2}: {str(e)}")  # +2 for header and 0-based index
+            
+            if progress is not None:
+                progress(rows_read, imported_count, skipped_count)
         
-        db.commit()
         return imported_count, skipped_count, errors
         
     except Exception as e:
@@ -233,4 +258,3 @@ def import_checkouts_from_csv(csv_path=None, skip_duplicates=True):
         raise e
     finally:
         db.close()
-
@@ -0,0 +1,200 @@
+"""
+In-memory index of past orders for duplicate and card-reuse checks at
+checkout, without a SQL lookup per request.
+
+For every (email, card) pair it counts how often the pair was ordered, and
+for every card how many distinct emails used it and how many orders it
+paid for in the last day. Lookups and updates are a few dict operations.
+
+Only keyed BLAKE2b digests of the normalized email and card number are
+kept. The key is random per process, since the index is rebuilt from the
+checkouts table on every start (in a background thread, so startup is not
+delayed; until it finishes, older orders are simply not counted yet).
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from velocity import SlidingWindowCounter, exceeded
+
+logger = logging.getLogger(__name__)
+
+# Distinct emails remembered per card; past this a card is reported as
+# having at least this many
+MAX_EMAILS_PER_CARD = 64
+RECENT_WINDOW_S = 86400
+
+
+def normalize_email(email):
+    return (email or '').strip().lower()
+
+
+def normalize_card(card_number):
+    return ''.join(ch for ch in (card_number or '') if ch.isdigit())
+
+
+def _timestamp(value):
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+class OrderIndex:
+    """Exact counts over 64-bit keyed hashes of past (email, card) orders"""
+
+    def __init__(self, max_recent_cards=100000):
+        self._key = os.urandom(16)
+        self._lock = threading.Lock()
+        self.pairs = {}
+        self.card_emails = {}
+        self.card_recent = SlidingWindowCounter(RECENT_WINDOW_S, max_keys=max_recent_cards)
+        self.ready = False
+        self.loaded_orders = 0
+        self.load_ms = 0.0
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_recent_cards=int(os.getenv('ORDER_INDEX_RECENT_CARDS', 100000)))
+
+    def _hash(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=8, key=self._key).digest()
+        return int.from_bytes(digest, 'little')
+
+    def _keys(self, email, card_number):
+        email = normalize_email(email)
+        card = normalize_card(card_number)
+        card_key = self._hash('card:' + card) if card else None
+        email_key = self._hash('email:' + email) if email else None
+        pair_key = self._hash(f'pair:{email}:{card}') if email and card else None
+        return email_key, card_key, pair_key
+
+    def add(self, email, card_number, timestamp=None):
+        """Record one order; timestamp is epoch seconds (default now)"""
+        keys = self._keys(email, card_number)
+        with self._lock:
+            self._add(keys, timestamp)
+
+    def check(self, email, card_number):
+        """Signals for an order about to be placed (the order itself is not counted)"""
+        keys = self._keys(email, card_number)
+        with self._lock:
+            return self._signals(keys)
+
+    def check_and_add(self, email, card_number, limits=None):
+        """
+        check() and add() as one step: returns (signals, names over `limits`)
+        and records the order only if none is over. Two identical orders at
+        the same time cannot both see order_seen=0.
+        """
+        keys = self._keys(email, card_number)
+        with self._lock:
+            signals = self._signals(keys)
+            over = exceeded(signals, limits or {})
+            if not over:
+                self._add(keys, None)
+            return signals, over
+
+    def discard(self, email, card_number):
+        """Take back a check_and_add() whose order could not be saved"""
+        email_key, card_key, pair_key = self._keys(email, card_number)
+        with self._lock:
+            if pair_key is not None and pair_key in self.pairs:
+                self.pairs[pair_key] -= 1
+                if not self.pairs[pair_key]:
+                    del self.pairs[pair_key]
+                    self.card_emails.get(card_key, set()).discard(email_key)
+            if card_key is not None:
+                self.card_recent.add(card_key, amount=-1)
+
+    def _add(self, keys, timestamp):
+        # Caller holds self._lock
+        email_key, card_key, pair_key = keys
+        if pair_key is not None:
+            self.pairs[pair_key] = self.pairs.get(pair_key, 0) + 1
+        if card_key is None:
+            return
+        if email_key is not None:
+            emails = self.card_emails.setdefault(card_key, set())
+            if len(emails) < MAX_EMAILS_PER_CARD:
+                emails.add(email_key)
+        # Orders older than the window would land in the wrong bucket
+        if timestamp is None or timestamp > time.time() - RECENT_WINDOW_S:
+            self.card_recent.add(card_key, timestamp)
+
+    def _signals(self, keys):
+        # Caller holds self._lock
+        email_key, card_key, pair_key = keys
+        emails = self.card_emails.get(card_key, ())
+        return {
+            'order_seen': self.pairs.get(pair_key, 0),
+            'card_emails': len(emails),
+            'card_new_email': int(card_key is not None and email_key is not None
+                                  and bool(emails) and email_key not in emails),
+            'card_orders_1d': self.card_recent.count(card_key) if card_key is not None else 0,
+        }
+
+    def load(self, database_path, until_id=None, chunk_size=10000):
+        """Index every stored order with id <= until_id (default: all of them)"""
+        started = time.perf_counter()
+        conn = sqlite3.connect(database_path, timeout=5.0)
+        try:
+            if until_id is None:
+                until_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM checkouts').fetchone()[0]
+            cursor = conn.execute(
+                'SELECT email, card_number, timestamp FROM checkouts WHERE id <= ? ORDER BY id',
+                (until_id,)
+            )
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for email, card_number, timestamp in rows:
+                    self.add(email, card_number, _timestamp(timestamp))
+                self.loaded_orders += len(rows)
+        finally:
+            conn.close()
+        self.load_ms = (time.perf_counter() - started) * 1000
+        self.ready = True
+
+    def load_in_background(self, database_path):
+        """
+        Start load() in a thread. Orders saved meanwhile are added by the
+        writers as usual (see database.set_order_index()); the cut-off id is
+        read here, before any of them, so nothing is counted twice.
+        """
+        try:
+            conn = sqlite3.connect(database_path, timeout=5.0)
+            try:
+                until_id = conn.execute('SELECT COALESCE(MAX(id), 0) FROM checkouts').fetchone()[0]
+            finally:
+                conn.close()
+        except sqlite3.OperationalError:
+            # No checkouts table yet (before `flask init-db`): nothing to load
+            self.ready = True
+            return None
+        thread = threading.Thread(target=self._load_logged, args=(database_path, until_id),
+                                  name='order-index-load', daemon=True)
+        thread.start()
+        return thread
+
+    def _load_logged(self, database_path, until_id):
+        try:
+            self.load(database_path, until_id)
+        except Exception as e:
+            logger.error('order index: loading past orders failed: %s', e)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'ready': int(self.ready),
+                'pairs': len(self.pairs),
+                'cards': len(self.card_emails),
+                'recent_cards': len(self.card_recent),
+                'loaded_orders': self.loaded_orders,
+                'load_ms': self.load_ms,
+            }
@@ -0,0 +1,80 @@
+import sqlite3
+
+import pytest
+
+import database
+from order_index import OrderIndex
+
+
+def order(email, **fields):
+    return {"full_name": "Test", "email": email, "card_number": "4111111111111111", **fields}
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / "checkouts.db")
+    monkeypatch.setattr(database, "DATABASE_PATH", path)
+    database.close_connection()
+    database.init_database()
+    # Orders from this address fail on their own, like a constraint violation would
+    database.get_connection().execute('''
+        CREATE TRIGGER reject_bad BEFORE INSERT ON checkouts WHEN NEW.email = 'bad@example.com'
+        BEGIN SELECT RAISE(ABORT, 'rejected'); END
+    ''')
+    yield path
+    database.close_connection()
+    database.set_order_index(None)
+
+
+def stored_emails(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute('SELECT email FROM checkouts ORDER BY id')]
+    finally:
+        conn.close()
+
+
+def test_group_commit_falls_back_to_one_order_at_a_time(db):
+    committer = database.GroupCommitter()  # its thread idles; batches are committed directly
+    futures = [database.Future() for _ in range(3)]
+    emails = ["a@example.com", "bad@example.com", "b@example.com"]
+    committer._commit([(database._order_params(order(email)), future)
+                       for email, future in zip(emails, futures)])
+
+    assert isinstance(futures[1].exception(), sqlite3.IntegrityError)
+    assert futures[0].result() < futures[2].result()
+    assert stored_emails(db) == ["a@example.com", "b@example.com"]
+    assert committer.orders == 2
+
+
+def test_group_commit_single_order_error(db):
+    committer = database.GroupCommitter()
+    future = database.Future()
+    committer._commit([(database._order_params(order("bad@example.com")), future)])
+    assert isinstance(future.exception(), sqlite3.IntegrityError)
+    assert stored_emails(db) == []
+
+
+def test_group_commit_thread(db, monkeypatch):
+    monkeypatch.setattr(database, "GROUP_COMMIT", True)
+    monkeypatch.setattr(database, "_committer", database.GroupCommitter(window_ms=20))
+    assert database.save_order(order("a@example.com")) > 0
+    with pytest.raises(sqlite3.IntegrityError):
+        database.save_order(order("bad@example.com"))
+    assert stored_emails(db) == ["a@example.com"]
+
+
+def test_save_order_keeps_the_index_current(db):
+    index = OrderIndex(max_recent_cards=16)
+    database.set_order_index(index)
+    limits = {"order_seen": 0}
+    database.save_order(order("a@example.com"), limits)
+    with pytest.raises(database.OrderRejected) as rejected:
+        database.save_order(order("a@example.com"), limits)
+    assert rejected.value.limits == ["order_seen"]
+
+    # A failed insert is taken back out of the index
+    with pytest.raises(sqlite3.IntegrityError):
+        database.save_order(order("bad@example.com"), limits)
+    assert index.check("bad@example.com", "4111111111111111")["order_seen"] == 0
+    assert stored_emails(db) == ["a@example.com"]
@@ -0,0 +1,59 @@
+import threading
+import time
+
+from order_index import OrderIndex
+
+
+def test_signals():
+    index = OrderIndex(max_recent_cards=16)
+    assert index.check("a@example.com", "4111 1111 1111 1111") == {
+        "order_seen": 0, "card_emails": 0, "card_new_email": 0, "card_orders_1d": 0}
+    index.add("A@Example.com ", "4111-1111-1111-1111")
+    assert index.check("a@example.com", "4111111111111111") == {
+        "order_seen": 1, "card_emails": 1, "card_new_email": 0, "card_orders_1d": 1}
+    assert index.check("b@example.com", "4111111111111111") == {
+        "order_seen": 0, "card_emails": 1, "card_new_email": 1, "card_orders_1d": 1}
+
+
+def test_old_orders_are_not_recent():
+    index = OrderIndex(max_recent_cards=16)
+    index.add("a@example.com", "4111", time.time() - 2 * 86400)
+    signals = index.check("a@example.com", "4111")
+    assert (signals["order_seen"], signals["card_orders_1d"]) == (1, 0)
+
+
+def test_check_and_add_rejects_over_limit():
+    index = OrderIndex(max_recent_cards=16)
+    limits = {"order_seen": 0}
+    assert index.check_and_add("a@example.com", "4111", limits) == (
+        {"order_seen": 0, "card_emails": 0, "card_new_email": 0, "card_orders_1d": 0}, [])
+    signals, over = index.check_and_add("a@example.com", "4111", limits)
+    assert (signals["order_seen"], over) == (1, ["order_seen"])
+    # The rejected order was not recorded
+    assert index.check("a@example.com", "4111")["order_seen"] == 1
+
+
+def test_discard_takes_the_order_back():
+    index = OrderIndex(max_recent_cards=16)
+    index.add("a@example.com", "4111")
+    index.check_and_add("b@example.com", "4111")
+    index.discard("b@example.com", "4111")
+    assert index.check("b@example.com", "4111") == {
+        "order_seen": 0, "card_emails": 1, "card_new_email": 1, "card_orders_1d": 1}
+
+
+def test_concurrent_duplicates_accept_one():
+    index = OrderIndex(max_recent_cards=16)
+    barrier = threading.Barrier(8)
+    results = []
+
+    def place():
+        barrier.wait()
+        results.append(index.check_and_add("a@example.com", "4111", {"order_seen": 0})[1])
+
+    threads = [threading.Thread(target=place) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results.count([]) == 1
@@ -0,0 +1,65 @@
+import pytest
+
+from velocity import SQLiteVelocityTracker, SlidingWindowCounter, VelocityTracker, exceeded, parse_limits
+
+T0 = 1_700_000_000.0
+
+
+def test_counts_within_the_window():
+    counter = SlidingWindowCounter(60, buckets=60, max_keys=4)
+    assert counter.add("k", T0) == 1
+    assert counter.add("k", T0 + 30) == 2
+    assert counter.add("k", T0 + 59) == 3
+    assert counter.count("other", T0) == 0
+
+
+def test_old_buckets_roll_off():
+    counter = SlidingWindowCounter(60, buckets=60, max_keys=4)
+    counter.add("k", T0)
+    counter.add("k", T0 + 30)
+    assert counter.count("k", T0 + 59) == 2
+    assert counter.count("k", T0 + 60) == 1  # T0's bucket left the window
+    assert counter.count("k", T0 + 90) == 0
+    assert counter.add("k", T0 + 1000) == 1  # idle for several windows
+
+
+def test_amount_and_discard():
+    counter = SlidingWindowCounter(3600, max_keys=4)
+    counter.add("k", T0, amount=3)
+    assert counter.add("k", T0 + 1, amount=-1) == 2
+
+
+def test_least_recently_used_key_is_evicted():
+    counter = SlidingWindowCounter(60, buckets=60, max_keys=2)
+    counter.add("a", T0)
+    counter.add("b", T0)
+    counter.add("a", T0 + 1)
+    counter.add("c", T0 + 2)
+    assert (len(counter), counter.evicted) == (2, 1)
+    assert counter.count("b", T0 + 2) == 0
+    assert counter.count("a", T0 + 2) == 2
+    # Keys that aged out are reused without counting as evictions
+    counter.add("d", T0 + 200)
+    assert counter.evicted == 1
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def tracker(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteVelocityTracker(str(tmp_path / "velocity.db"))
+    return VelocityTracker(max_keys=16)
+
+
+def test_trackers_agree(tracker):
+    assert tracker.record(T0, ip="10.0.0.1", email="a@example.com") == {
+        "ip_1m": 1, "ip_1h": 1, "email_1h": 1, "email_1d": 1}
+    tracker.record(T0 + 30, ip="10.0.0.1")
+    features = tracker.record(T0 + 120, ip="10.0.0.1", email="")
+    assert features == {"ip_1m": 1, "ip_1h": 3}
+
+
+def test_limits():
+    limits = parse_limits(" ip_1m=10, email_1h=5,")
+    assert limits == {"ip_1m": 10, "email_1h": 5}
+    assert exceeded({"ip_1m": 11, "email_1h": 5}, limits) == ["ip_1m"]
+    assert parse_limits("") == {}
@@ -0,0 +1,246 @@
+"""
+Sliding-window velocity counters (checkouts per IP per minute, per email per
+hour, ...) used as signals by /api/checkout.
+
+Each window is split into a ring of fixed-width buckets, so recording an
+event and reading a window total are O(1): the total is kept alongside the
+ring and only the buckets that rolled over since the key was last touched
+are cleared.
+
+Two stores are available (VELOCITY_BACKEND):
+    memory  per-process ring buffers (stdlib arrays), capped at VELOCITY_MAX_KEYS keys per
+            window (240 bytes each; least recently used keys go first)
+    sqlite  one bucket row per (counter, key, bucket) in VELOCITY_DB_PATH, so
+            every worker process sees the same counts
+"""
+import hashlib
+from array import array
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import TimedConnection
+
+# (dimension, label, window seconds); 60 buckets each
+DEFAULT_WINDOWS = (
+    ("ip", "1m", 60),
+    ("ip", "1h", 3600),
+    ("email", "1h", 3600),
+    ("email", "1d", 86400),
+)
+BUCKETS = 60
+
+
+def hash_key(dimension, value):
+    """Fixed-size key, so neither store keeps raw IPs or emails"""
+    return hashlib.blake2b(f"{dimension}:{value}".encode(), digest_size=8).hexdigest()
+
+
+class SlidingWindowCounter:
+    """Per-key event counts over the last `window_s` seconds, in `buckets` buckets"""
+
+    def __init__(self, window_s, buckets=BUCKETS, max_keys=20000):
+        self.width = window_s / buckets
+        self.buckets = buckets
+        self.max_keys = max_keys
+        # Row-major (slot, bucket) counts in one flat array; int32 keeps 240 B per key
+        self.counts = array('i', bytes(4 * max_keys * buckets))
+        self.totals = [0] * max_keys
+        self.heads = [0] * max_keys
+        self.slots = OrderedDict()
+        self.free = list(range(max_keys - 1, -1, -1))
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def _advance(self, slot, bucket):
+        """Roll the slot's ring forward to `bucket`, clearing the buckets it passes"""
+        gap = bucket - self.heads[slot]
+        if gap <= 0:
+            return
+        base = slot * self.buckets
+        if gap >= self.buckets:
+            self._clear(slot)
+        else:
+            for b in range(self.heads[slot] + 1, bucket + 1):
+                i = base + b % self.buckets
+                self.totals[slot] -= self.counts[i]
+                self.counts[i] = 0
+        self.heads[slot] = bucket
+
+    def _clear(self, slot):
+        base = slot * self.buckets
+        self.counts[base:base + self.buckets] = array('i', bytes(4 * self.buckets))
+        self.totals[slot] = 0
+
+    def _slot(self, key, bucket):
+        slot = self.slots.get(key)
+        if slot is not None:
+            self.slots.move_to_end(key)
+            return slot
+        # Reuse the least recently used key if it has aged out, else evict it
+        if self.slots:
+            oldest_key, oldest = next(iter(self.slots.items()))
+            if not self.free or bucket - self.heads[oldest] >= self.buckets:
+                del self.slots[oldest_key]
+                self.free.append(oldest)
+                if bucket - self.heads[oldest] < self.buckets:
+                    self.evicted += 1
+        slot = self.free.pop()
+        self._clear(slot)
+        self.heads[slot] = bucket
+        self.slots[key] = slot
+        return slot
+
+    def add(self, key, now=None, amount=1):
+        """Record `amount` events for key and return the key's window total"""
+        bucket = int((time.time() if now is None else now) // self.width)
+        with self._lock:
+            slot = self._slot(key, bucket)
+            self._advance(slot, bucket)
+            self.counts[slot * self.buckets + bucket % self.buckets] += amount
+            self.totals[slot] += amount
+            return self.totals[slot]
+
+    def count(self, key, now=None):
+        bucket = int((time.time() if now is None else now) // self.width)
+        with self._lock:
+            slot = self.slots.get(key)
+            if slot is None:
+                return 0
+            self._advance(slot, bucket)
+            return self.totals[slot]
+
+    def __len__(self):
+        return len(self.slots)
+
+
+class VelocityTracker:
+    """In-process counters for every (dimension, window) in `windows`"""
+
+    def __init__(self, windows=DEFAULT_WINDOWS, max_keys=20000):
+        self.windows = tuple(windows)
+        self.counters = {(dim, label): SlidingWindowCounter(window_s, BUCKETS, max_keys)
+                         for dim, label, window_s in self.windows}
+
+    @classmethod
+    def from_env(cls):
+        if os.getenv("VELOCITY_BACKEND", "memory") == "sqlite":
+            return SQLiteVelocityTracker(os.getenv("VELOCITY_DB_PATH", SQLiteVelocityTracker.default_path()))
+        return cls(max_keys=int(os.getenv("VELOCITY_MAX_KEYS", 20000)))
+
+    def record(self, now=None, **keys):
+        """
+        Count one event for each given dimension (e.g. ip=..., email=...)
+        and return the updated totals as features, e.g. {"ip_1m": 3, ...}.
+        Dimensions that are missing or empty are skipped.
+        """
+        features = {}
+        for dim, label, _ in self.windows:
+            value = keys.get(dim)
+            if value:
+                features[f"{dim}_{label}"] = self.counters[(dim, label)].add(hash_key(dim, value), now)
+        return features
+
+    def stats(self):
+        stats = {}
+        for (dim, label), counter in self.counters.items():
+            stats[f"{dim}_{label}_keys"] = len(counter)
+            stats[f"{dim}_{label}_evicted"] = counter.evicted
+        return stats
+
+
+class SQLiteVelocityTracker(VelocityTracker):
+    """
+    Same interface, backed by a SQLite file shared by all worker processes.
+
+    One row per (counter, key, bucket); a record is one UPSERT plus one
+    range SUM over the primary key per window, all in one transaction.
+    Buckets older than their window are purged at most once a minute.
+    """
+
+    PURGE_INTERVAL_S = 60
+
+    def __init__(self, path, windows=DEFAULT_WINDOWS):
+        self.windows = tuple(windows)
+        self.path = path
+        self._local = threading.local()
+        self._last_purge = 0.0
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS velocity_buckets (
+                counter TEXT NOT NULL,
+                key TEXT NOT NULL,
+                bucket INTEGER NOT NULL,
+                count INTEGER NOT NULL,
+                PRIMARY KEY (counter, key, bucket)
+            ) WITHOUT ROWID
+        ''')
+        conn.commit()
+
+    @staticmethod
+    def default_path():
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data')
+        return os.path.join(data_dir, 'velocity.db')
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, factory=TimedConnection)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('PRAGMA busy_timeout=5000')
+            self._local.conn = conn
+        return conn
+
+    def record(self, now=None, **keys):
+        now = time.time() if now is None else now
+        conn = self._connection()
+        features = {}
+        try:
+            for dim, label, window_s in self.windows:
+                value = keys.get(dim)
+                if not value:
+                    continue
+                window = f"{dim}_{label}"
+                key = hash_key(dim, value)
+                bucket = int(now // (window_s / BUCKETS))
+                conn.execute('''
+                    INSERT INTO velocity_buckets (counter, key, bucket, count) VALUES (?, ?, ?, 1)
+                    ON CONFLICT (counter, key, bucket) DO UPDATE SET count = count + 1
+                ''', (window, key, bucket))
+                row = conn.execute('''
+                    SELECT SUM(count) FROM velocity_buckets
+                    WHERE counter = ? AND key = ? AND bucket > ?
+                ''', (window, key, bucket - BUCKETS)).fetchone()
+                features[window] = row[0] or 0
+            if now - self._last_purge > self.PURGE_INTERVAL_S:
+                self._last_purge = now
+                for dim, label, window_s in self.windows:
+                    conn.execute('DELETE FROM velocity_buckets WHERE counter = ? AND bucket <= ?',
+                                 (f"{dim}_{label}", int(now // (window_s / BUCKETS)) - BUCKETS))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return features
+
+    def stats(self):
+        row = self._connection().execute('SELECT COUNT(*) FROM velocity_buckets').fetchone()
+        return {"bucket_rows": row[0]}
+
+
+def parse_limits(spec):
+    """'ip_1m=10,email_1h=5' -> {'ip_1m': 10, 'email_1h': 5}"""
+    limits = {}
+    for item in (spec or "").split(","):
+        name, _, value = item.strip().partition("=")
+        if name:
+            limits[name] = int(value)
+    return limits
+
+
+def exceeded(features, limits):
+    """Names of the windows whose count is over its limit"""
+    return [name for name, limit in limits.items() if features.get(name, 0) > limit]
@@ -0,0 +1,428 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db import transaction
+from features import (PAUSE_THRESHOLD_S, dwell_times, encode_keys, events_to_arrays,
+                      feature_vector, mouse_kinematics)
+from ingest import TRANSIENT_ERRORS
+from session_view import mark_dirty
+
+logger = logging.getLogger(__name__)
+
+# Pause lengths (s) and keystroke intervals (s) are kept as fixed-bin histograms
+PAUSE_BINS = np.array([PAUSE_THRESHOLD_S, 0.25, 0.5, 1.0, 2.0, 5.0, np.inf])
+RHYTHM_BINS = np.array([0.0, 0.02, 0.05, 0.08, 0.12, 0.16, 0.2, 0.3, 0.45, 0.7, 1.0, 2.0, np.inf])
+
+# Raw mouse samples / open keydowns carried between batches so derivatives
+# and dwell times that straddle a batch boundary are still counted
+MOUSE_TAIL = 3
+MAX_OPEN_KEYS = 16
+
+# Rough upper bound on one SessionState, used to turn a memory budget into a session cap
+SESSION_STATE_BYTES = 4096
+
+# Snapshots written per session_features transaction
+FLUSH_BATCH = 500
+
+# /api/events accepts any session_id, so snapshots of sessions that do not
+# exist are skipped here rather than failing the batch on the foreign key
+UPSERT_FEATURES_SQL = """
+    INSERT INTO session_features (session_id, features, updated_at)
+    SELECT v.session_id, v.features, v.updated_at
+    FROM (VALUES %s) AS v (session_id, features, updated_at)
+    JOIN sessions s ON s.session_id = v.session_id
+    ON CONFLICT (session_id) DO UPDATE
+    SET features = EXCLUDED.features, updated_at = EXCLUDED.updated_at
+"""
+UPSERT_FEATURES_TEMPLATE = "(%s::text, %s::json, %s::timestamptz)"
+
+
+class RunningStat:
+    """Welford mean/variance plus max, merged a whole array at a time"""
+
+    __slots__ = ("n", "mean", "m2", "max")
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.max = 0.0
+
+    def update(self, values):
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return
+        n_b = values.size
+        mean_b = float(values.mean())
+        m2_b = float(((values - mean_b) ** 2).sum())
+        n = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta * delta * self.n * n_b / n
+        self.n = n
+        self.max = max(self.max, float(values.max()))
+
+    @property
+    def std(self):
+        return (self.m2 / self.n) ** 0.5 if self.n else 0.0
+
+
+class SessionState:
+    """Running statistics for one session; fixed size regardless of event count"""
+
+    __slots__ = ("velocity", "acceleration", "jerk", "curvature", "interkey", "dwell",
+                 "pause_hist", "pause_total", "rhythm_hist", "dwell_hist", "honeypot_hits",
+                 "mouse_events", "keystrokes", "path_length", "first_point", "mouse_tail",
+                 "first_keydown", "last_keydown", "open_keys", "last_seen")
+
+    def __init__(self):
+        self.velocity = RunningStat()
+        self.acceleration = RunningStat()
+        self.jerk = RunningStat()
+        self.curvature = RunningStat()
+        self.interkey = RunningStat()
+        self.dwell = RunningStat()
+        self.pause_hist = np.zeros(len(PAUSE_BINS) - 1, dtype=np.int64)
+        self.pause_total = 0.0
+        self.rhythm_hist = np.zeros(len(RHYTHM_BINS) - 1, dtype=np.int64)
+        self.dwell_hist = np.zeros(len(RHYTHM_BINS) - 1, dtype=np.int64)
+        self.honeypot_hits = 0
+        self.mouse_events = 0
+        self.keystrokes = 0
+        self.path_length = 0.0
+        self.first_point = None
+        self.mouse_tail = np.empty((0, 3))
+        self.first_keydown = None
+        self.last_keydown = None
+        self.open_keys = (np.empty(0), np.empty(0, dtype=object))
+        self.last_seen = time.monotonic()
+
+    def add_mouse(self, t, x, y, honeypot):
+        self.mouse_events += t.size
+        self.honeypot_hits += int(honeypot.sum())
+        valid = np.isfinite(t) & np.isfinite(x) & np.isfinite(y)
+        order = np.argsort(t[valid], kind="stable")
+        points = np.column_stack((t[valid], x[valid], y[valid]))[order]
+        if points.shape[0] == 0:
+            return
+        if self.first_point is None:
+            self.first_point = points[0]
+
+        # Element i of each derivative array uses samples i .. i+k; skip the
+        # ones built only from carried-over samples (already counted)
+        carried = self.mouse_tail.shape[0]
+        trace = np.vstack((self.mouse_tail, points))
+        self.mouse_tail = trace[-MOUSE_TAIL:]
+        if trace.shape[0] < 2:
+            return
+        k = mouse_kinematics(trace[:, 0], trace[:, 1], trace[:, 2])
+
+        gap = k["gap"][max(carried - 1, 0):]
+        self.path_length += float(k["distance"][max(carried - 1, 0):].sum())
+        self.velocity.update(k["velocity"][max(carried - 1, 0):])
+        self.acceleration.update(np.abs(k["acceleration"][max(carried - 2, 0):]))
+        self.curvature.update(k["curvature"][max(carried - 2, 0):])
+        self.jerk.update(np.abs(k["jerk"][max(carried - 3, 0):]))
+
+        pauses = gap[gap > PAUSE_THRESHOLD_S]
+        self.pause_hist += np.histogram(pauses, PAUSE_BINS)[0]
+        self.pause_total += float(pauses.sum())
+
+    def add_keys(self, t, names, down):
+        open_t, open_names = self.open_keys
+        carried = open_t.size
+        if carried:
+            t = np.concatenate((open_t, t))
+            names = np.concatenate((open_names, names))
+            down = np.concatenate((np.ones(carried, dtype=bool), down))
+        code = encode_keys(names)
+
+        # Carried-over keydowns were counted (and used for interkey) last time
+        down_t = np.sort(t[carried:][down[carried:] & np.isfinite(t[carried:])])
+        if down_t.size:
+            self.keystrokes += down_t.size
+            if self.first_keydown is None:
+                self.first_keydown = float(down_t[0])
+            if self.last_keydown is not None:
+                down_t = np.concatenate(([self.last_keydown], down_t))
+            interkey = np.diff(down_t) / 1000.0
+            self.interkey.update(interkey)
+            self.rhythm_hist += np.histogram(interkey, RHYTHM_BINS)[0]
+            self.last_keydown = float(down_t[-1])
+
+        dwell, still_open = dwell_times(t, code, down)
+        self.dwell.update(dwell)
+        self.dwell_hist += np.histogram(dwell, RHYTHM_BINS)[0]
+        keep = still_open[-MAX_OPEN_KEYS:]
+        self.open_keys = (t[keep], names[keep])
+
+    def snapshot(self):
+        """Current features, keyed like features.FEATURE_NAMES"""
+        pause_count = int(self.pause_hist.sum())
+        straightness = 0.0
+        if self.path_length > 0 and self.first_point is not None:
+            last = self.mouse_tail[-1]
+            straightness = float(np.hypot(last[1] - self.first_point[1], last[2] - self.first_point[2]) / self.path_length)
+        typing_speed = 0.0
+        if self.keystrokes > 1 and self.last_keydown > self.first_keydown:
+            typing_speed = (self.keystrokes - 1) / ((self.last_keydown - self.first_keydown) / 1000.0)
+        return {
+            "movement_speed": self.velocity.mean,
+            "pause_duration": self.pause_total / pause_count if pause_count else 0.0,
+            "honeypot_clicked": float(self.honeypot_hits > 0),
+            "mouse_event_count": float(self.mouse_events),
+            "velocity_mean": self.velocity.mean,
+            "velocity_std": self.velocity.std,
+            "velocity_max": self.velocity.max,
+            "acceleration_mean": self.acceleration.mean,
+            "acceleration_std": self.acceleration.std,
+            "jerk_mean": self.jerk.mean,
+            "jerk_std": self.jerk.std,
+            "curvature_mean": self.curvature.mean,
+            "curvature_std": self.curvature.std,
+            "straightness": straightness,
+            "pause_count": float(pause_count),
+            "pause_total": self.pause_total,
+            "typing_speed": typing_speed,
+            "keystroke_count": float(self.keystrokes),
+            "interkey_mean": self.interkey.mean,
+            "interkey_std": self.interkey.std,
+            "interkey_median": _hist_median(self.rhythm_hist, RHYTHM_BINS, self.interkey.max),
+            "dwell_mean": self.dwell.mean,
+            "dwell_std": self.dwell.std,
+            "dwell_median": _hist_median(self.dwell_hist, RHYTHM_BINS, self.dwell.max),
+            "honeypot_hits": self.honeypot_hits,
+            "pause_histogram": self.pause_hist.tolist(),
+            "rhythm_histogram": self.rhythm_hist.tolist(),
+        }
+
+
+def _hist_median(hist, bins, upper):
+    """Approximate median: midpoint of the bin holding the middle sample"""
+    total = hist.sum()
+    if total == 0:
+        return 0.0
+    i = int(np.searchsorted(np.cumsum(hist), (total + 1) / 2))
+    hi = bins[i + 1] if np.isfinite(bins[i + 1]) else max(upper, bins[i])
+    return float((bins[i] + hi) / 2)
+
+
+def write_session_features(rows):
+    """
+    Upsert (session_id, snapshot) pairs into session_features.
+
+    Only the last snapshot per session is written (ON CONFLICT DO UPDATE
+    cannot touch the same row twice in one statement). If the batch still
+    fails, each snapshot is retried under its own savepoint so only the bad
+    ones are lost. Returns how many snapshots failed.
+    """
+    now = datetime.now(timezone.utc)
+    latest = {session_id: snapshot for session_id, snapshot in rows}
+    values = [(session_id, json.dumps(snapshot), now) for session_id, snapshot in latest.items()]
+    failed = 0
+    with transaction() as cur:
+        cur.execute("SAVEPOINT session_features")
+        try:
+            execute_values(cur, UPSERT_FEATURES_SQL, values, template=UPSERT_FEATURES_TEMPLATE)
+        except TRANSIENT_ERRORS:
+            raise
+        except psycopg2.Error:
+            cur.execute("ROLLBACK TO SAVEPOINT session_features")
+            for value in values:
+                cur.execute("SAVEPOINT session_feature")
+                try:
+                    execute_values(cur, UPSERT_FEATURES_SQL, [value], template=UPSERT_FEATURES_TEMPLATE)
+                except TRANSIENT_ERRORS:
+                    raise
+                except psycopg2.Error as e:
+                    cur.execute("ROLLBACK TO SAVEPOINT session_feature")
+                    failed += 1
+                    logger.warning("session aggregator: dropping snapshot of %r: %s", value[0], e)
+        mark_dirty(cur, list(latest))
+    return failed
+
+
+class SessionAggregator:
+    """
+    In-memory running features per session_id, updated batch by batch.
+
+    Sessions live in an LRU; the least recently updated one is evicted once
+    `max_sessions` is reached, and sessions idle for `ttl_s` expire. Evicted,
+    expired and ended sessions are handed to a background thread that writes
+    their final snapshot to session_features, so the request path never
+    waits on the database.
+
+    At most `max_pending` snapshots wait for that thread; beyond that they
+    are dropped and counted in flush_dropped. close() writes what is still
+    pending plus the current snapshot of every tracked session.
+    """
+
+    def __init__(self, max_sessions=100000, ttl_s=1800, flush=write_session_features, max_pending=50000):
+        self.max_sessions = max_sessions
+        self.ttl_s = ttl_s
+        self.flush = flush
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._flush_queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._closed = False
+        self.evicted = 0
+        self.expired = 0
+        self.flush_failures = 0
+        self.flush_dropped = 0
+
+    @classmethod
+    def from_env(cls):
+        """Build an aggregator from AGG_* environment variables"""
+        max_sessions = int(os.getenv("AGG_MAX_SESSIONS", 100000))
+        memory_mb = os.getenv("AGG_MAX_MEMORY_MB")
+        if memory_mb:
+            max_sessions = min(max_sessions, int(float(memory_mb) * 1024 * 1024 // SESSION_STATE_BYTES))
+        return cls(max_sessions=max_sessions, ttl_s=float(os.getenv("AGG_TTL_S", 1800)),
+                   max_pending=int(os.getenv("AGG_MAX_PENDING_FLUSH", 50000)))
+
+    def update(self, session_id, events):
+        """Fold one /api/events batch into the session's running statistics"""
+        self.update_arrays(session_id, events_to_arrays(events))
+
+    def update_arrays(self, session_id, arrays):
+        """Same as update(), for a batch already decoded by events_to_arrays()"""
+        evicted = []
+        with self._lock:
+            state = self._sessions.get(session_id)
+            if state is None:
+                state = SessionState()
+                self._sessions[session_id] = state
+            else:
+                self._sessions.move_to_end(session_id)
+            state.last_seen = time.monotonic()
+            if arrays["mouse_t"].size:
+                state.add_mouse(arrays["mouse_t"], arrays["mouse_x"], arrays["mouse_y"], arrays["honeypot"])
+            if arrays["key_t"].size:
+                state.add_keys(arrays["key_t"], arrays["key_name"], arrays["key_down"])
+            evicted = self._evict()
+        self._enqueue_flush(evicted)
+
+    def snapshot(self, session_id):
+        """Current feature dict for a session, or None if it is not tracked"""
+        with self._lock:
+            state = self._sessions.get(session_id)
+            return state.snapshot() if state is not None else None
+
+    def vector(self, session_id):
+        """Current features as a FEATURE_NAMES-ordered float32 vector, or None"""
+        snapshot = self.snapshot(session_id)
+        return feature_vector(snapshot) if snapshot is not None else None
+
+    def end_session(self, session_id):
+        """Stop tracking a session and persist its final snapshot"""
+        with self._lock:
+            state = self._sessions.pop(session_id, None)
+        if state is not None:
+            self._enqueue_flush([(session_id, state.snapshot())])
+
+    def stats(self):
+        with self._lock:
+            tracked = len(self._sessions)
+        return {
+            "sessions": tracked,
+            "max_sessions": self.max_sessions,
+            "approx_memory_bytes": tracked * SESSION_STATE_BYTES,
+            "evicted": self.evicted,
+            "expired": self.expired,
+            "pending_flush": self._flush_queue.qsize(),
+            "flush_failures": self.flush_failures,
+            "flush_dropped": self.flush_dropped,
+        }
+
+    def close(self, timeout=10.0):
+        """Write pending and still-tracked snapshots; later flushes are written inline"""
+        with self._lock:
+            rows = [(session_id, state.snapshot()) for session_id, state in self._sessions.items()]
+            self._sessions.clear()
+        with self._thread_lock:
+            self._closed = True
+            thread = self._thread
+        if thread is not None and thread.is_alive():
+            # The thread finishes the batch it is writing and exits at the sentinel
+            try:
+                self._flush_queue.put(None, timeout=timeout)
+                thread.join(timeout)
+            except queue.Full:
+                pass
+        while True:
+            try:
+                row = self._flush_queue.get_nowait()
+            except queue.Empty:
+                break
+            if row is not None:
+                rows.append(row)
+        for start in range(0, len(rows), FLUSH_BATCH):
+            self._write(rows[start:start + FLUSH_BATCH])
+
+    def _evict(self):
+        # Caller holds self._lock. The OrderedDict is in last-update order,
+        # so both expired and over-cap sessions are at the front.
+        evicted = []
+        now = time.monotonic()
+        while self._sessions:
+            session_id, state = next(iter(self._sessions.items()))
+            if now - state.last_seen > self.ttl_s:
+                self.expired += 1
+            elif len(self._sessions) > self.max_sessions:
+                self.evicted += 1
+            else:
+                break
+            self._sessions.popitem(last=False)
+            evicted.append((session_id, state.snapshot()))
+        return evicted
+
+    def _enqueue_flush(self, rows):
+        if not rows:
+            return
+        with self._thread_lock:
+            if self._closed:
+                self._write(rows)
+                return
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run_flush, name="session-flush", daemon=True)
+                self._thread.start()
+        for row in rows:
+            try:
+                self._flush_queue.put_nowait(row)
+            except queue.Full:
+                self.flush_dropped += 1
+
+    def _run_flush(self):
+        while True:
+            rows = [self._flush_queue.get()]
+            while len(rows) < FLUSH_BATCH and rows[-1] is not None:
+                try:
+                    rows.append(self._flush_queue.get_nowait())
+                except queue.Empty:
+                    break
+            stopping = rows[-1] is None
+            if stopping:
+                rows.pop()
+            if rows:
+                self._write(rows)
+            if stopping:
+                return
+
+    def _write(self, rows):
+        try:
+            self.flush_failures += self.flush(rows) or 0
+        except Exception as e:
+            self.flush_failures += len(rows)
+            logger.error("session aggregator: flush of %d sessions failed: %s", len(rows), e)
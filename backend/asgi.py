@@ -0,0 +1,141 @@
+"""
+Async entry point for telemetry ingestion.
+
+Serves the same GET / and POST /api/events contract as the Flask app in
+main.py, on a single asyncio event loop, so thousands of open telemetry
+connections do not each need a worker thread. Everything else stays on
+the Flask app. Bodies are checked by event_codec.parse_batch() like
+there, batches go to the spool when INGEST_SPOOL_DIR is set, and the
+session aggregator is kept up to date the same way.
+
+    uvicorn asgi:app --port 8081
+    python asgi.py
+"""
+import asyncio
+import json
+import os
+
+from aggregator import SessionAggregator
+from async_ingest import writer_from_env
+from event_codec import UnsupportedEncoding, decode_body, parse_batch
+from ingest import QueueFull
+
+MAX_BODY_BYTES = int(os.getenv("INGEST_MAX_BODY_BYTES", 1024 * 1024))
+
+event_writer = writer_from_env()
+session_aggregator = SessionAggregator.from_env()
+
+
+async def _respond(send, status, body, content_type="application/json"):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type.encode()),
+            (b"content-length", str(len(body)).encode()),
+            (b"access-control-allow-origin", b"*"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive):
+    chunks = []
+    size = 0
+    while True:
+        message = await receive()
+        chunk = message.get("body", b"")
+        size += len(chunk)
+        if size > MAX_BODY_BYTES:
+            return None
+        chunks.append(chunk)
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await event_writer.start()
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await event_writer.stop()
+            await asyncio.to_thread(session_aggregator.close)
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+def _header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+async def events(scope, receive, send):
+    body = await _read_body(receive)
+    if body is None:
+        return await _respond(send, 413, {"error": "Request body too large"})
+    try:
+        data = decode_body(body, _header(scope, b"content-encoding"), _header(scope, b"content-type"))
+    except UnsupportedEncoding as e:
+        return await _respond(send, 415, {"error": str(e)})
+    except ValueError:
+        data = {}
+
+    try:
+        session_id, events, arrays, count = parse_batch(data)
+    except ValueError as e:
+        return await _respond(send, 400, {"error": str(e)})
+
+    try:
+        if arrays is not None:
+            queued = await event_writer.submit_arrays(session_id, arrays)
+        else:
+            queued = await event_writer.submit(session_id, events)
+    except QueueFull:
+        return await _respond(send, 503, {"error": "Event queue is full, retry later"})
+
+    if arrays is not None:
+        session_aggregator.update_arrays(session_id, arrays)
+    else:
+        session_aggregator.update(session_id, events)
+
+    await _respond(send, 202, {"status": "ok" if queued else "dropped", "events": count})
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        await send({
+            "type": "http.response.start",
+            "status": 204,
+            "headers": [
+                (b"access-control-allow-origin", b"*"),
+                (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+                (b"access-control-allow-headers", b"Content-Type, Content-Encoding"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": b""})
+    elif path == "/" and method == "GET":
+        await _respond(send, 200, b"Hello, World", "text/html; charset=utf-8")
+    elif path == "/api/events" and method == "POST":
+        await events(scope, receive, send)
+    elif path == "/api/events/stats" and method == "GET":
+        await _respond(send, 200, event_writer.stats())
+    else:
+        await _respond(send, 404, {"error": "Not found"})
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run("asgi:app", port=int(os.getenv("ASGI_PORT", 8081)), log_level="warning")
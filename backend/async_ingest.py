@@ -0,0 +1,235 @@
+import asyncio
+import os
+import time
+
+import asyncpg
+
+from db import connect_kwargs
+from ingest import BatchWriter, flatten, settings_from_env, split_arrays, split_events
+
+# One statement per table: parallel arrays are unnested server-side, so a
+# flush is two round trips no matter how many rows it carries. Ids already
+# in telemetry_event_ids are skipped, as in ingest.insert_rows()
+INSERT_MOUSE = """
+    WITH v AS (
+        SELECT * FROM unnest($1::text[], $2::text[], $3::real[], $4::real[], $5::boolean[])
+            AS v (session_id, mouse_event_id, movement_speed, pause_duration, honeypot_clicked)
+    ), new AS (
+        INSERT INTO telemetry_event_ids (kind, event_id)
+        SELECT 'mouse', mouse_event_id FROM v
+        ON CONFLICT DO NOTHING
+        RETURNING event_id
+    )
+    INSERT INTO mouseDynamics (session_id, mouse_event_id, movement_speed, pause_duration, honeypot_clicked)
+    SELECT v.* FROM v JOIN new ON new.event_id = v.mouse_event_id
+    ON CONFLICT DO NOTHING
+"""
+INSERT_KEYSTROKE = """
+    WITH v AS (
+        SELECT * FROM unnest($1::text[], $2::text[], $3::real[])
+            AS v (session_id, keystroke_id, typing_speed)
+    ), new AS (
+        INSERT INTO telemetry_event_ids (kind, event_id)
+        SELECT 'keystroke', keystroke_id FROM v
+        ON CONFLICT DO NOTHING
+        RETURNING event_id
+    )
+    INSERT INTO keystrokeDynamics (session_id, keystroke_id, typing_speed)
+    SELECT v.* FROM v JOIN new ON new.event_id = v.keystroke_id
+    ON CONFLICT DO NOTHING
+"""
+# Lost connections, server restarts and shutdowns; retried like ingest.TRANSIENT_ERRORS
+TRANSIENT_ERRORS = (OSError, asyncio.TimeoutError, asyncpg.PostgresConnectionError,
+                    asyncpg.InterfaceError, asyncpg.exceptions.OperatorInterventionError)
+
+# Same as session_view.mark_dirty()
+MARK_DIRTY = """
+    INSERT INTO session_feature_dirty (session_id)
+    SELECT unnest($1::text[])
+    ON CONFLICT DO NOTHING
+"""
+
+
+class AsyncEventWriter(BatchWriter):
+    """
+    asyncio counterpart of ingest.EventWriter.
+
+    Same INGEST_* settings, backpressure policies, retries and stats (see
+    ingest.BatchWriter); the queue is an asyncio.Queue and the flusher is a
+    task on the event loop writing through an asyncpg pool, so no request
+    ever holds a thread while waiting on the database.
+    """
+
+    name = "async event writer"
+
+    def __init__(self, max_batches=10000, pool_max=10, **settings):
+        super().__init__(max_batches, **settings)
+        self.pool_max = pool_max
+        self.queue = None
+        self._pool = None
+        self._task = None
+
+    @classmethod
+    def from_env(cls):
+        return cls(pool_max=int(os.getenv("DB_POOL_MAX", 10)), **settings_from_env())
+
+    async def start(self):
+        self.queue = asyncio.Queue(maxsize=self.max_batches)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Flush whatever is still queued, then close the pool"""
+        if self._task is not None:
+            await self.queue.join()
+            self._task.cancel()
+        if self._pool is not None:
+            await self._pool.close()
+
+    async def submit(self, session_id, events):
+        """Same contract as EventWriter.submit()"""
+        return await self._enqueue(session_id, *split_events(session_id, events))
+
+    async def submit_arrays(self, session_id, arrays):
+        """Same contract as EventWriter.submit_arrays()"""
+        return await self._enqueue(session_id, *split_arrays(arrays))
+
+    def queue_depth(self):
+        return self.queue.qsize() if self.queue is not None else 0
+
+    async def _enqueue(self, session_id, mouse_rows, key_rows):
+        if not mouse_rows and not key_rows:
+            return True
+        item = (session_id, mouse_rows, key_rows)
+        try:
+            if self.backpressure == "block":
+                await asyncio.wait_for(self.queue.put(item), self.block_timeout_ms / 1000)
+            else:
+                self.queue.put_nowait(item)
+        except (asyncio.QueueFull, asyncio.TimeoutError):
+            return self._full()
+        self._bump("batches_enqueued")
+        return True
+
+    async def _get_pool(self):
+        if self._pool is None:
+            kwargs = connect_kwargs()
+            self._pool = await asyncpg.create_pool(
+                host=kwargs["host"], database=kwargs["dbname"], user=kwargs["user"],
+                password=kwargs["password"], port=kwargs["port"],
+                min_size=1, max_size=self.pool_max,
+                command_timeout=float(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000)) / 1000
+            )
+        return self._pool
+
+    async def _run(self):
+        pending = []
+        pending_rows = 0
+        oldest = None
+        while True:
+            try:
+                item = await asyncio.wait_for(self.queue.get(), self._flush_timeout(oldest))
+                pending.append(item)
+                pending_rows += len(item[1]) + len(item[2])
+                if oldest is None:
+                    oldest = time.monotonic()
+            except asyncio.TimeoutError:
+                pass
+
+            if pending and self._flush_due(pending_rows, oldest):
+                await self._flush(pending)
+                for _ in pending:
+                    self.queue.task_done()
+                pending = []
+                pending_rows = 0
+                oldest = None
+
+    async def _flush(self, batches):
+        started = time.perf_counter()
+        per_batch = False
+        attempt = 0
+        while True:
+            try:
+                pool = await self._get_pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        if per_batch:
+                            written, failed = await self._write_per_batch(conn, batches)
+                        else:
+                            await self._write(conn, batches)
+                            written, failed = batches, []
+                break
+            except TRANSIENT_ERRORS as e:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    return self._lost(batches, e)
+                await asyncio.sleep(delay)
+                attempt += 1
+            except Exception as e:
+                if per_batch:
+                    return self._lost(batches, e)
+                # Find the bad batches instead of losing everyone's rows
+                per_batch = True
+        self._flushed(written, failed, started)
+
+    async def _write(self, conn, batches):
+        mouse_rows, key_rows = flatten(batches)
+        if mouse_rows:
+            await conn.execute(INSERT_MOUSE, *(list(column) for column in zip(*mouse_rows)))
+        if key_rows:
+            await conn.execute(INSERT_KEYSTROKE, *(list(column) for column in zip(*key_rows)))
+        await conn.execute(MARK_DIRTY, sorted({session_id for session_id, _, _ in batches}))
+
+    async def _write_per_batch(self, conn, batches):
+        """Write each batch in a nested transaction (savepoint); returns (written, failed) batches"""
+        written = []
+        failed = []
+        for batch in batches:
+            try:
+                async with conn.transaction():
+                    await self._write(conn, [batch])
+            except TRANSIENT_ERRORS:
+                raise
+            except asyncpg.PostgresError as e:
+                self._dropped_batch(batch, e, failed)
+            else:
+                written.append(batch)
+        return written, failed
+
+
+class AsyncSpoolWriter:
+    """
+    spool.SpoolWriter behind AsyncEventWriter's interface. Appends only
+    write to the page cache under a short lock (fsyncs run on the spool's
+    own thread), so they are called on the event loop directly.
+    """
+
+    def __init__(self, spool):
+        self.spool = spool
+
+    @classmethod
+    def from_env(cls):
+        from spool import SpoolWriter
+
+        return cls(SpoolWriter.from_env())
+
+    async def start(self):
+        self.spool.start()
+
+    async def stop(self):
+        await asyncio.to_thread(self.spool.stop)
+
+    async def submit(self, session_id, events):
+        return self.spool.submit(session_id, events)
+
+    async def submit_arrays(self, session_id, arrays):
+        return self.spool.submit_arrays(session_id, arrays)
+
+    def stats(self):
+        return self.spool.stats()
+
+
+def writer_from_env():
+    """The spool when INGEST_SPOOL_DIR is set, else an AsyncEventWriter (as in routes.init_app())"""
+    if os.getenv("INGEST_SPOOL_DIR"):
+        return AsyncSpoolWriter.from_env()
+    return AsyncEventWriter.from_env()
@@ -0,0 +1,225 @@
+"""
+Roll raw mouse/keystroke rows of finished sessions up into session_rollups
+and remove the raw rows.
+
+    python compact.py [--batch-size 500] [--grace-minutes 30] [--archive]
+        [--max-rows-per-s 0] [--pause-ms 0] [--max-batches 0] [--job default]
+
+Sessions are taken in (session_end_time, session_id) order among those with
+session_status = 'ended' that ended more than --grace-minutes ago (late
+events can still arrive right after a session ends). Each batch — rollup
+upsert, raw row removal and checkpoint update — is one transaction, so the
+job can be stopped at any point and rerun; it continues after the last
+committed session. With --archive the raw rows are moved to
+mousedynamics_archive / keystrokedynamics_archive instead of deleted.
+
+A session that already has a rollup (rows that arrived after it was
+compacted, picked up by another --job) has the new rows merged into it:
+counts add up, means are weighted by event counts, standard deviations
+are pooled, and maxima and first/last times are combined.
+
+--max-rows-per-s and --pause-ms throttle the job so it can run next to live
+traffic without saturating I/O or autovacuum.
+"""
+import argparse
+import time
+from datetime import datetime, timedelta, timezone
+
+from db import transaction
+
+
+# The existing rollup row and the one being inserted, in ON CONFLICT DO UPDATE
+_SIDES = ("session_rollups", "EXCLUDED")
+
+
+def _merged(column, expression):
+    # Either side's value when the other is NULL, else `expression`
+    old, new = (f"{side}.{column}" for side in _SIDES)
+    return f"CASE WHEN {old} IS NULL THEN {new} WHEN {new} IS NULL THEN {old} ELSE {expression} END"
+
+
+def _merged_mean(avg, count):
+    # Event counts stand in for the number of non-null values behind each mean
+    total = " + ".join(f"{side}.{count}" for side in _SIDES)
+    weighted = " + ".join(f"{side}.{count} * {side}.{avg}" for side in _SIDES)
+    return _merged(avg, f"({weighted}) / NULLIF({total}, 0)")
+
+
+def _merged_std(std, avg, count):
+    # Pooled population std: each side's variance plus the offset of its mean from the merged one
+    mean = _merged_mean(avg, count)
+    total = " + ".join(f"{side}.{count}" for side in _SIDES)
+    spread = " + ".join(f"{side}.{count} * ({side}.{std} ^ 2 + ({side}.{avg} - ({mean})) ^ 2)" for side in _SIDES)
+    return _merged(std, f"sqrt(({spread}) / NULLIF({total}, 0))")
+
+
+ROLLUP_SQL = """
+    WITH m AS (
+        SELECT session_id,
+               count(*) AS mouse_events,
+               count(*) FILTER (WHERE honeypot_clicked) AS honeypot_clicks,
+               avg(movement_speed) AS speed_avg,
+               stddev_pop(movement_speed) AS speed_std,
+               max(movement_speed) AS speed_max,
+               avg(pause_duration) AS pause_avg,
+               max(pause_duration) AS pause_max,
+               min(event_time) AS first_time,
+               max(event_time) AS last_time
+        FROM mouseDynamics
+        WHERE session_id = ANY(%(ids)s)
+        GROUP BY session_id
+    ), k AS (
+        SELECT session_id,
+               count(*) AS keystrokes,
+               avg(typing_speed) AS typing_avg,
+               stddev_pop(typing_speed) AS typing_std,
+               min(event_time) AS first_time,
+               max(event_time) AS last_time
+        FROM keystrokeDynamics
+        WHERE session_id = ANY(%(ids)s)
+        GROUP BY session_id
+    )
+    INSERT INTO session_rollups (
+        session_id, mouse_events, honeypot_clicks,
+        movement_speed_avg, movement_speed_std, movement_speed_max,
+        pause_duration_avg, pause_duration_max,
+        keystrokes, typing_speed_avg, typing_speed_std,
+        first_event_time, last_event_time, compacted_at
+    )
+    SELECT COALESCE(m.session_id, k.session_id),
+           COALESCE(m.mouse_events, 0), COALESCE(m.honeypot_clicks, 0),
+           m.speed_avg, m.speed_std, m.speed_max,
+           m.pause_avg, m.pause_max,
+           COALESCE(k.keystrokes, 0), k.typing_avg, k.typing_std,
+           LEAST(m.first_time, k.first_time), GREATEST(m.last_time, k.last_time), now()
+    FROM m FULL JOIN k ON k.session_id = m.session_id
+    ON CONFLICT (session_id) DO UPDATE SET
+        mouse_events = session_rollups.mouse_events + EXCLUDED.mouse_events,
+        honeypot_clicks = session_rollups.honeypot_clicks + EXCLUDED.honeypot_clicks,
+        movement_speed_avg = {speed_avg},
+        movement_speed_std = {speed_std},
+        movement_speed_max = GREATEST(session_rollups.movement_speed_max, EXCLUDED.movement_speed_max),
+        pause_duration_avg = {pause_avg},
+        pause_duration_max = GREATEST(session_rollups.pause_duration_max, EXCLUDED.pause_duration_max),
+        keystrokes = session_rollups.keystrokes + EXCLUDED.keystrokes,
+        typing_speed_avg = {typing_avg},
+        typing_speed_std = {typing_std},
+        first_event_time = LEAST(session_rollups.first_event_time, EXCLUDED.first_event_time),
+        last_event_time = GREATEST(session_rollups.last_event_time, EXCLUDED.last_event_time),
+        compacted_at = EXCLUDED.compacted_at
+""".format(
+    speed_avg=_merged_mean("movement_speed_avg", "mouse_events"),
+    speed_std=_merged_std("movement_speed_std", "movement_speed_avg", "mouse_events"),
+    pause_avg=_merged_mean("pause_duration_avg", "mouse_events"),
+    typing_avg=_merged_mean("typing_speed_avg", "keystrokes"),
+    typing_std=_merged_std("typing_speed_std", "typing_speed_avg", "keystrokes"),
+)
+
+# (raw table, archive table, legacy link table)
+RAW_TABLES = [
+    ("mouseDynamics", "mousedynamics_archive", "s_mouse"),
+    ("keystrokeDynamics", "keystrokedynamics_archive", "s_keystroke"),
+]
+
+
+def load_checkpoint(cur, job):
+    cur.execute("""
+        SELECT session_end_time, session_id, sessions_done, rows_removed
+        FROM compaction_checkpoints WHERE job = %s
+    """, (job,))
+    row = cur.fetchone()
+    if row is None:
+        return datetime.min.replace(tzinfo=timezone.utc), "", 0, 0
+    return row
+
+
+def compact_batch(job, batch_size, grace, archive):
+    """
+    Compact the next batch of finished sessions.
+
+    Returns (sessions, raw rows removed); (0, 0) once everything that
+    has finished is compacted.
+    """
+    with transaction() as cur:
+        after_time, after_id, sessions_done, rows_removed = load_checkpoint(cur, job)
+        cur.execute("""
+            SELECT session_id, session_end_time
+            FROM sessions
+            WHERE session_status = 'ended'
+              AND session_end_time < %s
+              AND (session_end_time, session_id) > (%s, %s)
+            ORDER BY session_end_time, session_id
+            LIMIT %s
+        """, (datetime.now(timezone.utc) - grace, after_time, after_id, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return 0, 0
+
+        ids = [session_id for session_id, _ in rows]
+        cur.execute(ROLLUP_SQL, {"ids": ids})
+
+        removed = 0
+        for table, archive_table, link_table in RAW_TABLES:
+            if archive:
+                cur.execute(f"""
+                    WITH moved AS (DELETE FROM {table} WHERE session_id = ANY(%s) RETURNING *)
+                    INSERT INTO {archive_table} SELECT * FROM moved
+                """, (ids,))
+            else:
+                cur.execute(f"DELETE FROM {table} WHERE session_id = ANY(%s)", (ids,))
+            removed += cur.rowcount
+            cur.execute(f"DELETE FROM {link_table} WHERE session_id = ANY(%s)", (ids,))
+
+        last_id, last_time = rows[-1]
+        cur.execute("""
+            INSERT INTO compaction_checkpoints (job, session_end_time, session_id, sessions_done, rows_removed, updated_at)
+            VALUES (%s, %s, %s, %s, %s, now())
+            ON CONFLICT (job) DO UPDATE SET
+                session_end_time = EXCLUDED.session_end_time,
+                session_id = EXCLUDED.session_id,
+                sessions_done = EXCLUDED.sessions_done,
+                rows_removed = EXCLUDED.rows_removed,
+                updated_at = EXCLUDED.updated_at
+        """, (job, last_time, last_id, sessions_done + len(rows), rows_removed + removed))
+        return len(rows), removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=500, help="sessions per transaction")
+    parser.add_argument("--grace-minutes", type=float, default=30, help="skip sessions that ended more recently")
+    parser.add_argument("--archive", action="store_true", help="move raw rows to the *_archive tables")
+    parser.add_argument("--max-rows-per-s", type=float, default=0, help="raw rows removed per second (0 = no limit)")
+    parser.add_argument("--pause-ms", type=float, default=0, help="sleep between batches")
+    parser.add_argument("--max-batches", type=int, default=0, help="stop after this many batches (0 = until done)")
+    parser.add_argument("--job", default="default", help="checkpoint name")
+    args = parser.parse_args()
+
+    grace = timedelta(minutes=args.grace_minutes)
+    started = time.perf_counter()
+    total_sessions = total_rows = batches = 0
+    while True:
+        sessions, removed = compact_batch(args.job, args.batch_size, grace, args.archive)
+        if sessions == 0:
+            break
+        batches += 1
+        total_sessions += sessions
+        total_rows += removed
+        elapsed = time.perf_counter() - started
+        print(f"Compacted {total_sessions} sessions, {total_rows} raw rows "
+              f"({total_rows / elapsed:.0f} rows/s)")
+        if args.max_batches and batches >= args.max_batches:
+            break
+
+        delay = args.pause_ms / 1000
+        if args.max_rows_per_s:
+            # Sleep until the running average is back under the limit
+            delay = max(delay, total_rows / args.max_rows_per_s - (time.perf_counter() - started))
+        if delay > 0:
+            time.sleep(delay)
+    print(f"Done: {total_sessions} sessions compacted, {total_rows} raw rows "
+          f"{'archived' if args.archive else 'deleted'}")
+
+
+if __name__ == "__main__":
+    main()
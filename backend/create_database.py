@@ -1,18 +1,10 @@
-import psycopg2
-from dotenv import load_dotenv, dotenv_values
-import os
+import logging
 
+from db import get_connection
+from migrations import migrate
 
-load_dotenv()
-psql_password = os.getenv("PSQL_PASSWORD") #Update your .env file with PSQL_PASSWORD=insert_password_here
-
-connection = psycopg2.connect(
-    host="localhost",
-    dbname="postgres",
-    user="postgres",
-    password=psql_password,
-    port=5432
-)
+#Update your .env file with PSQL_PASSWORD=insert_password_here
+connection = get_connection()
 
 cursor = connection.cursor()
 
@@ -42,10 +34,17 @@ cursor.execute("""CREATE TABLE IF NOT EXISTS rl_experience (
     action_taken TEXT,
     reward REAL,
     next_state JSON,
+    state_bin BYTEA,
+    next_state_bin BYTEA,
     FOREIGN KEY (session_id) REFERENCES sessions(session_id)
 );
 """)
 
+# Packed float32 state vectors (see state_codec.py); run
+# migrate_states.py to convert rows created before these columns existed
+cursor.execute("ALTER TABLE rl_experience ADD COLUMN IF NOT EXISTS state_bin BYTEA")
+cursor.execute("ALTER TABLE rl_experience ADD COLUMN IF NOT EXISTS next_state_bin BYTEA")
+
 cursor.execute("""CREATE TABLE IF NOT EXISTS mouseDynamics (
     mouse_event_id TEXT PRIMARY KEY,
     movement_speed REAL,
@@ -94,7 +93,20 @@ cursor.execute("""CREATE TABLE IF NOT EXISTS s_challenge (
 );
 """)
 
-connection.commit()
+cursor.execute("""CREATE TABLE IF NOT EXISTS session_features (
+    session_id TEXT PRIMARY KEY,
+    features JSON,
+    updated_at TEXT,
+    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+);
+""")
 
+connection.commit()
 cursor.close()
+
+# Everything after the original schema (timestamptz columns, partitioned
+# telemetry tables, indexes) lives in versioned migrations
+logging.basicConfig(level=logging.INFO, format="%(message)s")
+migrate(connection)
+
 connection.close()
\ No newline at end of file
@@ -0,0 +1,188 @@
+import psycopg2
+import os
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+from psycopg2.pool import ThreadedConnectionPool
+
+from metrics import TimedCursor
+
+load_dotenv()
+
+
+def connect_kwargs():
+    """Connection settings shared by the pool and one-off scripts"""
+    return dict(
+        host=os.getenv("PSQL_HOST", "localhost"),
+        dbname=os.getenv("PSQL_DBNAME", "postgres"),
+        user=os.getenv("PSQL_USER", "postgres"),
+        password=os.getenv("PSQL_PASSWORD"),
+        port=int(os.getenv("PSQL_PORT", 5432))
+    )
+
+
+def get_connection():
+    """Open a standalone connection (for scripts; the app should use the pool)"""
+    return psycopg2.connect(**connect_kwargs())
+
+
+class PoolTimeout(Exception):
+    """Raised when no pooled connection frees up within the checkout timeout"""
+
+
+class ConnectionPool:
+    """
+    Thread-safe Postgres pool shared by every route and background worker.
+
+    psycopg2's ThreadedConnectionPool raises as soon as it is exhausted, so
+    callers wait on a semaphore sized to `maxconn` instead; the time spent
+    waiting is what shows up as `wait_ms` in stats(). Connections that have
+    been idle longer than `health_check_s` are pinged before being handed out
+    and replaced if the ping fails.
+    """
+
+    def __init__(self, minconn=1, maxconn=10, statement_timeout_ms=5000,
+                 checkout_timeout_s=5.0, health_check_s=30.0, **kwargs):
+        if statement_timeout_ms:
+            kwargs["options"] = f"-c statement_timeout={int(statement_timeout_ms)}"
+        kwargs.setdefault("cursor_factory", TimedCursor)
+        self.maxconn = maxconn
+        self.checkout_timeout_s = checkout_timeout_s
+        self.health_check_s = health_check_s
+        self._pool = ThreadedConnectionPool(minconn, maxconn, **kwargs)
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "checkout_timeouts": 0,
+            "health_check_failures": 0,
+            "in_use": 0,
+            "max_in_use": 0,
+            "wait_ms_total": 0.0,
+            "wait_ms_max": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Build a pool from PSQL_* and DB_POOL_* environment variables"""
+        return cls(
+            minconn=int(os.getenv("DB_POOL_MIN", 1)),
+            maxconn=int(os.getenv("DB_POOL_MAX", 10)),
+            statement_timeout_ms=int(os.getenv("DB_STATEMENT_TIMEOUT_MS", 5000)),
+            checkout_timeout_s=float(os.getenv("DB_POOL_TIMEOUT_S", 5.0)),
+            health_check_s=float(os.getenv("DB_POOL_HEALTH_CHECK_S", 30.0)),
+            **connect_kwargs()
+        )
+
+    def getconn(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.checkout_timeout_s):
+            with self._lock:
+                self._stats["checkout_timeouts"] += 1
+            raise PoolTimeout(f"No database connection available after {self.checkout_timeout_s}s")
+        waited_ms = (time.perf_counter() - started) * 1000
+
+        try:
+            conn = self._checkout_healthy()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["max_in_use"] = max(self._stats["max_in_use"], self._stats["in_use"])
+            self._stats["wait_ms_total"] += waited_ms
+            self._stats["wait_ms_max"] = max(self._stats["wait_ms_max"], waited_ms)
+        return conn
+
+    def putconn(self, conn, close=False):
+        with self._lock:
+            self._stats["in_use"] -= 1
+            self._last_used[id(conn)] = time.monotonic()
+        try:
+            if close or conn.closed:
+                self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=close or bool(conn.closed))
+        finally:
+            self._slots.release()
+
+    def _checkout_healthy(self):
+        conn = self._pool.getconn()
+        last_used = self._last_used.get(id(conn))
+        stale = last_used is None or time.monotonic() - last_used > self.health_check_s
+        if not conn.closed and not stale:
+            return conn
+        try:
+            if conn.closed:
+                raise psycopg2.InterfaceError("connection already closed")
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return conn
+        except psycopg2.Error:
+            with self._lock:
+                self._stats["health_check_failures"] += 1
+            self._last_used.pop(id(conn), None)
+            self._pool.putconn(conn, close=True)
+            return self._pool.getconn()
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; it goes back to the pool on exit"""
+        conn = self.getconn()
+        broken = False
+        try:
+            yield conn
+        except psycopg2.OperationalError:
+            broken = True
+            raise
+        finally:
+            if not broken and not conn.closed:
+                conn.rollback()
+            self.putconn(conn, close=broken)
+
+    @contextmanager
+    def transaction(self):
+        """Yield a cursor; commit on success, roll back on any exception"""
+        with self.connection() as conn:
+            try:
+                with conn.cursor() as cur:
+                    yield cur
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        checkouts = stats["checkouts"]
+        stats["wait_ms_avg"] = stats["wait_ms_total"] / checkouts if checkouts else 0.0
+        stats["max_size"] = self.maxconn
+        stats["utilization"] = stats["in_use"] / self.maxconn
+        return stats
+
+    def close(self):
+        self._pool.closeall()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Return the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool.from_env()
+    return _pool
+
+
+def transaction():
+    return get_pool().transaction()
@@ -0,0 +1,249 @@
+"""
+Wire formats accepted by /api/events.
+
+Bodies may be gzip- or deflate-compressed (Content-Encoding) and either JSON
+or MessagePack (Content-Type application/msgpack). Besides the original
+{"session_id", "events": [{...}, ...]} shape, a columnar batch is accepted:
+
+    {
+      "session_id": "abc",
+      "format": "columnar/v1",
+      "types": ["mousemove", "click", "keydown", "keyup"],  # lookup table
+      "type": [0, 0, 1, 2, 3],     # per event, index into "types"
+      "t": [171234, 16, 17, ...],  # first value absolute, then deltas (ms)
+      "x": [310, 4, -2, ...],      # same for x and y (px); key events send 0
+      "y": [122, 1, 0, ...],
+      "key": ["a", "a"],           # one entry per key event, in order
+      "honeypot": [1]              # optional: indices of honeypot events
+    }
+
+In MessagePack bodies "t", "x" and "y" may also be bin fields holding
+little-endian int32 deltas. Columnar batches are decoded straight into the
+arrays features.events_to_arrays() returns, without per-event dicts.
+
+parse_batch() is the one place a decoded body is checked: anything it
+rejects raises ValueError and becomes a 400 instead of failing deeper in
+the ingest or scoring path.
+"""
+import json
+import math
+import zlib
+
+import numpy as np
+
+from features import KEY_EVENT_TYPES, MOUSE_EVENT_TYPES, encode_keys
+
+COLUMNAR_FORMAT = "columnar/v1"
+MSGPACK_TYPES = {"application/msgpack", "application/x-msgpack", "application/vnd.msgpack"}
+
+# zlib wbits per Content-Encoding; 47 accepts both zlib- and gzip-wrapped data
+_WBITS = {"gzip": 31, "x-gzip": 31, "deflate": 47}
+
+# Event fields coerced by validate_events(); other fields pass through untouched
+NUMERIC_FIELDS = ("t", "x", "y", "movement_speed", "pause_duration", "typing_speed")
+STRING_FIELDS = ("type", "key", "mouse_event_id", "keystroke_id")
+
+
+class UnsupportedEncoding(Exception):
+    """Content-Encoding or Content-Type this server cannot decode (HTTP 415)"""
+
+
+def decompress(body, content_encoding, max_bytes):
+    """Undo Content-Encoding; raises ValueError past max_bytes or on corrupt data"""
+    encoding = (content_encoding or "identity").strip().lower()
+    if encoding == "identity":
+        return body
+    if encoding not in _WBITS:
+        raise UnsupportedEncoding(f"Unsupported Content-Encoding: {encoding}")
+    wbits = _WBITS[encoding]
+    if encoding == "deflate" and body[:1] not in (b"\x78", b"\x1f"):
+        wbits = -15  # raw deflate stream without a zlib header
+    try:
+        decompressor = zlib.decompressobj(wbits)
+        data = decompressor.decompress(body, max_bytes)
+        if decompressor.unconsumed_tail:
+            raise ValueError("Decompressed body too large")
+        return data
+    except zlib.error as e:
+        raise ValueError(f"Corrupt {encoding} body: {e}")
+
+
+def decode_body(body, content_encoding=None, content_type=None, max_bytes=16 * 1024 * 1024):
+    """
+    Parse a raw /api/events body into a dict.
+
+    Raises UnsupportedEncoding for encodings or types it cannot handle and
+    ValueError for malformed bodies.
+    """
+    body = decompress(body, content_encoding, max_bytes)
+    if not body:
+        return {}
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+    if mimetype in MSGPACK_TYPES:
+        try:
+            import msgpack
+        except ImportError:
+            raise UnsupportedEncoding("MessagePack bodies need the msgpack package")
+        try:
+            data = msgpack.unpackb(body, raw=False)
+        except Exception as e:
+            raise ValueError(f"Invalid MessagePack body: {e}")
+    else:
+        data = json.loads(body)
+    if not isinstance(data, dict):
+        raise ValueError("Body must be an object")
+    return data
+
+
+def is_columnar(data):
+    return data.get("format") == COLUMNAR_FORMAT
+
+
+def _number(value, name, i):
+    if isinstance(value, bool) or not isinstance(value, (int, float, str)):
+        raise ValueError(f"event {i}: '{name}' must be a number")
+    try:
+        number = float(value)
+    except ValueError:
+        raise ValueError(f"event {i}: '{name}' must be a number")
+    if not math.isfinite(number):
+        raise ValueError(f"event {i}: '{name}' must be finite")
+    return number
+
+
+def validate_events(events):
+    """
+    Check a JSON "events" list and return coerced copies of its events.
+
+    Numeric fields become floats (null ones are dropped, so they are derived
+    like missing ones), honeypot_clicked a bool, and type, key and the ids
+    must be strings. Raises ValueError naming the first bad event.
+    """
+    if not isinstance(events, list):
+        raise ValueError("'events' must be a list")
+    checked = []
+    for i, event in enumerate(events):
+        if not isinstance(event, dict):
+            raise ValueError(f"event {i} must be an object")
+        event = {name: value for name, value in event.items() if value is not None}
+        for name in NUMERIC_FIELDS:
+            if name in event:
+                event[name] = _number(event[name], name, i)
+        for name in STRING_FIELDS:
+            if name in event and not isinstance(event[name], str):
+                raise ValueError(f"event {i}: '{name}' must be a string")
+        if "honeypot_clicked" in event:
+            if event["honeypot_clicked"] not in (True, False, 0, 1):
+                raise ValueError(f"event {i}: 'honeypot_clicked' must be a boolean")
+            event["honeypot_clicked"] = bool(event["honeypot_clicked"])
+        checked.append(event)
+    return checked
+
+
+def parse_batch(data):
+    """
+    Validate a decoded /api/events body.
+
+    Returns (session_id, events, arrays, count): the checked event list for
+    the JSON shape, or the decoded arrays of a columnar batch (the other one
+    is None). Raises ValueError with a message meant for the client.
+    """
+    session_id = data.get("session_id")
+    if not session_id or not isinstance(session_id, str):
+        raise ValueError("session_id is required")
+    if is_columnar(data):
+        try:
+            arrays = columns_to_arrays(data)
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"Invalid columnar batch: {e}")
+        return session_id, None, arrays, len(data.get("type") or [])
+    events = validate_events(data.get("events", []))
+    return session_id, events, None, len(events)
+
+
+def _column(data, name, n):
+    values = data.get(name)
+    if values is None:
+        return np.zeros(n)
+    if isinstance(values, (bytes, bytearray)):
+        column = np.frombuffer(values, dtype="<i4").astype(np.float64)
+    else:
+        column = np.asarray(values, dtype=np.float64)
+    if column.shape != (n,):
+        raise ValueError(f"'{name}' must have one value per event")
+    return np.cumsum(column)
+
+
+def columns_to_arrays(data):
+    """Decode a columnar/v1 batch into the dict events_to_arrays() returns"""
+    type_names = list(data.get("types") or [])
+    type_ids = np.asarray(data.get("type") or [], dtype=np.int64)
+    if type_ids.ndim != 1:
+        raise ValueError("'type' must be a flat list")
+    n = type_ids.size
+    if n and (type_ids.min() < 0 or type_ids.max() >= len(type_names)):
+        raise ValueError("'type' index outside 'types'")
+
+    # Per-type lookups, then one fancy-index per event
+    mouse_lut = np.array([name in MOUSE_EVENT_TYPES for name in type_names] or [False])
+    key_lut = np.array([name in KEY_EVENT_TYPES for name in type_names] or [False])
+    down_lut = np.array([name == "keydown" for name in type_names] or [False])
+    honeypot_lut = np.array([name == "honeypot_click" for name in type_names] or [False])
+    is_mouse = mouse_lut[type_ids]
+    is_key = key_lut[type_ids]
+
+    t = _column(data, "t", n)
+    x = _column(data, "x", n)
+    y = _column(data, "y", n)
+
+    honeypot = honeypot_lut[type_ids]
+    flagged = np.asarray(data.get("honeypot") or [], dtype=np.int64)
+    if flagged.size:
+        if flagged.min() < 0 or flagged.max() >= n:
+            raise ValueError("'honeypot' index outside the batch")
+        honeypot[flagged] = True
+
+    keys = np.asarray(data.get("key") or [], dtype=object)
+    if keys.size != int(is_key.sum()):
+        raise ValueError("'key' must have one entry per key event")
+
+    return {
+        "mouse_t": t[is_mouse],
+        "mouse_x": x[is_mouse],
+        "mouse_y": y[is_mouse],
+        "honeypot": honeypot[is_mouse],
+        "key_t": t[is_key],
+        "key_code": encode_keys(keys),
+        "key_name": keys,
+        "key_down": down_lut[type_ids][is_key],
+    }
+
+
+def encode_columnar(session_id, events, decimals=None):
+    """
+    Build a columnar/v1 batch from event dicts (reference client encoder).
+
+    With `decimals` set, t/x/y are rounded to that many decimals first, which
+    keeps the deltas short in JSON; browsers report whole pixels and
+    timestamps no finer than 0.1 ms anyway. The default is lossless.
+    """
+    events = [e for e in events if e.get("type")]
+    types = sorted({e["type"] for e in events})
+    index = {name: i for i, name in enumerate(types)}
+    columns = {}
+    for name in ("t", "x", "y"):
+        values = np.array([e.get(name) or 0 for e in events], dtype=np.float64)
+        if decimals is None:
+            columns[name] = np.diff(values, prepend=0).tolist()
+            continue
+        deltas = np.round(np.diff(np.round(values, decimals), prepend=0), decimals)
+        columns[name] = [int(d) if d.is_integer() else d for d in deltas.tolist()]
+    return {
+        "session_id": session_id,
+        "format": COLUMNAR_FORMAT,
+        "types": types,
+        "type": [index[e["type"]] for e in events],
+        **columns,
+        "key": [e.get("key", "") for e in events if e.get("type") in KEY_EVENT_TYPES],
+        "honeypot": [i for i, e in enumerate(events) if e.get("honeypot_clicked")],
+    }
@@ -0,0 +1,232 @@
+"""
+Incremental training dataset export: rl_experience plus per-session
+telemetry aggregates, as date-partitioned Parquet or Arrow IPC files.
+
+    python export_dataset.py [--out dataset] [--format parquet|arrow]
+        [--chunk-rows 50000] [--lag-minutes 5] [--full]
+
+One row per transition, with the packed states flattened into float32
+columns (state_<feature>, next_state_<feature>, zeros when there is no next
+state, which has_next_state tells apart), the action as text and as
+its index in policy.ACTIONS, the reward, and the session's mouse, keystroke
+and challenge aggregates, read from session_feature_summary (see
+session_view.py) and computed on the spot for sessions not refreshed yet.
+
+Experiences are streamed with a server-side cursor in (created_at,
+experience_id) order and written a chunk at a time to
+<out>/date=YYYY-MM-DD/part-<key>.<ext>, so memory stays bounded by
+--chunk-rows. After each chunk the last exported key is saved to
+<out>/_watermark.json and the next run starts after it; rows newer than
+--lag-minutes are left for the next run so transactions still in flight
+are not skipped. File names derive from the watermark a chunk started at,
+so a chunk cut short before its watermark was saved is redone over the
+same files.
+
+--format arrow writes uncompressed Arrow IPC files, which training jobs can
+memory-map without copying (see open_dataset()); Parquet is smaller on disk.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from features import FEATURE_NAMES
+from policy import ACTIONS
+from session_view import fetch_summaries
+from state_codec import decode_states
+
+WATERMARK_FILE = "_watermark.json"
+EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+# (session_view column, Arrow type name) copied onto every transition
+SESSION_COLUMNS = [
+    ("mouse_events", "int32"),
+    ("honeypot_clicks", "int32"),
+    ("movement_speed_avg", "float32"),
+    ("movement_speed_std", "float32"),
+    ("movement_speed_max", "float32"),
+    ("pause_duration_avg", "float32"),
+    ("pause_duration_max", "float32"),
+    ("keystrokes", "int32"),
+    ("typing_speed_avg", "float32"),
+    ("typing_speed_std", "float32"),
+    ("challenges", "int32"),
+    ("challenge_types", "string"),
+]
+
+
+def load_watermark(out):
+    """(created_at, experience_id, rows exported so far) of the last run"""
+    try:
+        with open(os.path.join(out, WATERMARK_FILE)) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return EPOCH, "", 0
+    return datetime.fromisoformat(data["created_at"]), data["experience_id"], data["rows"]
+
+
+def save_watermark(out, created_at, experience_id, rows):
+    path = os.path.join(out, WATERMARK_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({
+            "created_at": created_at.isoformat(),
+            "experience_id": experience_id,
+            "rows": rows,
+            "exported_at": datetime.now(timezone.utc).isoformat(),
+        }, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)
+
+
+def build_table(rows, sessions):
+    """Arrow table for one chunk of (experience_id, session_id, created_at, state_bin, state,
+    next_state_bin, next_state, action_taken, reward) rows"""
+    import pyarrow as pa
+
+    action_index = {name: i for i, name in enumerate(ACTIONS)}
+    states = decode_states([r[3] if r[3] is not None else r[4] for r in rows])
+    next_states = decode_states([r[5] if r[5] is not None else r[6] for r in rows])
+
+    columns = {
+        "experience_id": pa.array([r[0] for r in rows], pa.string()),
+        "session_id": pa.array([r[1] for r in rows], pa.string()),
+        "created_at": pa.array([r[2] for r in rows], pa.timestamp("us", tz="UTC")),
+        "action_taken": pa.array([r[7] for r in rows], pa.string()),
+        "action": pa.array([action_index.get(r[7], -1) for r in rows], pa.int8()),
+        "reward": pa.array(np.array([r[8] or 0.0 for r in rows], dtype=np.float32)),
+        "has_next_state": pa.array([r[5] is not None or r[6] is not None for r in rows], pa.bool_()),
+    }
+    for i, name in enumerate(FEATURE_NAMES):
+        columns[f"state_{name}"] = pa.array(states[:, i])
+    for i, name in enumerate(FEATURE_NAMES):
+        columns[f"next_state_{name}"] = pa.array(next_states[:, i])
+
+    per_row = [sessions.get(r[1], {}) for r in rows]
+    for name, type_name in SESSION_COLUMNS:
+        columns[name] = pa.array([values.get(name) for values in per_row], getattr(pa, type_name)())
+    return pa.table(columns)
+
+
+def chunk_key(after_time, after_id):
+    """File name stem for the chunk that starts after this watermark"""
+    micros = int((after_time - EPOCH).total_seconds() * 1e6)
+    return f"{micros:017d}-{hashlib.blake2b(after_id.encode(), digest_size=4).hexdigest()}"
+
+
+def write_chunk(table, out, key, file_format):
+    """Write one file per created_at date in the chunk; returns the paths"""
+    import pyarrow.compute as pc
+
+    days = pc.strftime(table["created_at"], format="%Y-%m-%d")
+    paths = []
+    for day in pc.unique(days).to_pylist():
+        part = table.filter(pc.equal(days, day))
+        directory = os.path.join(out, f"date={day}")
+        os.makedirs(directory, exist_ok=True)
+        ext = "parquet" if file_format == "parquet" else "arrow"
+        path = os.path.join(directory, f"part-{key}.{ext}")
+        # Dot-prefixed until complete, which dataset readers skip
+        tmp = os.path.join(directory, f".part-{key}.{ext}.tmp")
+        if file_format == "parquet":
+            import pyarrow.parquet as pq
+            pq.write_table(part, tmp, compression="zstd")
+        else:
+            import pyarrow as pa
+            with pa.OSFile(tmp, "wb") as sink, pa.ipc.new_file(sink, part.schema) as writer:
+                writer.write_table(part)
+        os.replace(tmp, path)
+        paths.append(path)
+    return paths
+
+
+def export(conn, out, file_format="parquet", chunk_rows=50000, lag=timedelta(minutes=5)):
+    """
+    Export every experience after the watermark in `out`.
+
+    Returns (rows, files) written by this run.
+    """
+    os.makedirs(out, exist_ok=True)
+    after_time, after_id, total_rows = load_watermark(out)
+    until = datetime.now(timezone.utc) - lag
+
+    rows_written = files_written = 0
+    with conn.cursor(name="dataset_export") as cur, conn.cursor() as lookup:
+        cur.itersize = chunk_rows
+        cur.execute("""
+            SELECT experience_id, session_id, created_at,
+                   state_bin, state, next_state_bin, next_state,
+                   action_taken, reward
+            FROM rl_experience
+            WHERE (created_at, experience_id) > (%s, %s) AND created_at < %s
+            ORDER BY created_at, experience_id
+        """, (after_time, after_id, until))
+        while True:
+            rows = cur.fetchmany(chunk_rows)
+            if not rows:
+                break
+            ids = sorted({r[1] for r in rows})
+            sessions = fetch_summaries(lookup, ids)
+
+            key = chunk_key(after_time, after_id)
+            files_written += len(write_chunk(build_table(rows, sessions), out, key, file_format))
+            rows_written += len(rows)
+            after_id, after_time = rows[-1][0], rows[-1][2]
+            save_watermark(out, after_time, after_id, total_rows + rows_written)
+    conn.rollback()
+    return rows_written, files_written
+
+
+def open_dataset(out):
+    """
+    The exported files as a pyarrow.dataset.Dataset; Arrow IPC files are
+    memory-mapped, so e.g. dataset.to_table(columns=[...]) reads only the
+    pages it touches.
+    """
+    import pyarrow.dataset as ds
+    from pyarrow import fs
+
+    has_arrow = any(name.endswith(".arrow") for _, _, names in os.walk(out) for name in names)
+    return ds.dataset(out, format="ipc" if has_arrow else "parquet", partitioning="hive",
+                      filesystem=fs.LocalFileSystem(use_mmap=True),
+                      exclude_invalid_files=True)
+
+
+def main():
+    from db import get_connection
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="dataset", help="output directory")
+    parser.add_argument("--format", choices=("parquet", "arrow"), default="parquet")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="experiences per fetch and per file")
+    parser.add_argument("--lag-minutes", type=float, default=5, help="leave rows this recent for the next run")
+    parser.add_argument("--full", action="store_true", help="delete the previous export and start over")
+    args = parser.parse_args()
+
+    if args.full and os.path.isdir(args.out):
+        for name in os.listdir(args.out):
+            if name.startswith("date="):
+                shutil.rmtree(os.path.join(args.out, name))
+        try:
+            os.remove(os.path.join(args.out, WATERMARK_FILE))
+        except FileNotFoundError:
+            pass
+
+    started = time.perf_counter()
+    conn = get_connection()
+    try:
+        rows, files = export(conn, args.out, args.format, args.chunk_rows, timedelta(minutes=args.lag_minutes))
+    finally:
+        conn.close()
+    elapsed = time.perf_counter() - started
+    print(f"Exported {rows} experiences to {files} files in {args.out} "
+          f"in {elapsed:.1f}s ({rows / elapsed if elapsed else 0:.0f} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
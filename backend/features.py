@@ -0,0 +1,224 @@
+import numpy as np
+
+# Raw event contract for /api/events (one dict per event):
+#   mouse:     {"type": "mousemove" | "click" | ..., "t": ms, "x": px, "y": px}
+#   honeypot:  {"type": "honeypot_click", "t": ms} or any mouse event with "honeypot_clicked": true
+#   keyboard:  {"type": "keydown" | "keyup", "t": ms, "key": "a"}
+MOUSE_EVENT_TYPES = {"mousemove", "mousedown", "mouseup", "click", "scroll", "honeypot_click"}
+KEY_EVENT_TYPES = {"keydown", "keyup", "keypress"}
+
+# A gap between mouse samples longer than this (seconds) counts as a pause
+PAUSE_THRESHOLD_S = 0.1
+
+MOUSE_FEATURES = (
+    "movement_speed",
+    "pause_duration",
+    "honeypot_clicked",
+    "mouse_event_count",
+    "velocity_mean",
+    "velocity_std",
+    "velocity_max",
+    "acceleration_mean",
+    "acceleration_std",
+    "jerk_mean",
+    "jerk_std",
+    "curvature_mean",
+    "curvature_std",
+    "straightness",
+    "pause_count",
+    "pause_total",
+)
+
+KEYSTROKE_FEATURES = (
+    "typing_speed",
+    "keystroke_count",
+    "interkey_mean",
+    "interkey_std",
+    "interkey_median",
+    "dwell_mean",
+    "dwell_std",
+    "dwell_median",
+)
+
+FEATURE_NAMES = MOUSE_FEATURES + KEYSTROKE_FEATURES
+
+
+def events_to_arrays(events):
+    """Pull the numeric columns out of a list of raw event dicts"""
+    types = [e.get("type") for e in events]
+    is_mouse = np.fromiter((t in MOUSE_EVENT_TYPES for t in types), dtype=bool, count=len(types))
+    is_key = np.fromiter((t in KEY_EVENT_TYPES for t in types), dtype=bool, count=len(types))
+    t = np.array([e.get("t", np.nan) for e in events], dtype=np.float64)
+    x = np.array([e.get("x", np.nan) for e in events], dtype=np.float64)
+    y = np.array([e.get("y", np.nan) for e in events], dtype=np.float64)
+    honeypot = np.fromiter(
+        (typ == "honeypot_click" or bool(e.get("honeypot_clicked", False)) for typ, e in zip(types, events)),
+        dtype=bool, count=len(types)
+    )
+    is_down = np.fromiter((typ == "keydown" for typ in types), dtype=bool, count=len(types))
+    keys = np.array([e.get("key", "") for e, k in zip(events, is_key) if k], dtype=object)
+    return {
+        "mouse_t": t[is_mouse],
+        "mouse_x": x[is_mouse],
+        "mouse_y": y[is_mouse],
+        "honeypot": honeypot[is_mouse],
+        "key_t": t[is_key],
+        "key_code": encode_keys(keys),
+        "key_name": keys,
+        "key_down": is_down[is_key],
+    }
+
+
+def encode_keys(keys):
+    """Map key names to small integer codes (only equality between codes is meaningful)"""
+    if len(keys) == 0:
+        return np.empty(0, dtype=np.int64)
+    _, codes = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+    return codes.astype(np.int64)
+
+
+def _stats(values):
+    values = values[np.isfinite(values)]
+    if values.size == 0:
+        return 0.0, 0.0, 0.0
+    return float(values.mean()), float(values.std()), float(values.max())
+
+
+def _safe_divide(num, den):
+    out = np.full(num.shape, np.nan)
+    np.divide(num, den, out=out, where=den > 0)
+    return out
+
+
+def mouse_motion(t, x, y):
+    """
+    Per-sample speed (px/s) and preceding gap (s) for a mouse trace.
+
+    Both arrays have the same length as the input; the first sample has
+    speed 0 and gap 0. This is what fills mouseDynamics.movement_speed and
+    pause_duration for each stored event. Input must be sorted by t.
+    """
+    speed = np.zeros(t.shape)
+    gap = np.zeros(t.shape)
+    if t.size > 1:
+        dt = np.diff(t) / 1000.0
+        dist = np.hypot(np.diff(x), np.diff(y))
+        speed[1:] = np.nan_to_num(_safe_divide(dist, dt))
+        gap[1:] = dt
+    return speed, gap
+
+
+def mouse_kinematics(t, x, y):
+    """
+    Derivative arrays for a mouse trace sorted by t (ms).
+
+    Returns gaps (s) and velocity between consecutive samples (length n-1),
+    acceleration and curvature (n-2) and jerk (n-3). Element i of each array
+    depends on samples i .. i+k, where k is 1, 2, 2 and 3 respectively.
+    """
+    dt = np.diff(t) / 1000.0
+    dx = np.diff(x)
+    dy = np.diff(y)
+    dist = np.hypot(dx, dy)
+
+    velocity = _safe_divide(dist, dt)
+    acceleration = _safe_divide(np.diff(velocity), dt[1:])
+    jerk = _safe_divide(np.diff(acceleration), dt[2:])
+
+    # Curvature: change in heading per pixel travelled
+    heading = np.arctan2(dy, dx)
+    turn = np.abs((np.diff(heading) + np.pi) % (2 * np.pi) - np.pi)
+    curvature = _safe_divide(turn, dist[1:])
+    return {
+        "gap": dt,
+        "distance": dist,
+        "velocity": velocity,
+        "acceleration": acceleration,
+        "jerk": jerk,
+        "curvature": curvature,
+    }
+
+
+def mouse_features(t, x, y, honeypot=None):
+    """Session-level mouse features from parallel t (ms), x, y arrays"""
+    order = np.argsort(t, kind="stable")
+    t, x, y = t[order], x[order], y[order]
+    features = dict.fromkeys(MOUSE_FEATURES, 0.0)
+    features["mouse_event_count"] = float(t.size)
+    features["honeypot_clicked"] = float(honeypot is not None and bool(np.any(honeypot)))
+
+    valid = np.isfinite(t) & np.isfinite(x) & np.isfinite(y)
+    t, x, y = t[valid], x[valid], y[valid]
+    if t.size < 2:
+        return features
+
+    k = mouse_kinematics(t, x, y)
+    pauses = k["gap"][k["gap"] > PAUSE_THRESHOLD_S]
+    path = k["distance"].sum()
+    displacement = np.hypot(x[-1] - x[0], y[-1] - y[0])
+
+    features["velocity_mean"], features["velocity_std"], features["velocity_max"] = _stats(k["velocity"])
+    features["acceleration_mean"], features["acceleration_std"], _ = _stats(np.abs(k["acceleration"]))
+    features["jerk_mean"], features["jerk_std"], _ = _stats(np.abs(k["jerk"]))
+    features["curvature_mean"], features["curvature_std"], _ = _stats(k["curvature"])
+    features["straightness"] = float(displacement / path) if path > 0 else 0.0
+    features["pause_count"] = float(pauses.size)
+    features["pause_total"] = float(pauses.sum())
+    features["pause_duration"] = float(pauses.mean()) if pauses.size else 0.0
+    features["movement_speed"] = features["velocity_mean"]
+    return features
+
+
+def dwell_times(t, key_code, key_down):
+    """
+    Pair each keydown with the next event for the same key, if it is a keyup.
+
+    Returns the dwell times (s) and the indices of keydowns still open at
+    the end of the batch (no later event for that key).
+    """
+    if t.size == 0:
+        return np.empty(0), np.empty(0, dtype=np.int64)
+    order = np.lexsort((t, key_code))
+    code, times, down = key_code[order], t[order], key_down[order]
+    pairs = (code[:-1] == code[1:]) & down[:-1] & ~down[1:]
+    dwell = (times[1:] - times[:-1])[pairs] / 1000.0
+    last_for_key = np.append(code[:-1] != code[1:], True)
+    return dwell, order[last_for_key & down]
+
+
+def keystroke_features(t, key_code, key_down):
+    """Session-level typing features from parallel t (ms), key code and keydown-flag arrays"""
+    features = dict.fromkeys(KEYSTROKE_FEATURES, 0.0)
+    down_t = np.sort(t[key_down & np.isfinite(t)])
+    features["keystroke_count"] = float(down_t.size)
+
+    if down_t.size > 1:
+        span = (down_t[-1] - down_t[0]) / 1000.0
+        interkey = np.diff(down_t) / 1000.0
+        features["typing_speed"] = float((down_t.size - 1) / span) if span > 0 else 0.0
+        features["interkey_mean"], features["interkey_std"], _ = _stats(interkey)
+        features["interkey_median"] = float(np.median(interkey))
+
+    dwell, _ = dwell_times(t, key_code, key_down)
+    if dwell.size:
+        features["dwell_mean"], features["dwell_std"], _ = _stats(dwell)
+        features["dwell_median"] = float(np.median(dwell))
+    return features
+
+
+def extract_features(events):
+    """Compute every feature in FEATURE_NAMES for one session's raw event batch"""
+    arrays = events_to_arrays(events)
+    return extract_features_from_arrays(arrays)
+
+
+def extract_features_from_arrays(arrays):
+    """Same as extract_features() but for the column arrays from events_to_arrays()"""
+    features = mouse_features(arrays["mouse_t"], arrays["mouse_x"], arrays["mouse_y"], arrays["honeypot"])
+    features.update(keystroke_features(arrays["key_t"], arrays["key_code"], arrays["key_down"]))
+    return features
+
+
+def feature_vector(features, dtype=np.float32):
+    """Flatten a feature dict into an array ordered like FEATURE_NAMES"""
+    return np.array([features.get(name, 0.0) for name in FEATURE_NAMES], dtype=dtype)
@@ -0,0 +1,426 @@
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+
+import numpy as np
+import psycopg2
+from psycopg2.extras import execute_values
+
+from db import transaction
+from features import (MOUSE_EVENT_TYPES, KEY_EVENT_TYPES, events_to_arrays,
+                      keystroke_features, mouse_motion)
+from session_view import mark_dirty
+
+logger = logging.getLogger(__name__)
+
+BACKPRESSURE_POLICIES = ("block", "drop", "reject")
+# Lost connections and server restarts; anything else is a problem with the rows
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError)
+
+MOUSE_COLUMNS = ("session_id", "mouse_event_id", "movement_speed", "pause_duration", "honeypot_clicked")
+KEYSTROKE_COLUMNS = ("session_id", "keystroke_id", "typing_speed")
+_CASTS = {"movement_speed": "real", "pause_duration": "real", "honeypot_clicked": "boolean",
+          "typing_speed": "real", "event_time": "timestamptz"}
+
+
+def _deduped_insert(table, kind, columns):
+    """
+    (SQL, execute_values template) inserting only rows whose id is new.
+
+    The partitioned tables' keys include event_time, which defaults to
+    now(), so a retried batch would get new keys; the ids are checked
+    against telemetry_event_ids (not partitioned) instead. Rows with a
+    repeated id are skipped, whenever they arrive within the window that
+    retention.py keeps ids for.
+    """
+    names = ", ".join(columns)
+    sql = f"""
+        WITH v ({names}) AS (VALUES %s),
+        new AS (
+            INSERT INTO telemetry_event_ids (kind, event_id)
+            SELECT '{kind}', {columns[1]} FROM v
+            ON CONFLICT DO NOTHING
+            RETURNING event_id
+        )
+        INSERT INTO {table} ({names})
+        SELECT v.* FROM v JOIN new ON new.event_id = v.{columns[1]}
+        ON CONFLICT DO NOTHING
+    """
+    # Explicit casts, since VALUES would type an all-NULL column as text
+    template = "(" + ", ".join(f"%s::{_CASTS.get(c, 'text')}" for c in columns) + ")"
+    return sql, template
+
+
+def insert_rows(cur, mouse_rows, key_rows, with_event_time=False):
+    """
+    Insert (session_id, id, ...) rows into mouseDynamics / keystrokeDynamics,
+    skipping ids already stored. With with_event_time the rows carry
+    event_time after the id; otherwise it defaults to now(), which picks the
+    partition.
+    """
+    for table, kind, columns, rows in (("mouseDynamics", "mouse", MOUSE_COLUMNS, mouse_rows),
+                                       ("keystrokeDynamics", "keystroke", KEYSTROKE_COLUMNS, key_rows)):
+        if not rows:
+            continue
+        if with_event_time:
+            columns = columns[:2] + ("event_time",) + columns[2:]
+        sql, template = _deduped_insert(table, kind, columns)
+        execute_values(cur, sql, rows, template=template, page_size=1000)
+
+
+class QueueFull(Exception):
+    """Raised by EventWriter.submit() when the queue is full and the policy is reject"""
+
+
+def _mouse_motion(arrays):
+    """Speed and gap per mouse sample, in the order the samples arrived"""
+    t, x, y = arrays["mouse_t"], arrays["mouse_x"], arrays["mouse_y"]
+    order = np.argsort(t, kind="stable")
+    speed = np.empty(t.shape)
+    gap = np.empty(t.shape)
+    speed[order], gap[order] = mouse_motion(t[order], x[order], y[order])
+    return speed, gap
+
+
+def _typing_speed(arrays):
+    return keystroke_features(arrays["key_t"], arrays["key_code"], arrays["key_down"])["typing_speed"]
+
+
+def split_events(session_id, events):
+    """
+    Turn a raw /api/events batch into mouseDynamics and keystrokeDynamics rows.
+
+    Values the client already sent (movement_speed, pause_duration,
+    typing_speed) are kept; otherwise they are derived from the raw t/x/y
+    columns of the batch.
+    """
+    mouse = [e for e in events if e.get("type") in MOUSE_EVENT_TYPES]
+    keys = [e for e in events if e.get("type") in KEY_EVENT_TYPES]
+
+    speed = gap = None
+    if mouse:
+        speed, gap = _mouse_motion(events_to_arrays(mouse))
+
+    typing_speed = None
+    if keys:
+        typing_speed = _typing_speed(events_to_arrays(keys))
+
+    mouse_rows = [
+        (
+            event.get("mouse_event_id") or str(uuid.uuid4()),
+            event.get("movement_speed", float(speed[i])),
+            event.get("pause_duration", float(gap[i])),
+            bool(event.get("honeypot_clicked", event.get("type") == "honeypot_click"))
+        )
+        for i, event in enumerate(mouse)
+    ]
+    key_rows = [
+        (
+            event.get("keystroke_id") or str(uuid.uuid4()),
+            event.get("typing_speed", typing_speed)
+        )
+        for event in keys
+    ]
+    return mouse_rows, key_rows
+
+
+def split_arrays(arrays):
+    """split_events() for a batch already decoded to arrays (columnar wire format)"""
+    mouse_rows = []
+    if arrays["mouse_t"].size:
+        speed, gap = _mouse_motion(arrays)
+        mouse_rows = [
+            (str(uuid.uuid4()), s, g, h)
+            for s, g, h in zip(speed.tolist(), gap.tolist(), arrays["honeypot"].tolist())
+        ]
+    key_rows = []
+    if arrays["key_t"].size:
+        typing_speed = _typing_speed(arrays)
+        key_rows = [(str(uuid.uuid4()), typing_speed) for _ in range(arrays["key_t"].size)]
+    return mouse_rows, key_rows
+
+
+def settings_from_env():
+    """Keyword arguments shared by EventWriter and async_ingest.AsyncEventWriter, from INGEST_*"""
+    return {
+        "max_batches": int(os.getenv("INGEST_QUEUE_SIZE", 10000)),
+        "flush_rows": int(os.getenv("INGEST_FLUSH_ROWS", 5000)),
+        "flush_ms": int(os.getenv("INGEST_FLUSH_MS", 200)),
+        "backpressure": os.getenv("INGEST_BACKPRESSURE", "block"),
+        "block_timeout_ms": int(os.getenv("INGEST_BLOCK_TIMEOUT_MS", 50)),
+        "flush_retries": int(os.getenv("INGEST_FLUSH_RETRIES", 3)),
+        "retry_backoff_ms": int(os.getenv("INGEST_RETRY_BACKOFF_MS", 100)),
+    }
+
+
+def flatten(batches):
+    """(session_id, mouse rows, key rows) batches -> rows with the session_id in front, per table"""
+    mouse_rows = []
+    key_rows = []
+    for session_id, mouse, keys in batches:
+        mouse_rows.extend((session_id,) + tuple(row) for row in mouse)
+        key_rows.extend((session_id,) + tuple(row) for row in keys)
+    return mouse_rows, key_rows
+
+
+def _batch_rows(batches):
+    return sum(len(mouse) + len(keys) for _, mouse, keys in batches)
+
+
+class BatchWriter:
+    """
+    Settings, flush policy and stats shared by EventWriter and
+    async_ingest.AsyncEventWriter; subclasses supply the queue, the
+    flusher and the database calls.
+
+    Batches are (session_id, mouse rows, key rows) as split_events() and
+    split_arrays() produce them. A flush is due once `flush_rows` rows are
+    pending or the oldest pending batch is `flush_ms` old. A flush that fails
+    on a lost connection is retried up to `flush_retries` times with
+    exponential backoff from `retry_backoff_ms`. One that fails on the data
+    (e.g. an id containing a NUL byte) is redone with a savepoint per batch,
+    so only the offending batches are lost.
+    """
+
+    name = "event writer"
+
+    def __init__(self, max_batches=10000, flush_rows=5000, flush_ms=200,
+                 backpressure="block", block_timeout_ms=50, flush_retries=3, retry_backoff_ms=100):
+        if backpressure not in BACKPRESSURE_POLICIES:
+            raise ValueError(f"backpressure must be one of {BACKPRESSURE_POLICIES}")
+        self.max_batches = max_batches
+        self.flush_rows = flush_rows
+        self.flush_ms = flush_ms
+        self.backpressure = backpressure
+        self.block_timeout_ms = block_timeout_ms
+        self.flush_retries = flush_retries
+        self.retry_backoff_ms = retry_backoff_ms
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches_enqueued": 0,
+            "batches_dropped": 0,
+            "batches_rejected": 0,
+            "flushes": 0,
+            "flushes_failed": 0,
+            "flush_retries": 0,
+            "batches_failed": 0,
+            "mouse_rows_written": 0,
+            "keystroke_rows_written": 0,
+            "rows_lost": 0,
+            "last_flush_rows": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def queue_depth(self):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+        flushes = stats["flushes"]
+        stats["avg_flush_ms"] = stats["total_flush_ms"] / flushes if flushes else 0.0
+        stats["queue_depth"] = self.queue_depth()
+        stats["queue_capacity"] = self.max_batches
+        stats["backpressure"] = self.backpressure
+        stats["flush_rows"] = self.flush_rows
+        stats["flush_ms"] = self.flush_ms
+        return stats
+
+    def _bump(self, key, amount=1):
+        with self._stats_lock:
+            self._stats[key] += amount
+
+    def _full(self):
+        """The queue had no room: raise QueueFull (reject) or report the batch dropped"""
+        if self.backpressure == "reject":
+            self._bump("batches_rejected")
+            raise QueueFull()
+        self._bump("batches_dropped")
+        return False
+
+    def _flush_timeout(self, oldest):
+        """Seconds the flusher may wait for the next batch"""
+        if oldest is None:
+            return self.flush_ms / 1000
+        return max(0.0, oldest + self.flush_ms / 1000 - time.monotonic())
+
+    def _flush_due(self, pending_rows, oldest):
+        return (pending_rows >= self.flush_rows
+                or (oldest is not None and time.monotonic() - oldest >= self.flush_ms / 1000))
+
+    def _retry_delay(self, attempt):
+        """Backoff before retrying after a transient error, or None once retries are used up"""
+        if attempt >= self.flush_retries:
+            return None
+        self._bump("flush_retries")
+        return self.retry_backoff_ms / 1000 * 2 ** attempt
+
+    def _flushed(self, written, failed, started):
+        if failed:
+            self._bump("batches_failed", len(failed))
+            self._bump("rows_lost", _batch_rows(failed))
+        mouse_rows = sum(len(mouse) for _, mouse, _ in written)
+        key_rows = sum(len(keys) for _, _, keys in written)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self._stats["flushes"] += 1
+            self._stats["mouse_rows_written"] += mouse_rows
+            self._stats["keystroke_rows_written"] += key_rows
+            self._stats["last_flush_rows"] = mouse_rows + key_rows
+            self._stats["last_flush_ms"] = elapsed_ms
+            self._stats["max_flush_ms"] = max(self._stats["max_flush_ms"], elapsed_ms)
+            self._stats["total_flush_ms"] += elapsed_ms
+
+    def _dropped_batch(self, batch, error, failed):
+        if not failed:
+            logger.warning("%s: dropping batch of session %r: %s", self.name, batch[0], error)
+        failed.append(batch)
+
+    def _lost(self, batches, error):
+        rows = _batch_rows(batches)
+        logger.error("%s: flush of %d rows failed: %s", self.name, rows, error)
+        self._bump("flushes_failed")
+        self._bump("rows_lost", rows)
+
+
+class EventWriter(BatchWriter):
+    """
+    Bounded in-process queue in front of the telemetry tables.
+
+    Requests only enqueue; one background thread drains the queue and writes
+    everything it has collected with multi-row INSERTs in a single
+    transaction (see BatchWriter for when, and what happens on errors).
+    """
+
+    def __init__(self, max_batches=10000, transaction=transaction, **settings):
+        super().__init__(max_batches, **settings)
+        self.queue = queue.Queue(maxsize=max_batches)
+        self.transaction = transaction
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+
+    @classmethod
+    def from_env(cls):
+        """Build a writer from INGEST_* environment variables"""
+        return cls(**settings_from_env())
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="event-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """Flush whatever is still queued and stop the background thread"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, session_id, events):
+        """
+        Queue one batch for writing.
+
+        Returns True if the batch was queued and False if it was dropped.
+        Raises QueueFull if the queue is full and the policy is reject.
+        """
+        return self._enqueue(session_id, *split_events(session_id, events))
+
+    def submit_arrays(self, session_id, arrays):
+        """submit() for a batch decoded by event_codec.columns_to_arrays()"""
+        return self._enqueue(session_id, *split_arrays(arrays))
+
+    def queue_depth(self):
+        return self.queue.qsize()
+
+    def _enqueue(self, session_id, mouse_rows, key_rows):
+        self.start()
+        if not mouse_rows and not key_rows:
+            return True
+        item = (session_id, mouse_rows, key_rows)
+        try:
+            if self.backpressure == "block":
+                self.queue.put(item, timeout=self.block_timeout_ms / 1000)
+            else:
+                self.queue.put_nowait(item)
+        except queue.Full:
+            return self._full()
+        self._bump("batches_enqueued")
+        return True
+
+    def _run(self):
+        pending = []
+        pending_rows = 0
+        oldest = None
+        while True:
+            try:
+                item = self.queue.get(timeout=self._flush_timeout(oldest))
+                pending.append(item)
+                pending_rows += len(item[1]) + len(item[2])
+                if oldest is None:
+                    oldest = time.monotonic()
+            except queue.Empty:
+                pass
+
+            stopping = self._stop.is_set()
+            if pending and (self._flush_due(pending_rows, oldest) or (stopping and self.queue.empty())):
+                self._flush(pending)
+                pending = []
+                pending_rows = 0
+                oldest = None
+            if stopping and self.queue.empty() and not pending:
+                return
+
+    def _flush(self, batches):
+        started = time.perf_counter()
+        per_batch = False
+        attempt = 0
+        while True:
+            try:
+                with self.transaction() as cur:
+                    if per_batch:
+                        written, failed = self._write_per_batch(cur, batches)
+                    else:
+                        self._write(cur, batches)
+                        written, failed = batches, []
+                break
+            except TRANSIENT_ERRORS as e:
+                delay = self._retry_delay(attempt)
+                if delay is None:
+                    return self._lost(batches, e)
+                time.sleep(delay)
+                attempt += 1
+            except Exception as e:
+                if per_batch:
+                    return self._lost(batches, e)
+                # Find the bad batches instead of losing everyone's rows
+                per_batch = True
+        self._flushed(written, failed, started)
+
+    def _write(self, cur, batches):
+        insert_rows(cur, *flatten(batches))
+        mark_dirty(cur, [session_id for session_id, _, _ in batches])
+
+    def _write_per_batch(self, cur, batches):
+        """Write each batch under its own savepoint; returns (written, failed) batches"""
+        written = []
+        failed = []
+        for batch in batches:
+            cur.execute("SAVEPOINT flush_batch")
+            try:
+                self._write(cur, [batch])
+            except TRANSIENT_ERRORS:
+                raise
+            except psycopg2.Error as e:
+                cur.execute("ROLLBACK TO SAVEPOINT flush_batch")
+                self._dropped_batch(batch, e, failed)
+            else:
+                cur.execute("RELEASE SAVEPOINT flush_batch")
+                written.append(batch)
+        return written, failed
@@ -1,10 +1,17 @@
 from flask import Flask
 from flask_cors import CORS
 
-app = Flask(__name__)
-CORS(app)
+import metrics
+import routes
+
+
+def create_app():
+    app = Flask(__name__)
+    CORS(app)
+    metrics.init_app(app)
+    routes.init_app(app)
+    return app
 
-from routes import *
 
 if __name__ == "__main__":
-    app.run(debug=True, port=8080)
\ No newline at end of file
+    create_app().run(debug=True, port=8080)
@@ -0,0 +1,35 @@
+"""
+Prometheus metrics and the /debug/profiler sampling profiler.
+
+The metric types, GET /metrics and the profiler live in
+common/metrics_core.py, shared with TicketMonarch; this module re-exports
+them and adds the psycopg2 cursor that times every statement.
+"""
+import os
+import sys
+import time
+
+from psycopg2.extensions import cursor as _pg_cursor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "common"))
+
+from metrics_core import (Counter, Gauge, Histogram, SamplingProfiler, init_app,  # noqa: E402,F401
+                          profiler, record_query, register_stats, render)
+
+
+class TimedCursor(_pg_cursor):
+    """psycopg2 cursor that records statement time and row counts"""
+
+    def execute(self, query, vars=None):
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
+
+    def executemany(self, query, vars_list):
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            record_query(query, time.perf_counter() - started, self.rowcount)
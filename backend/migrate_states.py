@@ -0,0 +1,71 @@
+"""
+Convert rl_experience.state / next_state from JSON to packed state_bin /
+next_state_bin, a batch at a time.
+
+    python migrate_states.py [--batch-size 5000] [--keep-json]
+
+Each batch is its own transaction, so the script can be stopped and rerun;
+it only picks up rows that still have no state_bin. Unless --keep-json is
+given, the JSON columns of converted rows are set to NULL (run VACUUM on
+rl_experience afterwards to reclaim the space).
+"""
+import argparse
+import time
+
+from psycopg2.extras import execute_values
+
+from db import transaction
+from state_codec import CURRENT_VERSION, decode_state, encode_state
+
+
+def migrate_batch(batch_size, after, keep_json):
+    """Convert up to batch_size rows with experience_id > after; returns (count, last_id)"""
+    with transaction() as cur:
+        cur.execute("""
+            SELECT experience_id, state, next_state
+            FROM rl_experience
+            WHERE state_bin IS NULL AND experience_id > %s
+              AND (state IS NOT NULL OR next_state IS NOT NULL)
+            ORDER BY experience_id
+            LIMIT %s
+        """, (after, batch_size))
+        rows = cur.fetchall()
+        if not rows:
+            return 0, after
+
+        packed = [
+            (experience_id,
+             encode_state(decode_state(state), CURRENT_VERSION) if state is not None else None,
+             encode_state(decode_state(next_state), CURRENT_VERSION) if next_state is not None else None)
+            for experience_id, state, next_state in rows
+        ]
+        clear_json = "" if keep_json else ", state = NULL, next_state = NULL"
+        execute_values(cur, f"""
+            UPDATE rl_experience AS r
+            SET state_bin = v.state_bin, next_state_bin = v.next_state_bin{clear_json}
+            FROM (VALUES %s) AS v (experience_id, state_bin, next_state_bin)
+            WHERE r.experience_id = v.experience_id
+        """, packed, template="(%s, %s::bytea, %s::bytea)", page_size=1000)
+        return len(rows), rows[-1][0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--keep-json", action="store_true", help="leave the JSON columns populated")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    total = 0
+    last_id = ""
+    while True:
+        count, last_id = migrate_batch(args.batch_size, last_id, args.keep_json)
+        if count == 0:
+            break
+        total += count
+        print(f"Converted {total} rows ({total / (time.perf_counter() - started):.0f} rows/s)")
+    print(f"Done: {total} rows converted")
+
+
+if __name__ == "__main__":
+    main()
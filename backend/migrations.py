@@ -0,0 +1,300 @@
+"""
+Versioned schema migrations, applied on top of create_database.py.
+
+    python migrations.py [--list]
+
+Applied versions are recorded in schema_migrations; each migration runs in
+its own transaction, so a failed one leaves the schema at the previous
+version and can simply be rerun.
+"""
+import argparse
+import logging
+from datetime import datetime, timedelta, timezone
+
+from retention import PARTITIONED_TABLES, ensure_partitions, range_start
+
+logger = logging.getLogger(__name__)
+
+# Text timestamps written before migration 1 are ISO 8601; anything else
+# becomes NULL rather than failing the migration
+_TO_TIMESTAMPTZ = "CASE WHEN {col} ~ '^\\d{{4}}-\\d{{2}}-\\d{{2}}' THEN {col}::timestamptz END"
+
+
+def _to_timestamptz(cur, table, column, default_now=False):
+    cur.execute(f"""
+        ALTER TABLE {table} ALTER COLUMN {column} TYPE timestamptz
+        USING {_TO_TIMESTAMPTZ.format(col=column)}
+    """)
+    if default_now:
+        cur.execute(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT now()")
+
+
+def _partition(cur, table, create_sql, copy_sql, now):
+    """
+    Swap `table` for a range-partitioned copy.
+
+    Existing rows go into one partition ending where the regular
+    day/month partitions begin; there is also a DEFAULT partition so
+    inserts never fail for lack of a partition (retention.py moves those
+    rows out when it creates the matching one).
+    """
+    column, width, _ = PARTITIONED_TABLES[table]
+    cutoff = range_start(now, width)
+    cur.execute(f"ALTER TABLE {table} RENAME TO {table}_old")
+    cur.execute(f"ALTER INDEX {table}_pkey RENAME TO {table}_old_pkey")
+    cur.execute(create_sql)
+    cur.execute(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+    cur.execute(f"CREATE TABLE {table}_p_before{cutoff:%Y%m%d} PARTITION OF {table} "
+                f"FOR VALUES FROM (MINVALUE) TO (%s)", (cutoff,))
+    # Rows without a known time are clamped into the pre-migration partition
+    cur.execute(copy_sql, {"latest": cutoff - timedelta(microseconds=1)})
+    cur.execute(f"DROP TABLE {table}_old")
+    ensure_partitions(cur, table, cutoff, now + timedelta(days=8))
+
+
+def _v1_timestamptz_partitions(cur):
+    now = datetime.now(timezone.utc)
+
+    _to_timestamptz(cur, "sessions", "session_start_time", default_now=True)
+    _to_timestamptz(cur, "sessions", "session_end_time")
+    _to_timestamptz(cur, "session_features", "updated_at", default_now=True)
+
+    # Dynamics rows now carry their session, so the link tables are no
+    # longer written; their foreign keys would also block partitioning
+    cur.execute("ALTER TABLE s_mouse DROP CONSTRAINT IF EXISTS s_mouse_mouse_event_id_fkey")
+    cur.execute("ALTER TABLE s_keystroke DROP CONSTRAINT IF EXISTS s_keystroke_keystroke_id_fkey")
+
+    _partition(cur, "mousedynamics", """
+        CREATE TABLE mouseDynamics (
+            mouse_event_id TEXT NOT NULL,
+            session_id TEXT,
+            event_time TIMESTAMPTZ NOT NULL DEFAULT now(),
+            movement_speed REAL,
+            pause_duration REAL,
+            honeypot_clicked BOOLEAN,
+            PRIMARY KEY (mouse_event_id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """, """
+        INSERT INTO mouseDynamics (mouse_event_id, session_id, event_time,
+                                   movement_speed, pause_duration, honeypot_clicked)
+        SELECT m.mouse_event_id, l.session_id,
+               LEAST(COALESCE(s.session_start_time, %(latest)s), %(latest)s),
+               m.movement_speed, m.pause_duration, m.honeypot_clicked
+        FROM mousedynamics_old m
+        LEFT JOIN s_mouse l ON l.mouse_event_id = m.mouse_event_id
+        LEFT JOIN sessions s ON s.session_id = l.session_id
+        ON CONFLICT DO NOTHING
+    """, now)
+
+    _partition(cur, "keystrokedynamics", """
+        CREATE TABLE keystrokeDynamics (
+            keystroke_id TEXT NOT NULL,
+            session_id TEXT,
+            event_time TIMESTAMPTZ NOT NULL DEFAULT now(),
+            typing_speed REAL,
+            PRIMARY KEY (keystroke_id, event_time)
+        ) PARTITION BY RANGE (event_time)
+    """, """
+        INSERT INTO keystrokeDynamics (keystroke_id, session_id, event_time, typing_speed)
+        SELECT k.keystroke_id, l.session_id,
+               LEAST(COALESCE(s.session_start_time, %(latest)s), %(latest)s),
+               k.typing_speed
+        FROM keystrokedynamics_old k
+        LEFT JOIN s_keystroke l ON l.keystroke_id = k.keystroke_id
+        LEFT JOIN sessions s ON s.session_id = l.session_id
+        ON CONFLICT DO NOTHING
+    """, now)
+
+    _partition(cur, "rl_experience", """
+        CREATE TABLE rl_experience (
+            experience_id TEXT NOT NULL,
+            session_id TEXT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            state JSON,
+            action_taken TEXT,
+            reward REAL,
+            next_state JSON,
+            state_bin BYTEA,
+            next_state_bin BYTEA,
+            PRIMARY KEY (experience_id, created_at),
+            FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+        ) PARTITION BY RANGE (created_at)
+    """, """
+        INSERT INTO rl_experience (experience_id, session_id, created_at, state, action_taken,
+                                   reward, next_state, state_bin, next_state_bin)
+        SELECT r.experience_id, r.session_id,
+               LEAST(COALESCE(s.session_start_time, %(latest)s), %(latest)s),
+               r.state, r.action_taken, r.reward, r.next_state, r.state_bin, r.next_state_bin
+        FROM rl_experience_old r
+        LEFT JOIN sessions s ON s.session_id = r.session_id
+    """, now)
+
+    # Indexes for the lookups the app and offline jobs actually do; indexes
+    # on a partitioned parent are created on every partition
+    cur.execute("CREATE INDEX IF NOT EXISTS sessions_user_id_idx ON sessions (user_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS sessions_start_time_idx ON sessions (session_start_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS sessions_status_end_time_idx ON sessions (session_status, session_end_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS mousedynamics_session_idx ON mouseDynamics (session_id, event_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS keystrokedynamics_session_idx ON keystrokeDynamics (session_id, event_time)")
+    cur.execute("CREATE INDEX IF NOT EXISTS rl_experience_session_idx ON rl_experience (session_id)")
+    cur.execute("CREATE INDEX IF NOT EXISTS session_features_updated_at_idx ON session_features (updated_at)")
+
+
+def _v2_session_rollups(cur):
+    # One row per compacted session (see compact.py)
+    cur.execute("""CREATE TABLE IF NOT EXISTS session_rollups (
+        session_id TEXT PRIMARY KEY,
+        mouse_events INTEGER NOT NULL DEFAULT 0,
+        honeypot_clicks INTEGER NOT NULL DEFAULT 0,
+        movement_speed_avg REAL,
+        movement_speed_std REAL,
+        movement_speed_max REAL,
+        pause_duration_avg REAL,
+        pause_duration_max REAL,
+        keystrokes INTEGER NOT NULL DEFAULT 0,
+        typing_speed_avg REAL,
+        typing_speed_std REAL,
+        first_event_time TIMESTAMPTZ,
+        last_event_time TIMESTAMPTZ,
+        compacted_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS compaction_checkpoints (
+        job TEXT PRIMARY KEY,
+        session_end_time TIMESTAMPTZ,
+        session_id TEXT,
+        sessions_done BIGINT NOT NULL DEFAULT 0,
+        rows_removed BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""")
+    # Plain (unpartitioned) tables for compact.py --archive
+    cur.execute("CREATE TABLE IF NOT EXISTS mousedynamics_archive (LIKE mouseDynamics)")
+    cur.execute("CREATE TABLE IF NOT EXISTS keystrokedynamics_archive (LIKE keystrokeDynamics)")
+
+
+def _v3_spool_checkpoints(cur):
+    # Loaded byte offset per spool segment (see spool.py)
+    cur.execute("""CREATE TABLE IF NOT EXISTS spool_checkpoints (
+        segment TEXT PRIMARY KEY,
+        byte_offset BIGINT NOT NULL DEFAULT 0,
+        records BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""")
+
+
+def _v4_session_feature_summary(cur):
+    # Precomputed per-session rows and the queue of sessions to recompute (see session_view.py)
+    cur.execute("""CREATE TABLE IF NOT EXISTS session_feature_summary (
+        session_id TEXT PRIMARY KEY,
+        user_id TEXT,
+        ip_address TEXT,
+        session_start_time TIMESTAMPTZ,
+        session_end_time TIMESTAMPTZ,
+        session_status TEXT,
+        mouse_events INTEGER NOT NULL DEFAULT 0,
+        honeypot_clicks INTEGER NOT NULL DEFAULT 0,
+        movement_speed_avg REAL,
+        movement_speed_std REAL,
+        movement_speed_max REAL,
+        pause_duration_avg REAL,
+        pause_duration_max REAL,
+        keystrokes INTEGER NOT NULL DEFAULT 0,
+        typing_speed_avg REAL,
+        typing_speed_std REAL,
+        challenges INTEGER NOT NULL DEFAULT 0,
+        challenge_types TEXT,
+        first_event_time TIMESTAMPTZ,
+        last_event_time TIMESTAMPTZ,
+        features JSONB,
+        refreshed_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+    )""")
+    cur.execute("""CREATE TABLE IF NOT EXISTS session_feature_dirty (
+        session_id TEXT PRIMARY KEY,
+        marked_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS session_feature_dirty_marked_at_idx ON session_feature_dirty (marked_at)")
+    # Existing sessions are filled in by the first refreshes
+    cur.execute("INSERT INTO session_feature_dirty (session_id) SELECT session_id FROM sessions ON CONFLICT DO NOTHING")
+
+
+def _v5_telemetry_event_ids(cur):
+    # Ids of stored telemetry rows, so retried batches are not stored twice
+    # (see ingest.insert_rows); pruned by retention.py
+    cur.execute("""CREATE TABLE IF NOT EXISTS telemetry_event_ids (
+        kind TEXT NOT NULL,
+        event_id TEXT NOT NULL,
+        seen_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+        PRIMARY KEY (kind, event_id)
+    )""")
+    cur.execute("CREATE INDEX IF NOT EXISTS telemetry_event_ids_seen_at_idx ON telemetry_event_ids (seen_at)")
+
+
+# (version, description, function(cursor)); append only, never renumber
+MIGRATIONS = [
+    (1, "timestamptz columns, time-partitioned telemetry tables, indexes", _v1_timestamptz_partitions),
+    (2, "session_rollups summary table and compaction checkpoints", _v2_session_rollups),
+    (3, "spool loader checkpoints", _v3_spool_checkpoints),
+    (4, "session_feature_summary table and its refresh queue", _v4_session_feature_summary),
+    (5, "telemetry event ids for idempotent ingest", _v5_telemetry_event_ids),
+]
+
+
+def applied_versions(cur):
+    cur.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+    )""")
+    cur.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cur.fetchall()}
+
+
+def migrate(connection):
+    """Apply every pending migration in order; returns the versions applied"""
+    with connection.cursor() as cur:
+        done = applied_versions(cur)
+    connection.commit()
+
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        if version in done:
+            continue
+        try:
+            with connection.cursor() as cur:
+                apply(cur)
+                cur.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                            (version, description))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        logger.info("Applied migration %d: %s", version, description)
+        applied.append(version)
+    return applied
+
+
+def main():
+    from db import get_connection
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--list", action="store_true", help="show migrations and whether they are applied")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    connection = get_connection()
+    try:
+        if args.list:
+            with connection.cursor() as cur:
+                done = applied_versions(cur)
+            connection.commit()
+            for version, description, _ in MIGRATIONS:
+                print(f"{version:4d} [{'x' if version in done else ' '}] {description}")
+        else:
+            migrate(connection)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
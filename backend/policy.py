@@ -0,0 +1,126 @@
+import os
+
+import numpy as np
+
+from features import FEATURE_NAMES
+
+# rl_experience.action_taken values, in index order
+ACTIONS = ("allow", "challenge_easy", "challenge_medium", "challenge_hard", "block")
+
+# What each action serves, as (challengeCAPTCHA.challenge_type, difficulty_level)
+ACTION_CHALLENGES = {
+    "allow": (None, None),
+    "challenge_easy": ("checkbox", "easy"),
+    "challenge_medium": ("image_select", "medium"),
+    "challenge_hard": ("puzzle", "hard"),
+    "block": (None, None),
+}
+
+# Bot-score cutoffs used when the policy has no learned action weights:
+# score < 0.3 -> allow, < 0.5 -> easy, < 0.7 -> medium, < 0.9 -> hard, else block
+ACTION_THRESHOLDS = np.array([0.3, 0.5, 0.7, 0.9])
+
+# Hand-tuned starting point: (center, scale, weight) per feature, applied to
+# (x - center) / scale. Positive weights push towards "bot".
+_DEFAULT_BOT_WEIGHTS = {
+    "honeypot_clicked": (0.0, 1.0, 6.0),
+    "straightness": (0.6, 0.2, 1.5),
+    "curvature_std": (0.05, 0.05, -1.0),
+    "pause_count": (3.0, 3.0, -0.8),
+    "typing_speed": (8.0, 4.0, 1.2),
+    "interkey_std": (0.04, 0.03, -1.0),
+    "dwell_std": (0.02, 0.015, -0.8),
+}
+
+
+def _sigmoid(z):
+    return 1.0 / (1.0 + np.exp(-np.clip(z, -30, 30)))
+
+
+class LinearPolicy:
+    """
+    Bot score and action for a batch of FEATURE_NAMES-ordered vectors.
+
+    Features are standardised with `mean`/`scale`; the bot score is a
+    logistic model on top. If `action_weights` (dim x len(ACTIONS)) are set,
+    e.g. by offline training, the action is the argmax of the linear
+    action values; otherwise it comes from ACTION_THRESHOLDS on the score.
+    """
+
+    def __init__(self, mean, scale, bot_weights, bot_bias, action_weights=None, action_bias=None, version=0):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.bot_weights = np.asarray(bot_weights, dtype=np.float32)
+        self.bot_bias = float(bot_bias)
+        self.action_weights = None if action_weights is None else np.asarray(action_weights, dtype=np.float32)
+        self.action_bias = None if action_bias is None else np.asarray(action_bias, dtype=np.float32)
+        self.version = version
+
+    @classmethod
+    def default(cls):
+        mean = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        scale = np.ones(len(FEATURE_NAMES), dtype=np.float32)
+        weights = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+        for name, (center, spread, weight) in _DEFAULT_BOT_WEIGHTS.items():
+            i = FEATURE_NAMES.index(name)
+            mean[i], scale[i], weights[i] = center, spread, weight
+        return cls(mean, scale, weights, bot_bias=-0.5)
+
+    def save(self, path):
+        """
+        Write the policy as a small .npz (a few KB), atomically, so a
+        process polling the file never sees a partial write.
+        """
+        arrays = {
+            "feature_names": np.array(FEATURE_NAMES),
+            "actions": np.array(ACTIONS),
+            "mean": self.mean,
+            "scale": self.scale,
+            "bot_weights": self.bot_weights,
+            "bot_bias": np.float32(self.bot_bias),
+            "version": np.int64(self.version),
+        }
+        if self.action_weights is not None:
+            arrays["action_weights"] = self.action_weights
+            arrays["action_bias"] = self.action_bias
+        tmp = f"{path}.tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """Read a policy written by save(); refuses files built for other features or actions"""
+        with np.load(path) as data:
+            if tuple(data["feature_names"]) != tuple(FEATURE_NAMES) or tuple(data["actions"]) != ACTIONS:
+                raise ValueError(f"{path} was trained for a different feature or action set")
+            return cls(
+                data["mean"], data["scale"], data["bot_weights"], float(data["bot_bias"]),
+                action_weights=data["action_weights"] if "action_weights" in data else None,
+                action_bias=data["action_bias"] if "action_bias" in data else None,
+                version=int(data["version"])
+            )
+
+    def standardize(self, X):
+        return (np.asarray(X, dtype=np.float32) - self.mean) / self.scale
+
+    def score(self, X):
+        """Probability that each row is a bot"""
+        return _sigmoid(self.standardize(X) @ self.bot_weights + self.bot_bias)
+
+    def act(self, X):
+        """Return (bot_scores, action_indices) for an (n, dim) feature matrix"""
+        Z = self.standardize(X)
+        scores = _sigmoid(Z @ self.bot_weights + self.bot_bias)
+        if self.action_weights is not None:
+            actions = np.argmax(Z @ self.action_weights + self.action_bias, axis=1)
+        else:
+            actions = np.searchsorted(ACTION_THRESHOLDS, scores, side="right")
+        return scores, actions
+
+
+def describe_action(index):
+    """Action name plus the challenge it serves, for API responses"""
+    name = ACTIONS[int(index)]
+    challenge_type, difficulty = ACTION_CHALLENGES[name]
+    return {"action": name, "challenge_type": challenge_type, "difficulty_level": difficulty}
@@ -0,0 +1,309 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from db import get_pool
+from features import FEATURE_NAMES
+from policy import ACTIONS
+from state_codec import decode_states
+
+STATE_DIM = len(FEATURE_NAMES)
+
+
+class SumTree:
+    """
+    Binary sum tree over `capacity` leaf priorities, stored in one flat array.
+
+    Node i has children 2i and 2i+1; leaves start at index `size`. Updates
+    and prefix-sum lookups for a whole batch run level by level with array
+    operations instead of one Python walk per item.
+    """
+
+    def __init__(self, capacity, tree=None):
+        self.size = 1 << max(int(capacity - 1).bit_length(), 0)
+        self.depth = self.size.bit_length() - 1
+        self.tree = tree if tree is not None else np.zeros(2 * self.size, dtype=np.float64)
+
+    @property
+    def total(self):
+        return float(self.tree[1])
+
+    def leaves(self):
+        return self.tree[self.size:]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices, dtype=np.int64) + self.size
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def rebuild(self):
+        """Recompute every internal node from the leaves"""
+        for level in range(self.depth - 1, -1, -1):
+            start = 1 << level
+            nodes = np.arange(start, 2 * start)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def find(self, targets, out, scratch, go_right):
+        """
+        Leaf index whose prefix-sum interval contains each target.
+
+        targets is overwritten; scratch (float64) and go_right (bool) are
+        arrays the size of targets, so the descent allocates nothing.
+        """
+        out[:] = 1
+        for _ in range(self.depth):
+            out *= 2
+            np.take(self.tree, out, out=scratch)
+            np.greater_equal(targets, scratch, out=go_right)
+            scratch *= go_right
+            targets -= scratch
+            out += go_right
+        out -= self.size
+        return out
+
+
+class ReplayBuffer:
+    """
+    Fixed-capacity ring buffer of (state, action, reward, next_state) transitions.
+
+    All storage is preallocated NumPy arrays, optionally memory-mapped under
+    `path` so a restarted trainer picks up where it left off. sample() and
+    sample_prioritized() write into buffers allocated once per batch size,
+    so the training loop does not allocate per minibatch.
+    """
+
+    def __init__(self, capacity, state_dim=STATE_DIM, path=None, prioritized=False,
+                 alpha=0.6, seed=None):
+        self.capacity = capacity
+        self.state_dim = state_dim
+        self.path = path
+        self.alpha = alpha
+        self.rng = np.random.default_rng(seed)
+        self.size = 0
+        self.pos = 0
+        self.max_priority = 1.0
+
+        arrays = {
+            "states": ((capacity, state_dim), np.float32),
+            "actions": ((capacity,), np.int64),
+            "rewards": ((capacity,), np.float32),
+            "next_states": ((capacity, state_dim), np.float32),
+        }
+        if prioritized:
+            arrays["priorities"] = ((2 * SumTree(capacity).size,), np.float64)
+
+        meta = self._load_meta()
+        for name, (shape, dtype) in arrays.items():
+            setattr(self, name, self._allocate(name, shape, dtype, reuse=meta is not None))
+        if meta is not None:
+            self.size, self.pos = meta["size"], meta["pos"]
+            self.max_priority = meta.get("max_priority", 1.0)
+
+        self.tree = SumTree(capacity, self.priorities) if prioritized else None
+        if self.tree is not None and meta is not None:
+            self.tree.rebuild()
+        self._batch = {}
+
+    def _meta_path(self):
+        return os.path.join(self.path, "meta.json")
+
+    def _load_meta(self):
+        if self.path is None or not os.path.exists(self._meta_path()):
+            return None
+        with open(self._meta_path()) as f:
+            meta = json.load(f)
+        if meta["capacity"] != self.capacity or meta["state_dim"] != self.state_dim:
+            raise ValueError(f"Replay buffer at {self.path} has a different capacity or state_dim")
+        return meta
+
+    def _allocate(self, name, shape, dtype, reuse):
+        if self.path is None:
+            return np.zeros(shape, dtype=dtype)
+        os.makedirs(self.path, exist_ok=True)
+        file_path = os.path.join(self.path, f"{name}.npy")
+        if reuse and os.path.exists(file_path):
+            return np.lib.format.open_memmap(file_path, mode="r+")
+        return np.lib.format.open_memmap(file_path, mode="w+", dtype=dtype, shape=shape)
+
+    def __len__(self):
+        return self.size
+
+    def add_batch(self, states, actions, rewards, next_states):
+        """Append n transitions, overwriting the oldest once the buffer is full"""
+        n = len(actions)
+        if n > self.capacity:
+            states, actions = states[-self.capacity:], actions[-self.capacity:]
+            rewards, next_states = rewards[-self.capacity:], next_states[-self.capacity:]
+            n = self.capacity
+        idx = (self.pos + np.arange(n)) % self.capacity
+        self.states[idx] = states
+        self.actions[idx] = actions
+        self.rewards[idx] = rewards
+        self.next_states[idx] = next_states
+        if self.tree is not None:
+            # New transitions get the highest priority seen so they are sampled at least once
+            self.tree.update(idx, self.max_priority ** self.alpha)
+        self.pos = (self.pos + n) % self.capacity
+        self.size = min(self.size + n, self.capacity)
+
+    def add(self, state, action, reward, next_state):
+        self.add_batch(np.asarray(state)[None], np.asarray([action]), np.asarray([reward]),
+                       np.asarray(next_state)[None])
+
+    def _buffers(self, batch_size):
+        batch = self._batch.get(batch_size)
+        if batch is None:
+            batch = {
+                "indices": np.empty(batch_size, dtype=np.int64),
+                "states": np.empty((batch_size, self.state_dim), dtype=np.float32),
+                "actions": np.empty(batch_size, dtype=np.int64),
+                "rewards": np.empty(batch_size, dtype=np.float32),
+                "next_states": np.empty((batch_size, self.state_dim), dtype=np.float32),
+                "weights": np.ones(batch_size, dtype=np.float32),
+                "_uniform": np.empty(batch_size, dtype=np.float64),
+                "_scratch": np.empty(batch_size, dtype=np.float64),
+                "_go_right": np.empty(batch_size, dtype=bool),
+                "_strata": np.arange(batch_size, dtype=np.float64),
+            }
+            self._batch[batch_size] = batch
+        return batch
+
+    def _gather(self, batch):
+        idx = batch["indices"]
+        np.take(self.states, idx, axis=0, out=batch["states"])
+        np.take(self.actions, idx, out=batch["actions"])
+        np.take(self.rewards, idx, out=batch["rewards"])
+        np.take(self.next_states, idx, axis=0, out=batch["next_states"])
+        return batch
+
+    def sample(self, batch_size):
+        """
+        Uniform minibatch. The returned dict's arrays are reused by the next
+        call with the same batch_size; copy them if they must outlive it.
+        """
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        batch = self._buffers(batch_size)
+        u = batch["_uniform"]
+        self.rng.random(out=u)
+        u *= self.size
+        batch["indices"][:] = u
+        batch["weights"].fill(1.0)
+        return self._gather(batch)
+
+    def sample_prioritized(self, batch_size, beta=0.4):
+        """Stratified proportional sample; batch["weights"] holds importance-sampling weights"""
+        if self.tree is None:
+            raise ValueError("Replay buffer was created without prioritized=True")
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        batch = self._buffers(batch_size)
+        u = batch["_uniform"]
+        total = self.tree.total
+        segment = total / batch_size
+
+        # One target per equal-mass segment of the priority range
+        self.rng.random(out=u)
+        u += batch["_strata"]
+        u *= segment
+        np.minimum(u, np.nextafter(total, 0), out=u)
+        idx = self.tree.find(u, batch["indices"], batch["_scratch"], batch["_go_right"])
+        np.minimum(idx, self.size - 1, out=idx)
+
+        weights = batch["weights"]
+        np.take(self.tree.leaves(), idx, out=u)
+        u /= total
+        u *= self.size
+        np.power(u, -beta, out=u)
+        u /= u.max()
+        weights[:] = u
+        return self._gather(batch)
+
+    def update_priorities(self, indices, td_errors, eps=1e-6):
+        """Set new priorities (|TD error| + eps) for previously sampled indices"""
+        if self.tree is None:
+            raise ValueError("Replay buffer was created without prioritized=True")
+        priorities = np.abs(td_errors) + eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.tree.update(indices, priorities ** self.alpha)
+
+    def flush(self):
+        """Persist a memory-mapped buffer's contents and write/read position"""
+        if self.path is None:
+            return
+        for name in ("states", "actions", "rewards", "next_states", "priorities"):
+            array = getattr(self, name, None)
+            if isinstance(array, np.memmap):
+                array.flush()
+        with open(self._meta_path(), "w") as f:
+            json.dump({
+                "capacity": self.capacity,
+                "state_dim": self.state_dim,
+                "size": self.size,
+                "pos": self.pos,
+                "max_priority": self.max_priority,
+                "actions": list(ACTIONS),
+            }, f)
+
+
+def load_from_db(buffer, chunk_size=10000, actions=ACTIONS):
+    """
+    Stream every rl_experience row into the buffer, chunk_size rows at a time.
+
+    Uses a server-side cursor so only one chunk is in memory. States are
+    read from the packed state_bin/next_state_bin columns, falling back to
+    the JSON columns for rows that have not been migrated. Rows whose
+    action_taken is not in `actions` are skipped. Returns the number of
+    transitions loaded.
+    """
+    action_index = {name: i for i, name in enumerate(actions)}
+    loaded = 0
+
+    with get_pool().connection() as conn:
+        with conn.cursor(name="replay_load") as cur:
+            cur.itersize = chunk_size
+            cur.execute("""
+                SELECT state_bin, state, next_state_bin, next_state,
+                       action_taken, reward
+                FROM rl_experience
+            """)
+            while True:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                rows = [row for row in rows if row[4] in action_index]
+                if not rows:
+                    continue
+                states = decode_states([row[0] if row[0] is not None else row[1] for row in rows])
+                next_states = decode_states([row[2] if row[2] is not None else row[3] for row in rows])
+                action_ids = np.fromiter((action_index[row[4]] for row in rows), dtype=np.int64, count=len(rows))
+                rewards = np.fromiter((row[5] or 0.0 for row in rows), dtype=np.float32, count=len(rows))
+                buffer.add_batch(states[:, :buffer.state_dim], action_ids, rewards, next_states[:, :buffer.state_dim])
+                loaded += len(rows)
+
+    buffer.flush()
+    return loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load rl_experience into a memory-mapped replay buffer")
+    parser.add_argument("--path", default="replay_buffer", help="directory for the .npy files")
+    parser.add_argument("--capacity", type=int, default=1_000_000)
+    parser.add_argument("--chunk-size", type=int, default=10000)
+    parser.add_argument("--prioritized", action="store_true")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    buffer = ReplayBuffer(args.capacity, path=args.path, prioritized=args.prioritized)
+    loaded = load_from_db(buffer, chunk_size=args.chunk_size)
+    print(f"Loaded {loaded} transitions into {args.path} ({len(buffer)} stored) "
+          f"in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+"""
+Time-range partitions for the high-volume tables, and retention by
+dropping whole partitions.
+
+    python retention.py [--premake-days 7] [--dry-run] [--event-id-hours 48]
+        [--keep-days mousedynamics=30 keystrokedynamics=30 rl_experience=365]
+
+Each run creates the partitions for the next --premake-days and drops every
+partition whose upper bound is older than its table's retention window.
+Dropping a partition is a catalog change, so it is instant and leaves no
+dead tuples behind, unlike DELETE. Run it daily (cron) — rows that arrive
+for a range with no partition land in the table's DEFAULT partition and are
+moved out when that range's partition is created.
+
+It also deletes telemetry_event_ids entries older than --event-id-hours. A
+client retrying a batch after that long would get its rows stored twice;
+the table is not partitioned, so this is a batched DELETE and it should
+stay far smaller than the telemetry it guards.
+"""
+import argparse
+import os
+import re
+from datetime import datetime, timedelta, timezone
+
+from db import transaction
+
+# table -> (partition column, partition width, default retention in days)
+PARTITIONED_TABLES = {
+    "mousedynamics": ("event_time", "day", int(os.getenv("RETENTION_TELEMETRY_DAYS", 30))),
+    "keystrokedynamics": ("event_time", "day", int(os.getenv("RETENTION_TELEMETRY_DAYS", 30))),
+    "rl_experience": ("created_at", "month", int(os.getenv("RETENTION_EXPERIENCE_DAYS", 365))),
+}
+
+EVENT_ID_HOURS = int(os.getenv("RETENTION_EVENT_ID_HOURS", 48))
+
+_UPPER_BOUND = re.compile(r"TO \('([^']+)'\)")
+
+
+def range_start(when, width):
+    """Start of the day/month containing `when` (UTC)"""
+    when = when.astimezone(timezone.utc)
+    if width == "month":
+        return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    return when.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_range_start(start, width):
+    if width == "month":
+        return (start + timedelta(days=32)).replace(day=1)
+    return start + timedelta(days=1)
+
+
+def partition_name(table, start, width):
+    return f"{table}_p{start:%Y%m}" if width == "month" else f"{table}_p{start:%Y%m%d}"
+
+
+def list_partitions(cur, table):
+    """Return [(name, upper_bound or None)] for every partition of `table`"""
+    cur.execute("""
+        SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = %s::regclass
+        ORDER BY c.relname
+    """, (table,))
+    partitions = []
+    for name, bound in cur.fetchall():
+        match = _UPPER_BOUND.search(bound or "")
+        upper = datetime.fromisoformat(match.group(1)) if match else None
+        partitions.append((name, upper))
+    return partitions
+
+
+def create_partition(cur, table, start, end, name):
+    """
+    Attach a [start, end) partition, first moving any rows for that range
+    out of the DEFAULT partition (ATTACH refuses to overlap rows there).
+    """
+    column = PARTITIONED_TABLES[table][0]
+    cur.execute(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    cur.execute(f"""
+        WITH moved AS (
+            DELETE FROM {table}_default WHERE {column} >= %s AND {column} < %s RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """, (start, end))
+    cur.execute(f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM (%s) TO (%s)", (start, end))
+
+
+def ensure_partitions(cur, table, start, end):
+    """Create the missing day/month partitions of `table` covering [start, end)"""
+    width = PARTITIONED_TABLES[table][1]
+    existing = {name for name, _ in list_partitions(cur, table)}
+    created = []
+    current = range_start(start, width)
+    while current < end:
+        following = next_range_start(current, width)
+        name = partition_name(table, current, width)
+        if name not in existing:
+            create_partition(cur, table, current, following, name)
+            created.append(name)
+        current = following
+    return created
+
+
+def expired_partitions(cur, table, keep_days, now=None):
+    """Partitions of `table` whose whole range is older than keep_days"""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=keep_days)
+    return [name for name, upper in list_partitions(cur, table) if upper is not None and upper <= cutoff]
+
+
+def drop_partitions(cur, table, names):
+    for name in names:
+        cur.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+        cur.execute(f"DROP TABLE {name}")
+
+
+def prune_event_ids(cur, keep_hours, now=None, limit=50000):
+    """Delete up to `limit` telemetry_event_ids older than keep_hours; returns the count"""
+    cutoff = (now or datetime.now(timezone.utc)) - timedelta(hours=keep_hours)
+    cur.execute("""
+        DELETE FROM telemetry_event_ids
+        WHERE (kind, event_id) IN (
+            SELECT kind, event_id FROM telemetry_event_ids
+            WHERE seen_at < %s
+            LIMIT %s
+        )
+    """, (cutoff, limit))
+    return cur.rowcount
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--premake-days", type=int, default=7, help="create partitions this far ahead")
+    parser.add_argument("--keep-days", nargs="*", default=[], metavar="TABLE=DAYS",
+                        help="override a table's retention window")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would be dropped")
+    parser.add_argument("--event-id-hours", type=int, default=EVENT_ID_HOURS,
+                        help="how long ids of stored events are kept for deduplicating retries")
+    args = parser.parse_args()
+
+    keep = {table: days for table, (_, _, days) in PARTITIONED_TABLES.items()}
+    for item in args.keep_days:
+        table, _, days = item.partition("=")
+        if table.lower() not in keep:
+            parser.error(f"unknown table {table!r}; expected one of {sorted(keep)}")
+        keep[table.lower()] = int(days)
+
+    now = datetime.now(timezone.utc)
+    for table in PARTITIONED_TABLES:
+        with transaction() as cur:
+            if not args.dry_run:
+                created = ensure_partitions(cur, table, now, now + timedelta(days=args.premake_days + 1))
+                for name in created:
+                    print(f"{table}: created {name}")
+            expired = expired_partitions(cur, table, keep[table], now)
+            for name in expired:
+                print(f"{table}: {'would drop' if args.dry_run else 'dropping'} {name}")
+            if not args.dry_run:
+                drop_partitions(cur, table, expired)
+
+    if not args.dry_run:
+        pruned = limit = 50000
+        total = 0
+        # One transaction per chunk keeps locks and WAL bursts small
+        while pruned == limit:
+            with transaction() as cur:
+                pruned = prune_event_ids(cur, args.event_id_hours, now, limit)
+            total += pruned
+        print(f"telemetry_event_ids: deleted {total} ids older than {args.event_id_hours}h")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,233 @@
-from flask import request
-from main import app
-
-@app.route('/')
+import atexit
+import os
+from datetime import datetime, timezone
+
+from flask import Blueprint, current_app, request, jsonify
+import db
+import metrics
+from aggregator import SessionAggregator
+from db import get_pool, transaction
+from event_codec import UnsupportedEncoding, decode_body, parse_batch, validate_events
+from features import extract_features, feature_vector
+from ingest import EventWriter, QueueFull
+from policy import describe_action
+from rules import RuleSet
+from scoring import MicroBatcher, Overloaded, ScoringTimeout
+from session_view import SummaryRefresher, TTLCache, fetch_summaries, mark_dirty
+
+MAX_FEATURE_BATCH = int(os.getenv("SESSION_FEATURES_MAX_BATCH", 500))
+
+bp = Blueprint("api", __name__)
+
+
+def init_app(app):
+    """
+    Build the ingest, aggregation and scoring workers into app.extensions,
+    register the routes and export the workers' stats to /metrics.
+
+    The workers' threads start lazily on first use; stop_workers() flushes
+    and stops them, and runs at interpreter exit.
+    """
+    if os.getenv("INGEST_SPOOL_DIR"):
+        from spool import SpoolWriter
+        event_writer = SpoolWriter.from_env()
+    else:
+        event_writer = EventWriter.from_env()
+    feature_cache = TTLCache.from_env()
+    app.extensions["event_writer"] = event_writer
+    app.extensions["session_aggregator"] = SessionAggregator.from_env()
+    app.extensions["scorer"] = MicroBatcher.from_env()
+    app.extensions["prefilter"] = RuleSet.from_env()
+    app.extensions["feature_cache"] = feature_cache
+    app.extensions["summary_refresher"] = SummaryRefresher.from_env(on_refresh=feature_cache.invalidate)
+    atexit.register(stop_workers, app)
+
+    app.register_blueprint(bp)
+    for prefix, name in [("ingest", "event_writer"), ("sessions", "session_aggregator"),
+                         ("scoring", "scorer"), ("prefilter", "prefilter"),
+                         ("feature_cache", "feature_cache"), ("session_view", "summary_refresher")]:
+        metrics.register_stats(prefix, app.extensions[name].stats)
+    metrics.register_stats("db_pool", lambda: db._pool.stats() if db._pool is not None else {})
+
+
+def stop_workers(app):
+    """Write out queued events and session snapshots and stop the background threads"""
+    app.extensions["event_writer"].stop()
+    app.extensions["summary_refresher"].stop()
+    app.extensions["session_aggregator"].close()
+
+
+@bp.route('/')
 def index():
     return "Hello, World"
 
 
-# IGNORE ALL THIS JUNK BELOW!
-
-@app.route("/api/events", methods=["POST"])
+@bp.route("/api/events", methods=["POST"])
 def events():
-    events = request.json.get("events", [])
-    return events
-    # return {"status": "ok"}
+    """
+    Telemetry batch, as {"session_id", "events": [...]} or the columnar
+    format (see event_codec.py); JSON or MessagePack, optionally gzip/deflate.
+    """
+    try:
+        data = decode_body(request.get_data(), request.headers.get("Content-Encoding"), request.content_type)
+    except UnsupportedEncoding as e:
+        return jsonify({"error": str(e)}), 415
+    except ValueError:
+        data = {}
+    try:
+        session_id, events, arrays, count = parse_batch(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    event_writer = current_app.extensions["event_writer"]
+    try:
+        if arrays is not None:
+            queued = event_writer.submit_arrays(session_id, arrays)
+        else:
+            queued = event_writer.submit(session_id, events)
+    except QueueFull:
+        return jsonify({"error": "Event queue is full, retry later"}), 503
+
+    session_aggregator = current_app.extensions["session_aggregator"]
+    if arrays is not None:
+        session_aggregator.update_arrays(session_id, arrays)
+    else:
+        session_aggregator.update(session_id, events)
+    current_app.extensions["feature_cache"].invalidate(session_id)
+    current_app.extensions["summary_refresher"].start()
+    return jsonify({"status": "ok" if queued else "dropped", "events": count}), 202
+
+
+@bp.route("/api/events/stats", methods=["GET"])
+def events_stats():
+    return jsonify(current_app.extensions["event_writer"].stats())
+
+
+@bp.route("/api/score", methods=["POST"])
+def score():
+    """
+    Bot score and challenge decision for a session.
+
+    Uses the session's live aggregated features when it is being tracked;
+    otherwise the request must carry the raw "events" to score. "rule" names
+    the prefilter rule that decided the session, or is null if the policy did.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        data = {}
+    session_id = data.get("session_id")
+    if session_id is not None and not isinstance(session_id, str):
+        return jsonify({"error": "session_id must be a string"}), 400
+    vector = current_app.extensions["session_aggregator"].vector(session_id) if session_id else None
+    if vector is None:
+        if "events" not in data:
+            return jsonify({"error": "Unknown session_id and no events given"}), 400
+        try:
+            events = validate_events(data["events"])
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        vector = feature_vector(extract_features(events))
+
+    # Obvious bots and humans are decided by rules.json without touching the policy
+    rule = current_app.extensions["prefilter"].check(vector)
+    if rule is not None:
+        bot_score, action = rule.bot_score, rule.action_index
+    else:
+        try:
+            bot_score, action = current_app.extensions["scorer"].score(vector)
+        except Overloaded:
+            return jsonify({"error": "Scoring queue is full, retry later"}), 503
+        except ScoringTimeout:
+            return jsonify({"error": "Scoring timed out, retry later"}), 503
+
+    return jsonify({"session_id": session_id, "bot_score": bot_score,
+                    "rule": rule.name if rule is not None else None, **describe_action(action)})
+
+
+@bp.route("/api/score/stats", methods=["GET"])
+def score_stats():
+    return jsonify({**current_app.extensions["scorer"].stats(),
+                    "prefilter": current_app.extensions["prefilter"].stats()})
+
+
+@bp.route("/api/sessions/<session_id>/end", methods=["POST"])
+def end_session(session_id):
+    with transaction() as cur:
+        cur.execute("""
+            UPDATE sessions SET session_status = %s, session_end_time = %s
+            WHERE session_id = %s
+        """, ("ended", datetime.now(timezone.utc), session_id))
+        found = cur.rowcount > 0
+        mark_dirty(cur, [session_id])
+
+    current_app.extensions["session_aggregator"].end_session(session_id)
+    current_app.extensions["feature_cache"].invalidate(session_id)
+    if not found:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify({"message": "Session ended"})
+
+
+def _session_features(session_ids):
+    """Summaries for session_ids from the cache, then session_feature_summary"""
+    feature_cache = current_app.extensions["feature_cache"]
+    found, missing = feature_cache.get_many(session_ids)
+    if missing:
+        current_app.extensions["summary_refresher"].start()
+        with transaction() as cur:
+            fetched = fetch_summaries(cur, missing)
+        feature_cache.put_many(fetched)
+        found.update(fetched)
+    return found
+
+
+@bp.route("/api/sessions/<session_id>/features", methods=["GET"])
+def session_features(session_id):
+    """
+    Everything known about one session: metadata, telemetry aggregates,
+    challenges and the last feature snapshot (see session_view.py).
+    """
+    summary = _session_features([session_id]).get(session_id)
+    if summary is None:
+        return jsonify({"error": "Session not found"}), 404
+    return jsonify(summary)
+
+
+@bp.route("/api/sessions/features", methods=["POST"])
+def sessions_features():
+    """Batch lookup: {"session_ids": [...]} -> {"sessions": {id: summary}, "missing": [...]}"""
+    data = request.get_json(silent=True) or {}
+    session_ids = data.get("session_ids")
+    if not isinstance(session_ids, list) or not all(isinstance(s, str) for s in session_ids):
+        return jsonify({"error": "session_ids must be a list of strings"}), 400
+    if len(session_ids) > MAX_FEATURE_BATCH:
+        return jsonify({"error": f"At most {MAX_FEATURE_BATCH} session_ids per request"}), 400
+
+    session_ids = list(dict.fromkeys(session_ids))
+    found = _session_features(session_ids)
+    return jsonify({"sessions": found, "missing": [s for s in session_ids if s not in found]})
+
+
+@bp.route("/api/sessions/stats", methods=["GET"])
+def sessions_stats():
+    return jsonify(current_app.extensions["session_aggregator"].stats())
+
+
+@bp.route("/api/db/stats", methods=["GET"])
+def db_stats():
+    return jsonify(get_pool().stats())
 
 
+# IGNORE ALL THIS JUNK BELOW!
 
 # sample post for /api/events using curl in powershell
 # curl -Method POST http://localhost:8080/api/events `
 #   -Headers @{ "Content-Type"="application/json" } `
 #   -Body '{
+#     "session_id": "abc123",
 #     "events": [
-#       { "type": "page_view", "page": "/home", "timestamp": "2025-01-01T12:00:00Z" },
-#       { "type": "login", "user_id": 42, "timestamp": "2025-01-01T12:01:30Z" }
+#       { "type": "mousemove", "movement_speed": 412.5, "pause_duration": 0.12 },
+#       { "type": "click", "honeypot_clicked": false },
+#       { "type": "keydown", "typing_speed": 5.3 }
 #     ]
 #   }'
 
@@ -0,0 +1,130 @@
+"""
+Rule-based prefilter that runs before the policy.
+
+Rules live in a JSON file (SCORING_RULES_PATH, default rules.json next to
+this module), checked in order; the first rule whose conditions all hold
+decides the session:
+
+    [
+      {"name": "honeypot", "when": [["honeypot_clicked", ">", 0]],
+       "action": "block", "bot_score": 1.0},
+      ...
+    ]
+
+Each condition is [feature, operator, value] over features.FEATURE_NAMES.
+The rule set is compiled once into index/threshold arrays, so a whole
+feature matrix is checked with a handful of NumPy operations regardless of
+how many rules there are.
+"""
+import json
+import os
+import threading
+
+import numpy as np
+
+from features import FEATURE_NAMES
+from policy import ACTIONS
+
+DEFAULT_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rules.json")
+
+OPERATORS = {
+    "<": np.less,
+    "<=": np.less_equal,
+    ">": np.greater,
+    ">=": np.greater_equal,
+    "==": np.equal,
+    "!=": np.not_equal,
+}
+
+
+class Rule:
+    __slots__ = ("name", "action", "action_index", "bot_score", "conditions")
+
+    def __init__(self, name, when, action, bot_score):
+        if action not in ACTIONS:
+            raise ValueError(f"rule {name!r}: unknown action {action!r}")
+        if not when:
+            raise ValueError(f"rule {name!r}: needs at least one condition")
+        for feature, op, _ in when:
+            if feature not in FEATURE_NAMES:
+                raise ValueError(f"rule {name!r}: unknown feature {feature!r}")
+            if op not in OPERATORS:
+                raise ValueError(f"rule {name!r}: unknown operator {op!r}")
+        self.name = name
+        self.action = action
+        self.action_index = ACTIONS.index(action)
+        self.bot_score = float(bot_score)
+        self.conditions = [(feature, op, float(value)) for feature, op, value in when]
+
+
+class RuleSet:
+    """
+    Ordered rules compiled to vectorized predicates.
+
+    Conditions of all rules are laid out rule after rule; evaluating a
+    matrix gathers the needed columns once, applies each operator to the
+    conditions that use it, and ANDs each rule's run of conditions with
+    np.logical_and.reduceat.
+    """
+
+    def __init__(self, rules):
+        self.rules = list(rules)
+        conditions = [(i, feature, op, value) for i, rule in enumerate(self.rules)
+                      for feature, op, value in rule.conditions]
+        self._columns = np.array([FEATURE_NAMES.index(c[1]) for c in conditions], dtype=np.int64)
+        self._thresholds = np.array([c[3] for c in conditions], dtype=np.float32)
+        self._by_op = [(OPERATORS[op], np.array([j for j, c in enumerate(conditions) if c[2] == op]))
+                       for op in OPERATORS if any(c[2] == op for c in conditions)]
+        self._starts = np.cumsum([0] + [len(rule.conditions) for rule in self.rules[:-1]])
+        self.action_index = np.array([rule.action_index for rule in self.rules], dtype=np.int64)
+        self.bot_score = np.array([rule.bot_score for rule in self.rules], dtype=np.float32)
+        self._lock = threading.Lock()
+        self._fired = np.zeros(len(self.rules), dtype=np.int64)
+        self._evaluated = 0
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(Rule(r["name"], r["when"], r["action"], r.get("bot_score", 1.0)) for r in config)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_config(json.load(f))
+
+    @classmethod
+    def from_env(cls):
+        """Rules from SCORING_RULES_PATH (empty string disables the prefilter)"""
+        path = os.getenv("SCORING_RULES_PATH", DEFAULT_RULES_PATH)
+        return cls.load(path) if path else cls([])
+
+    def match(self, X):
+        """Index of the first rule each row of X matches, or -1"""
+        X = np.atleast_2d(np.asarray(X, dtype=np.float32))
+        if not self.rules:
+            return np.full(X.shape[0], -1, dtype=np.int64)
+        values = X[:, self._columns]
+        hits = np.empty(values.shape, dtype=bool)
+        for op, idx in self._by_op:
+            hits[:, idx] = op(values[:, idx], self._thresholds[idx])
+        matched = np.logical_and.reduceat(hits, self._starts, axis=1)
+        first = np.argmax(matched, axis=1)
+        first[~matched.any(axis=1)] = -1
+
+        with self._lock:
+            self._evaluated += X.shape[0]
+            self._fired += np.bincount(first[first >= 0], minlength=len(self.rules))
+        return first
+
+    def check(self, vector):
+        """The Rule deciding a single feature vector, or None to fall through to the policy"""
+        i = int(self.match(vector)[0])
+        return self.rules[i] if i >= 0 else None
+
+    def stats(self):
+        with self._lock:
+            fired = self._fired.copy()
+            evaluated = self._evaluated
+        stats = {"evaluated": evaluated, "short_circuited": int(fired.sum())}
+        stats["passed_to_policy"] = evaluated - stats["short_circuited"]
+        stats.update({f"rule_{rule.name}": int(n) for rule, n in zip(self.rules, fired)})
+        return stats
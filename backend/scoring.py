@@ -0,0 +1,209 @@
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+import numpy as np
+
+from features import FEATURE_NAMES
+from policy import LinearPolicy
+
+logger = logging.getLogger(__name__)
+
+# Histogram bucket upper bounds; the last bucket catches everything above
+WAIT_MS_BUCKETS = (0.5, 1, 2, 5, 10, 20, 50, 100)
+
+# Written by train_policy.py; the default hand-tuned policy is used until it exists
+DEFAULT_POLICY_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "policy.npz")
+
+
+class Overloaded(Exception):
+    """Raised by MicroBatcher.submit() when the request queue is full"""
+
+
+class ScoringTimeout(Exception):
+    """Raised by MicroBatcher.score() when the worker did not get to the request in time"""
+
+
+class MicroBatcher:
+    """
+    Collects concurrent scoring requests and scores them together.
+
+    A single worker thread takes the first waiting request, keeps gathering
+    until it has `max_batch` rows or `max_wait_ms` has passed, copies them
+    into one preallocated matrix and runs the policy once. Each caller
+    blocks on its own Future and gets back its own (bot_score, action).
+
+    With `policy_path` set, the worker checks the file's mtime at most every
+    `reload_s` seconds and swaps in the new policy between batches, so a
+    retrained policy goes live without a restart.
+    """
+
+    def __init__(self, policy=None, max_batch=64, max_wait_ms=2.0, max_queue=10000,
+                 policy_path=None, reload_s=5.0):
+        self.policy = policy or LinearPolicy.default()
+        self.policy_path = policy_path
+        self.reload_s = reload_s
+        self._policy_mtime = None
+        self._next_reload_check = 0.0
+        self.reloads = 0
+        self.reload_failures = 0
+        self.max_batch = max_batch
+        self.max_wait_ms = max_wait_ms
+        self.queue = queue.Queue(maxsize=max_queue)
+        self._matrix = np.zeros((max_batch, len(FEATURE_NAMES)), dtype=np.float32)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._batch_sizes = np.zeros(max_batch + 1, dtype=np.int64)
+        self._wait_hist = np.zeros(len(WAIT_MS_BUCKETS) + 1, dtype=np.int64)
+        self.rejected = 0
+        self.timed_out = 0
+        self.skipped = 0
+        self.batches = 0
+        self.items = 0
+
+    @classmethod
+    def from_env(cls, policy=None):
+        """Build a batcher from SCORING_* environment variables"""
+        batcher = cls(
+            policy=policy,
+            max_batch=int(os.getenv("SCORING_MAX_BATCH", 64)),
+            max_wait_ms=float(os.getenv("SCORING_MAX_WAIT_MS", 2.0)),
+            max_queue=int(os.getenv("SCORING_MAX_QUEUE", 10000)),
+            policy_path=os.getenv("SCORING_POLICY_PATH", DEFAULT_POLICY_PATH) or None,
+            reload_s=float(os.getenv("SCORING_POLICY_RELOAD_S", 5.0))
+        )
+        if policy is None:
+            batcher.reload_policy()
+        return batcher
+
+    def reload_policy(self):
+        """Load policy_path if it changed since the last load; returns True if swapped"""
+        if self.policy_path is None:
+            return False
+        try:
+            mtime = os.stat(self.policy_path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+        if mtime == self._policy_mtime:
+            return False
+        self._policy_mtime = mtime
+        try:
+            self.policy = LinearPolicy.load(self.policy_path)
+        except Exception as e:
+            self.reload_failures += 1
+            logger.warning("scoring: keeping policy v%s, could not load %s: %s",
+                           self.policy.version, self.policy_path, e)
+            return False
+        self.reloads += 1
+        return True
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="micro-batcher", daemon=True)
+                self._thread.start()
+
+    def submit(self, vector):
+        """Queue one FEATURE_NAMES-ordered vector; returns a Future of (bot_score, action_index)"""
+        self.start()
+        future = Future()
+        try:
+            self.queue.put_nowait((vector, future, time.perf_counter()))
+        except queue.Full:
+            with self._stats_lock:
+                self.rejected += 1
+            raise Overloaded()
+        return future
+
+    def score(self, vector, timeout=1.0):
+        """
+        Block for one vector's (bot_score, action_index). On timeout the
+        request is cancelled, so the worker skips it, and ScoringTimeout is
+        raised.
+        """
+        future = self.submit(vector)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            # Fails only if the worker has just picked it up, which is harmless
+            future.cancel()
+            with self._stats_lock:
+                self.timed_out += 1
+            raise ScoringTimeout() from None
+
+    def stats(self):
+        with self._stats_lock:
+            sizes = self._batch_sizes.copy()
+            waits = self._wait_hist.copy()
+            batches, items, rejected = self.batches, self.items, self.rejected
+            timed_out, skipped = self.timed_out, self.skipped
+        return {
+            "batches": batches,
+            "items": items,
+            "rejected": rejected,
+            "timed_out": timed_out,
+            "skipped_cancelled": skipped,
+            "avg_batch_size": items / batches if batches else 0.0,
+            "queue_depth": self.queue.qsize(),
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait_ms,
+            "max_queue": self.queue.maxsize,
+            "policy_version": self.policy.version,
+            "policy_reloads": self.reloads,
+            "policy_reload_failures": self.reload_failures,
+            "batch_size_histogram": {str(size): int(n) for size, n in enumerate(sizes) if n},
+            "wait_ms_histogram": {
+                (f"le_{bound}" if i < len(WAIT_MS_BUCKETS) else "inf"): int(n)
+                for i, (bound, n) in enumerate(zip(WAIT_MS_BUCKETS + (None,), waits))
+            },
+        }
+
+    def _run(self):
+        while True:
+            batch = [self.queue.get()]
+            deadline = time.perf_counter() + self.max_wait_ms / 1000
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            if self.policy_path is not None and time.monotonic() >= self._next_reload_check:
+                self._next_reload_check = time.monotonic() + self.reload_s
+                self.reload_policy()
+            self._score(batch)
+
+    def _score(self, batch):
+        # Drop requests whose caller gave up; the rest can no longer be cancelled
+        live = [item for item in batch if item[1].set_running_or_notify_cancel()]
+        if len(live) < len(batch):
+            with self._stats_lock:
+                self.skipped += len(batch) - len(live)
+        batch = live
+        n = len(batch)
+        if not n:
+            return
+        started = time.perf_counter()
+        try:
+            for i, (vector, _, _) in enumerate(batch):
+                self._matrix[i] = vector
+            scores, actions = self.policy.act(self._matrix[:n])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+
+        waits_ms = np.array([(started - queued) * 1000 for _, _, queued in batch])
+        with self._stats_lock:
+            self.batches += 1
+            self.items += n
+            self._batch_sizes[n] += 1
+            self._wait_hist += np.bincount(np.searchsorted(WAIT_MS_BUCKETS, waits_ms),
+                                           minlength=len(self._wait_hist))
+
+        for (_, future, _), score, action in zip(batch, scores, actions):
+            future.set_result((float(score), int(action)))
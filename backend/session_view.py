@@ -0,0 +1,351 @@
+"""
+Precomputed per-session feature rows (session_feature_summary) and the
+cache in front of them.
+
+One row per session joins the session itself, its mouse/keystroke
+aggregates (or session_rollups once compacted), its challenges and the
+last feature snapshot from session_features, so readers do a primary-key
+lookup instead of the joins.
+
+The table is maintained incrementally: every writer of telemetry rows
+marks the session in session_feature_dirty in the same transaction
+(mark_dirty()), and refresh() recomputes only the marked sessions. Dirty
+rows are claimed with FOR UPDATE SKIP LOCKED, so any number of refreshers
+(the app's background thread, `python session_view.py --follow`) can run
+side by side.
+
+    python session_view.py [--batch 500] [--follow] [--interval-ms 1000] [--all]
+"""
+import argparse
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+from db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Column order of session_feature_summary after session_id (and of AGGREGATE_SQL)
+SUMMARY_COLUMNS = [
+    "user_id",
+    "ip_address",
+    "session_start_time",
+    "session_end_time",
+    "session_status",
+    "mouse_events",
+    "honeypot_clicks",
+    "movement_speed_avg",
+    "movement_speed_std",
+    "movement_speed_max",
+    "pause_duration_avg",
+    "pause_duration_max",
+    "keystrokes",
+    "typing_speed_avg",
+    "typing_speed_std",
+    "challenges",
+    "challenge_types",
+    "first_event_time",
+    "last_event_time",
+    "features",
+]
+
+# Everything known about the sessions in %(ids)s; raw rows win over
+# session_rollups while a session still has them
+AGGREGATE_SQL = """
+    WITH m AS (
+        SELECT session_id,
+               count(*) AS mouse_events,
+               count(*) FILTER (WHERE honeypot_clicked) AS honeypot_clicks,
+               avg(movement_speed) AS speed_avg,
+               stddev_pop(movement_speed) AS speed_std,
+               max(movement_speed) AS speed_max,
+               avg(pause_duration) AS pause_avg,
+               max(pause_duration) AS pause_max,
+               min(event_time) AS first_time,
+               max(event_time) AS last_time
+        FROM mouseDynamics
+        WHERE session_id = ANY(%(ids)s)
+        GROUP BY session_id
+    ), k AS (
+        SELECT session_id,
+               count(*) AS keystrokes,
+               avg(typing_speed) AS typing_avg,
+               stddev_pop(typing_speed) AS typing_std,
+               min(event_time) AS first_time,
+               max(event_time) AS last_time
+        FROM keystrokeDynamics
+        WHERE session_id = ANY(%(ids)s)
+        GROUP BY session_id
+    ), c AS (
+        SELECT sc.session_id,
+               count(*) AS challenges,
+               string_agg(DISTINCT cc.challenge_type, ',') AS challenge_types
+        FROM s_challenge sc
+        JOIN challengeCAPTCHA cc ON cc.challenge_id = sc.challenge_id
+        WHERE sc.session_id = ANY(%(ids)s)
+        GROUP BY sc.session_id
+    )
+    SELECT s.session_id, s.user_id, s.ip_address,
+           s.session_start_time, s.session_end_time, s.session_status,
+           COALESCE(m.mouse_events, r.mouse_events, 0),
+           COALESCE(m.honeypot_clicks, r.honeypot_clicks, 0),
+           COALESCE(m.speed_avg, r.movement_speed_avg),
+           COALESCE(m.speed_std, r.movement_speed_std),
+           COALESCE(m.speed_max, r.movement_speed_max),
+           COALESCE(m.pause_avg, r.pause_duration_avg),
+           COALESCE(m.pause_max, r.pause_duration_max),
+           COALESCE(k.keystrokes, r.keystrokes, 0),
+           COALESCE(k.typing_avg, r.typing_speed_avg),
+           COALESCE(k.typing_std, r.typing_speed_std),
+           COALESCE(c.challenges, 0),
+           COALESCE(c.challenge_types, ''),
+           COALESCE(LEAST(m.first_time, k.first_time), r.first_event_time),
+           COALESCE(GREATEST(m.last_time, k.last_time), r.last_event_time),
+           f.features::jsonb
+    FROM sessions s
+    LEFT JOIN m ON m.session_id = s.session_id
+    LEFT JOIN k ON k.session_id = s.session_id
+    LEFT JOIN c ON c.session_id = s.session_id
+    LEFT JOIN session_rollups r ON r.session_id = s.session_id
+    LEFT JOIN session_features f ON f.session_id = s.session_id
+    WHERE s.session_id = ANY(%(ids)s)
+"""
+
+UPSERT_SQL = f"""
+    INSERT INTO session_feature_summary (session_id, {", ".join(SUMMARY_COLUMNS)}, refreshed_at)
+    SELECT *, now() FROM ({AGGREGATE_SQL}) AS a
+    ON CONFLICT (session_id) DO UPDATE SET
+        {", ".join(f"{c} = EXCLUDED.{c}" for c in SUMMARY_COLUMNS)},
+        refreshed_at = EXCLUDED.refreshed_at
+"""
+
+
+def mark_dirty(cur, session_ids):
+    """Queue sessions for refresh(); call in the transaction that wrote their rows"""
+    if session_ids:
+        # Sorted so concurrent writers lock the same rows in the same order
+        cur.execute("""
+            INSERT INTO session_feature_dirty (session_id)
+            SELECT unnest(%s::text[])
+            ON CONFLICT DO NOTHING
+        """, (sorted(set(session_ids)),))
+
+
+def refresh(cur, limit=500):
+    """Recompute up to `limit` dirty sessions; returns their ids"""
+    cur.execute("""
+        DELETE FROM session_feature_dirty
+        WHERE session_id IN (
+            SELECT session_id FROM session_feature_dirty
+            ORDER BY marked_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING session_id
+    """, (limit,))
+    ids = [row[0] for row in cur.fetchall()]
+    if ids:
+        cur.execute(UPSERT_SQL, {"ids": ids})
+    return ids
+
+
+def _to_dict(row):
+    values = {"session_id": row[0]}
+    for name, value in zip(SUMMARY_COLUMNS + ["refreshed_at"], row[1:]):
+        values[name] = value.isoformat() if isinstance(value, datetime) else value
+    return values
+
+
+def fetch_summaries(cur, session_ids):
+    """
+    Summary dicts keyed by session_id. Sessions the refresher has not
+    reached yet are computed on the fly; unknown sessions are left out.
+    """
+    cur.execute(f"""
+        SELECT session_id, {", ".join(SUMMARY_COLUMNS)}, refreshed_at
+        FROM session_feature_summary
+        WHERE session_id = ANY(%s)
+    """, (list(session_ids),))
+    found = {row[0]: _to_dict(row) for row in cur.fetchall()}
+    missing = [session_id for session_id in session_ids if session_id not in found]
+    if missing:
+        cur.execute(AGGREGATE_SQL, {"ids": missing})
+        found.update((row[0], _to_dict(row + (None,))) for row in cur.fetchall())
+    return found
+
+
+class TTLCache:
+    """
+    Thread-safe LRU of up to `max_entries` values, each valid for `ttl_s`.
+
+    Used for summaries served by /api/sessions/.../features; entries are
+    dropped as soon as new events for the session arrive in this process, and
+    the TTL bounds staleness from writes made elsewhere.
+    """
+
+    def __init__(self, max_entries=10000, ttl_s=5.0):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @classmethod
+    def from_env(cls):
+        return cls(max_entries=int(os.getenv("SESSION_CACHE_MAX", 10000)),
+                   ttl_s=float(os.getenv("SESSION_CACHE_TTL_S", 5.0)))
+
+    def get_many(self, keys):
+        """(found dict, missing keys)"""
+        found = {}
+        missing = []
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is not None and now - entry[0] < self.ttl_s:
+                    self._entries.move_to_end(key)
+                    found[key] = entry[1]
+                else:
+                    missing.append(key)
+            self.hits += len(found)
+            self.misses += len(missing)
+        return found, missing
+
+    def put_many(self, values):
+        now = time.monotonic()
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (now, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                if self._entries.pop(key, None) is not None:
+                    self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "entries": size,
+            "max_entries": self.max_entries,
+            "ttl_s": self.ttl_s,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
+
+
+class SummaryRefresher:
+    """
+    Background thread running refresh() every `interval_ms` (immediately
+    again while a full batch came back) and handing refreshed ids to
+    `on_refresh`, e.g. to invalidate a TTLCache.
+    """
+
+    def __init__(self, interval_ms=1000, batch=500, on_refresh=None, transaction=transaction):
+        self.interval_ms = interval_ms
+        self.batch = batch
+        self.on_refresh = on_refresh
+        self.transaction = transaction
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {"refreshes": 0, "sessions_refreshed": 0, "failures": 0, "last_refresh_ms": 0.0}
+
+    @classmethod
+    def from_env(cls, on_refresh=None):
+        """SESSION_VIEW_REFRESH_MS=0 leaves refreshing to `python session_view.py --follow`"""
+        return cls(interval_ms=int(os.getenv("SESSION_VIEW_REFRESH_MS", 1000)),
+                   batch=int(os.getenv("SESSION_VIEW_BATCH", 500)),
+                   on_refresh=on_refresh)
+
+    def start(self):
+        if self.interval_ms <= 0:
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="session-view-refresh", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def refresh_once(self):
+        started = time.perf_counter()
+        with self.transaction() as cur:
+            ids = refresh(cur, self.batch)
+        self._stats["refreshes"] += 1
+        self._stats["sessions_refreshed"] += len(ids)
+        self._stats["last_refresh_ms"] = (time.perf_counter() - started) * 1000
+        if ids and self.on_refresh is not None:
+            self.on_refresh(*ids)
+        return ids
+
+    def stats(self):
+        return dict(self._stats, interval_ms=self.interval_ms)
+
+    def _run(self):
+        failing = False
+        delay = 0.0
+        while not self._stop.wait(delay):
+            try:
+                ids = self.refresh_once()
+                failing = False
+            except Exception as e:
+                self._stats["failures"] += 1
+                if not failing:
+                    logger.error("session view: refresh failed: %s", e)
+                failing = True
+                ids = []
+            delay = 0.0 if len(ids) >= self.batch else self.interval_ms / 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batch", type=int, default=500, help="sessions per transaction")
+    parser.add_argument("--follow", action="store_true", help="keep refreshing instead of exiting when clean")
+    parser.add_argument("--interval-ms", type=float, default=1000, help="wait between passes with --follow")
+    parser.add_argument("--all", action="store_true", help="mark every session dirty first (initial backfill)")
+    args = parser.parse_args()
+
+    if args.all:
+        with transaction() as cur:
+            cur.execute("""
+                INSERT INTO session_feature_dirty (session_id)
+                SELECT session_id FROM sessions
+                ON CONFLICT DO NOTHING
+            """)
+            print(f"Marked {cur.rowcount} sessions for refresh")
+
+    started = time.perf_counter()
+    total = 0
+    while True:
+        with transaction() as cur:
+            ids = refresh(cur, args.batch)
+        total += len(ids)
+        if ids:
+            print(f"Refreshed {total} sessions ({total / (time.perf_counter() - started):.0f}/s)")
+        elif not args.follow:
+            break
+        else:
+            time.sleep(args.interval_ms / 1000)
+    print(f"Done: {total} sessions refreshed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""
+Local write-ahead spool between /api/events and Postgres.
+
+With INGEST_SPOOL_DIR set, the endpoint appends each batch to a segment file
+on local disk and returns; a separate loader moves the spooled rows into
+mouseDynamics / keystrokeDynamics, so a slow or unavailable database no
+longer shows up as request latency or lost events.
+
+    python spool.py [--dir DIR] [--follow] [--poll-ms 500] [--batch-records 2000]
+
+Segments are named <time_ns>-<pid>.open while a writer appends to them and
+renamed to .seg once sealed (size limit reached or clean shutdown). Every
+record is a little-endian uint32 payload length, the payload's CRC-32 and a
+JSON payload; writes are buffered and fsynced in the background every
+INGEST_SPOOL_FSYNC_MS, so a power loss costs at most that much data.
+
+The loader commits the rows of each chunk of records together with the
+segment's byte offset in spool_checkpoints, so it can be killed at any
+point and resumes after the last committed record. Ids and event_time are
+fixed when a batch is spooled, which makes replaying a record a no-op
+(the ids are already in telemetry_event_ids, and the (id, event_time)
+keys conflict). A record cut short
+by a crash ends its segment; a sealed segment with such a tail is renamed to
+.torn instead of deleted.
+
+A chunk the database rejects is retried one record at a time under
+savepoints; records that still fail are appended to
+quarantine/<segment>.jsonl (with the error) and skipped, so one bad record
+cannot stall the loader. A record can be quarantined twice if the chunk's
+commit fails afterwards.
+"""
+import argparse
+import json
+import logging
+import os
+import struct
+import threading
+import time
+import zlib
+from datetime import datetime, timezone
+
+import psycopg2
+
+from ingest import TRANSIENT_ERRORS, insert_rows, split_arrays, split_events
+from session_view import mark_dirty
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers seal their own segments, orphans stay .open
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct("<II")  # payload length, CRC-32 of payload
+MAX_RECORD_BYTES = 64 * 1024 * 1024
+QUARANTINE_DIR = "quarantine"
+# What a malformed record can raise: rejected by Postgres, or not shaped
+# like what SpoolWriter writes
+RECORD_ERRORS = (psycopg2.Error, KeyError, TypeError, ValueError)
+
+
+def encode_record(payload):
+    data = json.dumps(payload, separators=(",", ":"), default=float).encode()
+    return HEADER.pack(len(data), zlib.crc32(data)) + data
+
+
+def read_records(path, offset=0):
+    """
+    Yield (payload, end offset) for each complete, intact record after offset.
+
+    Stops at end of file or at the first short or corrupt record.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        while True:
+            header = f.read(HEADER.size)
+            if len(header) < HEADER.size:
+                return
+            length, crc = HEADER.unpack(header)
+            if length > MAX_RECORD_BYTES:
+                return
+            data = f.read(length)
+            if len(data) < length or zlib.crc32(data) != crc:
+                return
+            offset += HEADER.size + length
+            yield json.loads(data), offset
+
+
+def _fsync_dir(directory):
+    if os.name == "nt":
+        return
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SpoolWriter:
+    """
+    Drop-in for ingest.EventWriter that appends batches to the spool.
+
+    submit() serializes and buffers the batch under a lock and returns; a
+    background thread flushes and fsyncs the active segment every `fsync_ms`
+    so many requests share one fsync.
+    """
+
+    def __init__(self, directory, segment_bytes=64 * 1024 * 1024, fsync_ms=50):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_ms = fsync_ms
+        os.makedirs(directory, exist_ok=True)
+
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._stats = {
+            "batches_enqueued": 0,
+            "batches_dropped": 0,
+            "mouse_rows_spooled": 0,
+            "keystroke_rows_spooled": 0,
+            "bytes_spooled": 0,
+            "segments_sealed": 0,
+            "append_errors": 0,
+            "fsyncs": 0,
+            "last_fsync_ms": 0.0,
+            "max_fsync_ms": 0.0,
+        }
+
+    @classmethod
+    def from_env(cls):
+        """Build a spool writer from INGEST_SPOOL_* environment variables"""
+        return cls(
+            os.getenv("INGEST_SPOOL_DIR"),
+            segment_bytes=int(os.getenv("INGEST_SPOOL_SEGMENT_MB", 64)) * 1024 * 1024,
+            fsync_ms=int(os.getenv("INGEST_SPOOL_FSYNC_MS", 50))
+        )
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="spool-fsync", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout=5.0):
+        """fsync and seal the active segment"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        with self._lock:
+            self._seal()
+
+    def submit(self, session_id, events):
+        """Spool one batch; returns False if it could not be written"""
+        return self._enqueue(session_id, *split_events(session_id, events))
+
+    def submit_arrays(self, session_id, arrays):
+        """submit() for a batch decoded by event_codec.columns_to_arrays()"""
+        return self._enqueue(session_id, *split_arrays(arrays))
+
+    def _enqueue(self, session_id, mouse_rows, key_rows):
+        self.start()
+        if not mouse_rows and not key_rows:
+            return True
+        record = encode_record({
+            "session_id": session_id,
+            "event_time": datetime.now(timezone.utc).isoformat(),
+            "mouse": mouse_rows,
+            "keys": key_rows,
+        })
+        with self._lock:
+            try:
+                if self._file is None:
+                    self._open_segment()
+                self._file.write(record)
+            except OSError as e:
+                # A partial record may be on disk; later records go to a new segment
+                logger.error("spool: append failed: %s", e)
+                self._stats["append_errors"] += 1
+                self._stats["batches_dropped"] += 1
+                self._seal()
+                return False
+            self._size += len(record)
+            self._dirty = True
+            self._stats["batches_enqueued"] += 1
+            self._stats["mouse_rows_spooled"] += len(mouse_rows)
+            self._stats["keystroke_rows_spooled"] += len(key_rows)
+            self._stats["bytes_spooled"] += len(record)
+            if self._size >= self.segment_bytes:
+                self._seal()
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["segment_bytes"] = self._size
+        stats["fsync_ms"] = self.fsync_ms
+        return stats
+
+    def _open_segment(self):
+        # Locked under a temporary name first so the loader never sees an
+        # unlocked .open file and mistakes it for an orphan
+        base = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}")
+        f = open(base + ".tmp", "ab")
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        os.replace(base + ".tmp", base + ".open")
+        _fsync_dir(self.directory)
+        self._file, self._path, self._size = f, base + ".open", 0
+
+    def _seal(self):
+        """Caller holds self._lock"""
+        if self._file is None:
+            return
+        try:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            os.replace(self._path, self._path[:-len(".open")] + ".seg")
+            _fsync_dir(self.directory)
+            self._stats["segments_sealed"] += 1
+        except OSError as e:
+            logger.error("spool: sealing %s failed: %s", self._path, e)
+        finally:
+            self._file.close()
+            self._file = None
+            self._dirty = False
+
+    def _run(self):
+        while not self._stop.wait(self.fsync_ms / 1000):
+            self._sync()
+
+    def _sync(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            try:
+                self._file.flush()
+                # fsync a duplicate outside the lock so appends carry on meanwhile
+                fd = os.dup(self._file.fileno())
+            except OSError as e:
+                logger.error("spool: flush failed: %s", e)
+                self._stats["append_errors"] += 1
+                self._seal()
+                return
+            self._dirty = False
+        started = time.perf_counter()
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._stats["fsyncs"] += 1
+            self._stats["last_fsync_ms"] = elapsed_ms
+            self._stats["max_fsync_ms"] = max(self._stats["max_fsync_ms"], elapsed_ms)
+
+
+def _writer_alive(path):
+    """False if no process holds the segment's lock, i.e. its writer died"""
+    if fcntl is None:
+        return True
+    with open(path, "rb") as f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+
+def list_segments(directory):
+    """[(name, sealed)] oldest first; orphaned .open segments are sealed on the way"""
+    segments = []
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if name.endswith(".open") and not _writer_alive(path):
+            sealed = name[:-len(".open")] + ".seg"
+            os.replace(path, os.path.join(directory, sealed))
+            name = sealed
+        if name.endswith(".seg"):
+            segments.append((name, True))
+        elif name.endswith(".open"):
+            segments.append((name, False))
+    return segments
+
+
+def load_records(cur, records):
+    """Insert the rows of spooled records; returns (mouse rows, keystroke rows)"""
+    mouse_rows = []
+    key_rows = []
+    for record in records:
+        session_id, event_time = record["session_id"], record["event_time"]
+        mouse_rows.extend((session_id, event_id, event_time, speed, gap, honeypot)
+                          for event_id, speed, gap, honeypot in record["mouse"])
+        key_rows.extend((session_id, keystroke_id, event_time, typing_speed)
+                        for keystroke_id, typing_speed in record["keys"])
+    insert_rows(cur, mouse_rows, key_rows, with_event_time=True)
+    mark_dirty(cur, [record["session_id"] for record in records])
+    return len(mouse_rows), len(key_rows)
+
+
+def quarantine(directory, segment, record, error):
+    """Set a record the loader cannot insert aside, with the reason"""
+    path = os.path.join(directory, QUARANTINE_DIR, segment + ".jsonl")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps({"error": str(error), "record": record}, default=str) + "\n")
+
+
+def load_chunk(cur, directory, segment, chunk):
+    """
+    load_records() for a chunk, falling back to one savepoint per record if
+    the chunk fails; returns (mouse rows, keystroke rows, records quarantined)
+    """
+    cur.execute("SAVEPOINT spool_chunk")
+    try:
+        mouse, keys = load_records(cur, chunk)
+        cur.execute("RELEASE SAVEPOINT spool_chunk")
+        return mouse, keys, 0
+    except TRANSIENT_ERRORS:
+        raise
+    except RECORD_ERRORS:
+        cur.execute("ROLLBACK TO SAVEPOINT spool_chunk")
+
+    mouse = keys = quarantined = 0
+    for record in chunk:
+        cur.execute("SAVEPOINT spool_record")
+        try:
+            m, k = load_records(cur, [record])
+        except TRANSIENT_ERRORS:
+            raise
+        except RECORD_ERRORS as e:
+            cur.execute("ROLLBACK TO SAVEPOINT spool_record")
+            logger.warning("spool: quarantining a record of %s: %s", segment, e)
+            quarantine(directory, segment, record, e)
+            quarantined += 1
+        else:
+            cur.execute("RELEASE SAVEPOINT spool_record")
+            mouse += m
+            keys += k
+    return mouse, keys, quarantined
+
+
+def load_segment(transaction, directory, name, sealed, batch_records):
+    """
+    Load everything after the segment's checkpoint, batch_records per
+    transaction. Fully loaded sealed segments are removed.
+
+    Returns (records, rows) loaded.
+    """
+    path = os.path.join(directory, name)
+    # Checkpoints are keyed without the extension, which changes on sealing
+    segment = name.rsplit(".", 1)[0]
+    if not os.path.exists(path):
+        return 0, 0  # sealed since it was listed; picked up on the next pass
+    with transaction() as cur:
+        cur.execute("SELECT byte_offset FROM spool_checkpoints WHERE segment = %s", (segment,))
+        row = cur.fetchone()
+    offset = row[0] if row else 0
+
+    total_records = total_rows = 0
+    while True:
+        chunk = []
+        end = offset
+        for payload, end in read_records(path, offset):
+            chunk.append(payload)
+            if len(chunk) >= batch_records:
+                break
+        if not chunk:
+            break
+        with transaction() as cur:
+            mouse, keys, _ = load_chunk(cur, directory, segment, chunk)
+            cur.execute("""
+                INSERT INTO spool_checkpoints (segment, byte_offset, records, updated_at)
+                VALUES (%s, %s, %s, now())
+                ON CONFLICT (segment) DO UPDATE SET
+                    byte_offset = EXCLUDED.byte_offset,
+                    records = spool_checkpoints.records + EXCLUDED.records,
+                    updated_at = EXCLUDED.updated_at
+            """, (segment, end, len(chunk)))
+        offset = end
+        total_records += len(chunk)
+        total_rows += mouse + keys
+
+    if sealed:
+        if os.path.getsize(path) > offset:
+            logger.warning("spool: %s has %d unreadable bytes after offset %d; keeping it as .torn",
+                           name, os.path.getsize(path) - offset, offset)
+            os.replace(path, path[:-len(".seg")] + ".torn")
+        else:
+            os.remove(path)
+        with transaction() as cur:
+            cur.execute("DELETE FROM spool_checkpoints WHERE segment = %s", (segment,))
+    return total_records, total_rows
+
+
+def load_once(transaction, directory, batch_records):
+    """One pass over every segment in the spool; returns (records, rows) loaded"""
+    records = rows = 0
+    for name, sealed in list_segments(directory):
+        r, n = load_segment(transaction, directory, name, sealed, batch_records)
+        records += r
+        rows += n
+    return records, rows
+
+
+def main():
+    from db import transaction
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=os.getenv("INGEST_SPOOL_DIR"), help="spool directory (default INGEST_SPOOL_DIR)")
+    parser.add_argument("--follow", action="store_true", help="keep tailing the spool instead of exiting when drained")
+    parser.add_argument("--poll-ms", type=float, default=500, help="wait between passes with --follow")
+    parser.add_argument("--batch-records", type=int, default=2000, help="spooled batches per transaction")
+    args = parser.parse_args()
+    if not args.dir:
+        parser.error("--dir or INGEST_SPOOL_DIR is required")
+
+    started = time.perf_counter()
+    total_records = total_rows = 0
+    while True:
+        try:
+            records, rows = load_once(transaction, args.dir, args.batch_records)
+        except Exception as e:
+            if not args.follow:
+                raise
+            # Database down: the spool keeps growing, retry on the next pass
+            print(f"spool: load failed, retrying: {e}")
+            records = rows = 0
+        if records:
+            total_records += records
+            total_rows += rows
+            elapsed = time.perf_counter() - started
+            print(f"Loaded {total_records} batches, {total_rows} rows ({total_rows / elapsed:.0f} rows/s)")
+        if not args.follow:
+            break
+        if not records:
+            time.sleep(args.poll_ms / 1000)
+    print(f"Done: {total_records} batches, {total_rows} rows loaded")
+
+
+if __name__ == "__main__":
+    main()
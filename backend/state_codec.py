@@ -0,0 +1,83 @@
+import json
+from collections import namedtuple
+
+import numpy as np
+
+from features import FEATURE_NAMES
+
+# A state vector is stored as one version byte followed by the packed
+# values. The version pins the feature names, order and dtype, so old rows
+# stay readable after the feature set changes: add a new schema, never edit
+# an existing one.
+StateSchema = namedtuple("StateSchema", ["version", "names", "dtype"])
+
+SCHEMAS = {
+    1: StateSchema(1, FEATURE_NAMES, np.dtype("<f4")),
+}
+CURRENT_VERSION = 1
+
+
+def encode_state(state, version=CURRENT_VERSION):
+    """Pack a feature dict or vector into bytes for a BYTEA column"""
+    schema = SCHEMAS[version]
+    if isinstance(state, dict):
+        values = np.array([state.get(name, 0.0) for name in schema.names], dtype=schema.dtype)
+    else:
+        values = np.asarray(state, dtype=schema.dtype)
+        if values.shape != (len(schema.names),):
+            raise ValueError(f"State has shape {values.shape}, schema v{version} expects ({len(schema.names)},)")
+    return bytes([version]) + values.tobytes()
+
+
+def decode_state(value, version=CURRENT_VERSION):
+    """
+    Decode a stored state into a float32 vector laid out like schema `version`.
+
+    Accepts packed bytes (BYTEA, any known version) as well as the legacy
+    JSON format: a list of numbers or a dict keyed by feature name, either
+    already decoded by psycopg2 or as a JSON string.
+    """
+    schema = SCHEMAS[version]
+    out = np.zeros(len(schema.names), dtype=np.float32)
+    if value is None:
+        return out
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        raw = bytes(value)
+        stored = SCHEMAS[raw[0]]
+        values = np.frombuffer(raw, dtype=stored.dtype, offset=1)
+        if stored.version == version:
+            out[:] = values
+        else:
+            positions = {name: i for i, name in enumerate(schema.names)}
+            for name, v in zip(stored.names, values):
+                if name in positions:
+                    out[positions[name]] = v
+        return out
+    if isinstance(value, str):
+        value = json.loads(value)
+    if isinstance(value, dict):
+        for i, name in enumerate(schema.names):
+            out[i] = value.get(name, 0.0)
+    else:
+        n = min(len(value), out.size)
+        out[:n] = value[:n]
+    return out
+
+
+def decode_states(values, version=CURRENT_VERSION):
+    """
+    Decode many stored states into an (n, dim) float32 matrix.
+
+    When every value is packed bytes of the requested version (the common
+    case after migration) this is a single frombuffer over the joined rows.
+    """
+    schema = SCHEMAS[version]
+    width = 1 + len(schema.names) * schema.dtype.itemsize
+    if values and all(isinstance(v, (bytes, memoryview)) and len(v) == width and bytes(v[:1])[0] == version
+                      for v in values):
+        raw = np.frombuffer(b"".join(bytes(v) for v in values), dtype=np.uint8).reshape(len(values), width)
+        return raw[:, 1:].copy().view(schema.dtype).astype(np.float32, copy=False)
+    matrix = np.empty((len(values), len(schema.names)), dtype=np.float32)
+    for i, value in enumerate(values):
+        matrix[i] = decode_state(value, version)
+    return matrix
@@ -0,0 +1,116 @@
+import gzip
+import json
+import zlib
+
+import numpy as np
+import pytest
+
+from event_codec import (UnsupportedEncoding, columns_to_arrays, decode_body, encode_columnar,
+                         parse_batch, validate_events)
+from features import events_to_arrays
+
+EVENTS = [
+    {"type": "mousemove", "t": 1000.0, "x": 10.0, "y": 20.0},
+    {"type": "mousemove", "t": 1016.0, "x": 14.0, "y": 21.0},
+    {"type": "keydown", "t": 1020.0, "key": "a"},
+    {"type": "keyup", "t": 1090.0, "key": "a"},
+    {"type": "click", "t": 1200.0, "x": 14.0, "y": 21.0, "honeypot_clicked": True},
+]
+
+
+def assert_same_arrays(a, b):
+    assert a.keys() == b.keys()
+    for name in a:
+        np.testing.assert_array_equal(a[name], b[name], err_msg=name)
+
+
+@pytest.mark.parametrize("encoding, compress", [
+    (None, lambda b: b),
+    ("gzip", gzip.compress),
+    ("deflate", zlib.compress),
+    ("deflate", lambda b: zlib.compress(b)[2:-4]),  # raw deflate, no zlib header
+])
+def test_decode_body_encodings(encoding, compress):
+    body = {"session_id": "s1", "events": EVENTS}
+    assert decode_body(compress(json.dumps(body).encode()), encoding) == body
+
+
+def test_decode_body_errors():
+    with pytest.raises(UnsupportedEncoding):
+        decode_body(b"{}", "br")
+    with pytest.raises(ValueError):
+        decode_body(b"not gzip", "gzip")
+    with pytest.raises(ValueError):
+        decode_body(gzip.compress(b"[" + b"0," * 1000 + b"0]"), "gzip", max_bytes=100)
+    with pytest.raises(ValueError):
+        decode_body(b"[1, 2]")
+    assert decode_body(b"") == {}
+
+
+def test_columnar_round_trip_matches_json_path():
+    batch = encode_columnar("s1", EVENTS)
+    assert_same_arrays(columns_to_arrays(batch), events_to_arrays(EVENTS))
+
+
+def test_columnar_rounding():
+    events = [{"type": "mousemove", "t": 1000.04, "x": 10.4, "y": 0.0}]
+    arrays = columns_to_arrays(encode_columnar("s1", events, decimals=0))
+    assert arrays["mouse_t"].tolist() == [1000.0]
+    assert arrays["mouse_x"].tolist() == [10.0]
+
+
+@pytest.mark.parametrize("change, message", [
+    ({"type": [0, 9]}, "outside 'types'"),
+    ({"t": [1.0]}, "one value per event"),
+    ({"honeypot": [5]}, "outside the batch"),
+    ({"key": []}, "one entry per key event"),
+])
+def test_columns_to_arrays_rejects_inconsistent_batches(change, message):
+    batch = {**encode_columnar("s1", EVENTS[:3]), **change}
+    with pytest.raises(ValueError, match=message):
+        columns_to_arrays(batch)
+
+
+def test_validate_events_coerces():
+    events = validate_events([{"type": "mousemove", "t": "12.5", "x": 3, "y": None, "honeypot_clicked": 1}])
+    assert events == [{"type": "mousemove", "t": 12.5, "x": 3.0, "honeypot_clicked": True}]
+
+
+@pytest.mark.parametrize("events, message", [
+    ({"type": "mousemove"}, "must be a list"),
+    (["mousemove"], "event 0 must be an object"),
+    ([{"type": "mousemove", "t": "soon"}], "'t' must be a number"),
+    ([{"type": "mousemove", "x": [1]}], "'x' must be a number"),
+    ([{"type": "mousemove", "x": True}], "'x' must be a number"),
+    ([{"type": "mousemove", "t": float("nan")}], "'t' must be finite"),
+    ([{"type": "mousemove", "t": "inf"}], "'t' must be finite"),
+    ([{"type": 3}], "'type' must be a string"),
+    ([{"type": "keydown", "key": 65}], "'key' must be a string"),
+    ([{"type": "click", "honeypot_clicked": "yes"}], "must be a boolean"),
+])
+def test_validate_events_rejects(events, message):
+    with pytest.raises(ValueError, match=message):
+        validate_events(events)
+
+
+def test_parse_batch():
+    session_id, events, arrays, count = parse_batch({"session_id": "s1", "events": EVENTS})
+    assert (session_id, arrays, count) == ("s1", None, len(EVENTS))
+    assert events == EVENTS
+
+    session_id, events, arrays, count = parse_batch(encode_columnar("s1", EVENTS))
+    assert (session_id, events, count) == ("s1", None, len(EVENTS))
+    assert_same_arrays(arrays, events_to_arrays(EVENTS))
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"events": EVENTS}, "session_id is required"),
+    ({"session_id": 7, "events": EVENTS}, "session_id is required"),
+    ({"session_id": "s1", "events": "nope"}, "must be a list"),
+    ({"session_id": "s1", "format": "columnar/v1", "types": ["click"], "type": [[0]]}, "Invalid columnar batch"),
+    ({"session_id": "s1", "format": "columnar/v1", "types": ["click"], "type": [0], "x": ["a"]},
+     "Invalid columnar batch"),
+])
+def test_parse_batch_rejects(data, message):
+    with pytest.raises(ValueError, match=message):
+        parse_batch(data)
@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from features import FEATURE_NAMES
+from policy import ACTIONS, LinearPolicy
+
+
+def test_save_load_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    dim = len(FEATURE_NAMES)
+    policy = LinearPolicy(rng.random(dim), rng.random(dim) + 1, rng.random(dim), 0.25,
+                          action_weights=rng.random((dim, len(ACTIONS))),
+                          action_bias=rng.random(len(ACTIONS)), version=7)
+    path = str(tmp_path / "policy.npz")
+    policy.save(path)
+    loaded = LinearPolicy.load(path)
+
+    assert loaded.version == 7
+    assert not (tmp_path / "policy.npz.tmp").exists()
+    X = rng.random((16, dim)) * 10
+    for a, b in zip(policy.act(X), loaded.act(X)):
+        np.testing.assert_array_equal(a, b)
+
+
+def test_default_policy_round_trip(tmp_path):
+    path = str(tmp_path / "policy.npz")
+    LinearPolicy.default().save(path)
+    loaded = LinearPolicy.load(path)
+    assert loaded.action_weights is None
+    X = np.zeros((1, len(FEATURE_NAMES)))
+    np.testing.assert_array_equal(loaded.act(X)[1], LinearPolicy.default().act(X)[1])
+
+
+def test_load_refuses_other_feature_set(tmp_path):
+    path = tmp_path / "policy.npz"
+    policy = LinearPolicy.default()
+    np.savez(path, feature_names=np.array(FEATURE_NAMES[:-1]), actions=np.array(ACTIONS),
+             mean=policy.mean, scale=policy.scale, bot_weights=policy.bot_weights,
+             bot_bias=np.float32(0), version=np.int64(0))
+    with pytest.raises(ValueError, match="different feature or action set"):
+        LinearPolicy.load(str(path))
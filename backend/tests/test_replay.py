@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+from replay import ReplayBuffer, SumTree
+
+
+def find(tree, targets):
+    targets = np.array(targets, dtype=np.float64)
+    out = np.empty(targets.size, dtype=np.int64)
+    return tree.find(targets, out, np.empty(targets.size), np.empty(targets.size, dtype=bool))
+
+
+def test_sum_tree_find():
+    tree = SumTree(5)
+    assert tree.size == 8
+    tree.update(np.arange(5), np.array([1.0, 0.0, 2.0, 3.0, 4.0]))
+    assert tree.total == 10.0
+    # Prefix intervals: [0,1) -> 0, [1,3) -> 2, [3,6) -> 3, [6,10) -> 4; leaf 1 is empty
+    assert find(tree, [0.0, 0.99, 1.0, 2.5, 3.0, 5.99, 6.0, 9.99]).tolist() == [0, 0, 2, 2, 3, 3, 4, 4]
+
+
+def test_sum_tree_update_and_rebuild():
+    tree = SumTree(4)
+    tree.update([0, 1, 2, 3], [1.0, 1.0, 1.0, 1.0])
+    tree.update([1, 1], [5.0, 5.0])  # repeated index: internal nodes still summed once
+    assert tree.total == 8.0
+    assert find(tree, [1.0, 5.99, 6.0]).tolist() == [1, 1, 2]
+    copy = SumTree(4, tree.tree.copy())
+    copy.tree[1:copy.size] = 0
+    copy.rebuild()
+    np.testing.assert_array_equal(copy.tree, tree.tree)
+
+
+def test_single_leaf_tree():
+    tree = SumTree(1)
+    tree.update([0], [2.0])
+    assert find(tree, [0.0, 1.5]).tolist() == [0, 0]
+
+
+def test_prioritized_sampling_follows_priorities():
+    buffer = ReplayBuffer(4, state_dim=2, prioritized=True, alpha=1.0, seed=0)
+    buffer.add_batch(np.zeros((4, 2)), np.arange(4), np.zeros(4), np.zeros((4, 2)))
+    buffer.update_priorities(np.arange(4), np.array([1.0, 0.0, 0.0, 3.0]), eps=0.0)
+    counts = np.zeros(4)
+    for _ in range(200):
+        batch = buffer.sample_prioritized(8)
+        counts += np.bincount(batch["indices"], minlength=4)
+    assert counts[1] == counts[2] == 0
+    assert 2.5 < counts[3] / counts[0] < 3.5
+
+
+def test_update_priorities_needs_prioritized_buffer():
+    buffer = ReplayBuffer(4, state_dim=2)
+    buffer.add(np.zeros(2), 0, 0.0, np.zeros(2))
+    with pytest.raises(ValueError, match="prioritized=True"):
+        buffer.update_priorities([0], np.array([1.0]))
+
+
+def test_memory_mapped_buffer_reopens(tmp_path):
+    path = str(tmp_path / "replay")
+    buffer = ReplayBuffer(3, state_dim=2, path=path, prioritized=True)
+    for i in range(5):
+        buffer.add(np.full(2, i), i % 2, float(i), np.full(2, i + 1))
+    buffer.flush()
+
+    reopened = ReplayBuffer(3, state_dim=2, path=path, prioritized=True)
+    assert (len(reopened), reopened.pos) == (3, 2)
+    assert sorted(reopened.rewards.tolist()) == [2.0, 3.0, 4.0]
+    assert reopened.tree.total == buffer.tree.total
+    with pytest.raises(ValueError):
+        ReplayBuffer(4, state_dim=2, path=path)
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from features import FEATURE_NAMES
+from rules import DEFAULT_RULES_PATH, Rule, RuleSet
+
+
+def row(**values):
+    x = np.zeros(len(FEATURE_NAMES), dtype=np.float32)
+    for name, value in values.items():
+        x[FEATURE_NAMES.index(name)] = value
+    return x
+
+
+RULES = RuleSet.from_config([
+    {"name": "honeypot", "when": [["honeypot_clicked", ">", 0]], "action": "block"},
+    {"name": "fast_typing", "when": [["keystroke_count", ">=", 5], ["typing_speed", ">", 25]],
+     "action": "block", "bot_score": 0.99},
+    {"name": "idle", "when": [["mouse_event_count", "==", 0], ["keystroke_count", "==", 0]],
+     "action": "challenge_hard", "bot_score": 0.9},
+])
+
+
+def test_first_matching_rule_wins():
+    X = np.stack([
+        row(honeypot_clicked=1),
+        row(honeypot_clicked=1, keystroke_count=10, typing_speed=30),
+        row(keystroke_count=10, typing_speed=30),
+        row(keystroke_count=4, typing_speed=30),  # only one condition holds
+        row(),
+        row(mouse_event_count=100),
+    ])
+    assert RULES.match(X).tolist() == [0, 0, 1, -1, 2, -1]
+    assert RULES.check(row(keystroke_count=10, typing_speed=30)).name == "fast_typing"
+    assert RULES.check(row(mouse_event_count=3)) is None
+
+
+def test_stats_count_matches():
+    rules = RuleSet(RULES.rules)
+    rules.match(np.stack([row(honeypot_clicked=1), row(), row(mouse_event_count=1)]))
+    assert rules.stats() == {"evaluated": 3, "short_circuited": 2, "passed_to_policy": 1,
+                             "rule_honeypot": 1, "rule_fast_typing": 0, "rule_idle": 1}
+
+
+def test_empty_rule_set():
+    assert RuleSet([]).match(np.zeros((3, len(FEATURE_NAMES)))).tolist() == [-1, -1, -1]
+
+
+@pytest.mark.parametrize("when, action", [
+    ([["no_such_feature", ">", 0]], "block"),
+    ([["typing_speed", "~", 0]], "block"),
+    ([["typing_speed", ">", 0]], "shrug"),
+    ([], "block"),
+])
+def test_invalid_rules(when, action):
+    with pytest.raises(ValueError):
+        Rule("bad", when, action, 1.0)
+
+
+def test_shipped_rules_load():
+    assert RuleSet.load(DEFAULT_RULES_PATH).rules
@@ -0,0 +1,111 @@
+import os
+import struct
+import zlib
+
+import psycopg2
+import pytest
+
+import spool
+from spool import HEADER, SpoolWriter, encode_record, list_segments, load_chunk, read_records
+
+
+def write(path, *chunks):
+    with open(path, "wb") as f:
+        for chunk in chunks:
+            f.write(chunk)
+
+
+def test_record_format(tmp_path):
+    record = encode_record({"session_id": "s1", "speed": 1.5})
+    length, crc = struct.unpack("<II", record[:8])
+    assert length == len(record) - HEADER.size
+    assert crc == zlib.crc32(record[8:])
+
+    path = tmp_path / "a.seg"
+    write(path, record, encode_record({"n": 2}))
+    assert [(payload, end) for payload, end in read_records(path)] == [
+        ({"session_id": "s1", "speed": 1.5}, len(record)),
+        ({"n": 2}, len(record) + len(encode_record({"n": 2}))),
+    ]
+    assert list(read_records(path, offset=len(record))) == [({"n": 2}, os.path.getsize(path))]
+
+
+def test_read_stops_at_torn_tail(tmp_path):
+    first, second = encode_record({"n": 1}), encode_record({"n": 2})
+    path = tmp_path / "a.seg"
+    for tail in (second[:5], second[:-1]):
+        write(path, first, tail)
+        assert [payload for payload, _ in read_records(path)] == [{"n": 1}]
+
+
+def test_read_stops_at_bad_crc(tmp_path):
+    first, second, third = (encode_record({"n": n}) for n in (1, 2, 3))
+    corrupt = second[:-2] + b"9}"
+    path = tmp_path / "a.seg"
+    write(path, first, corrupt, third)
+    assert [payload for payload, _ in read_records(path)] == [{"n": 1}]
+
+
+def test_read_stops_at_absurd_length(tmp_path):
+    path = tmp_path / "a.seg"
+    write(path, HEADER.pack(spool.MAX_RECORD_BYTES + 1, 0))
+    assert list(read_records(path)) == []
+
+
+def test_writer_spools_and_seals(tmp_path):
+    writer = SpoolWriter(str(tmp_path), fsync_ms=5)
+    events = [{"type": "mousemove", "t": 0, "x": 0, "y": 0},
+              {"type": "mousemove", "t": 16, "x": 3, "y": 4},
+              {"type": "keydown", "t": 20, "key": "a"}]
+    assert writer.submit("s1", events)
+    assert writer.submit("s2", events[:1])
+    assert writer.submit("s3", [])  # nothing to spool
+    writer.stop()
+
+    segments = list_segments(str(tmp_path))
+    assert len(segments) == 1 and segments[0][1]
+    records = [payload for payload, _ in read_records(tmp_path / segments[0][0])]
+    assert [r["session_id"] for r in records] == ["s1", "s2"]
+    assert [len(r["mouse"]) for r in records] == [2, 1]
+    assert [len(r["keys"]) for r in records] == [1, 0]
+    assert writer.stats()["segments_sealed"] == 1
+
+
+def test_list_segments_seals_orphans(tmp_path):
+    write(tmp_path / "1-100.open", encode_record({"n": 1}))
+    write(tmp_path / "2-100.seg", b"")
+    (tmp_path / "quarantine").mkdir()
+    assert list_segments(str(tmp_path)) == [("1-100.seg", True), ("2-100.seg", True)]
+
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+
+def test_load_chunk_quarantines_rejected_records(tmp_path, monkeypatch):
+    def load_records(cur, records):
+        if any(r["session_id"] == "bad" for r in records):
+            raise psycopg2.DataError("invalid byte sequence")
+        return len(records), 0
+
+    monkeypatch.setattr(spool, "load_records", load_records)
+    cur = FakeCursor()
+    chunk = [{"session_id": "s1"}, {"session_id": "bad"}, {"session_id": "s2"}]
+    assert load_chunk(cur, str(tmp_path), "1-100", chunk) == (2, 0, 1)
+    assert cur.statements.count("ROLLBACK TO SAVEPOINT spool_record") == 1
+    quarantined = (tmp_path / "quarantine" / "1-100.jsonl").read_text().splitlines()
+    assert len(quarantined) == 1 and '"bad"' in quarantined[0]
+
+
+def test_load_chunk_raises_transient_errors(tmp_path, monkeypatch):
+    def load_records(cur, records):
+        raise psycopg2.OperationalError("server closed the connection")
+
+    monkeypatch.setattr(spool, "load_records", load_records)
+    with pytest.raises(psycopg2.OperationalError):
+        load_chunk(FakeCursor(), str(tmp_path), "1-100", [{"session_id": "s1"}])
+    assert not (tmp_path / "quarantine").exists()
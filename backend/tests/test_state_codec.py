@@ -0,0 +1,53 @@
+import json
+
+import numpy as np
+import pytest
+
+from features import FEATURE_NAMES
+from state_codec import CURRENT_VERSION, decode_state, decode_states, encode_state
+
+
+def vector(seed=0):
+    return np.random.default_rng(seed).random(len(FEATURE_NAMES), dtype=np.float32)
+
+
+def test_round_trip():
+    state = vector()
+    value = encode_state(state)
+    assert value[0] == CURRENT_VERSION
+    np.testing.assert_array_equal(decode_state(value), state)
+    np.testing.assert_array_equal(decode_state(memoryview(value)), state)
+
+
+def test_dict_state():
+    state = {"movement_speed": 2.5, "typing_speed": 7.0}
+    decoded = decode_state(encode_state(state))
+    assert decoded[FEATURE_NAMES.index("movement_speed")] == 2.5
+    assert decoded[FEATURE_NAMES.index("typing_speed")] == 7.0
+    assert np.count_nonzero(decoded) == 2
+
+
+def test_wrong_shape():
+    with pytest.raises(ValueError):
+        encode_state(np.zeros(3))
+
+
+def test_legacy_json():
+    state = vector()
+    as_list = state.tolist()
+    as_dict = dict(zip(FEATURE_NAMES, as_list))
+    for value in (as_list, as_dict, json.dumps(as_list), json.dumps(as_dict)):
+        np.testing.assert_allclose(decode_state(value), state)
+    # Short lists are zero-padded, missing states are zeros
+    assert decode_state([1.0]).tolist() == [1.0] + [0.0] * (len(FEATURE_NAMES) - 1)
+    assert not decode_state(None).any()
+
+
+def test_decode_states():
+    states = np.stack([vector(i) for i in range(5)])
+    packed = [encode_state(s) for s in states]
+    np.testing.assert_array_equal(decode_states(packed), states)
+    # Mixed packed and legacy rows take the per-row path
+    mixed = packed[:4] + [states[4].tolist()]
+    np.testing.assert_allclose(decode_states(mixed), states)
+    assert decode_states([]).shape == (0, len(FEATURE_NAMES))
@@ -0,0 +1,122 @@
+from contextlib import contextmanager
+
+import psycopg2
+import pytest
+
+import aggregator
+import ingest
+from ingest import EventWriter
+
+
+class FakeCursor:
+    def __init__(self):
+        self.statements = []
+
+    def execute(self, sql, params=None):
+        self.statements.append(sql)
+
+
+def fake_transaction(cursors):
+    @contextmanager
+    def transaction():
+        cur = FakeCursor()
+        cursors.append(cur)
+        yield cur
+    return transaction
+
+
+def batch(session_id, mouse=2, keys=1):
+    return (session_id, [(f"{session_id}-m{i}", 1.0, 0.0, False) for i in range(mouse)],
+            [(f"{session_id}-k{i}", 5.0) for i in range(keys)])
+
+
+@pytest.fixture
+def rejected(monkeypatch):
+    """Sessions whose rows the fake database rejects"""
+    bad = set()
+
+    def insert_rows(cur, mouse_rows, key_rows, with_event_time=False):
+        if any(row[0] in bad for row in mouse_rows + key_rows):
+            raise psycopg2.DataError("invalid byte sequence")
+
+    monkeypatch.setattr(ingest, "insert_rows", insert_rows)
+    monkeypatch.setattr(ingest, "mark_dirty", lambda cur, session_ids: None)
+    return bad
+
+
+def test_flush_drops_only_the_bad_batch(rejected):
+    rejected.add("bad")
+    cursors = []
+    writer = EventWriter(transaction=fake_transaction(cursors))
+    writer._flush([batch("s1"), batch("bad"), batch("s2")])
+
+    stats = writer.stats()
+    assert stats["batches_failed"] == 1
+    assert stats["rows_lost"] == 3
+    assert stats["mouse_rows_written"] == 4
+    assert stats["keystroke_rows_written"] == 2
+    assert stats["flushes_failed"] == 0
+    # One failed group transaction, then one with a savepoint per batch
+    assert len(cursors) == 2
+    assert cursors[1].statements.count("ROLLBACK TO SAVEPOINT flush_batch") == 1
+
+
+def test_flush_retries_transient_errors(monkeypatch):
+    attempts = []
+
+    @contextmanager
+    def transaction():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise psycopg2.OperationalError("server closed the connection")
+        yield FakeCursor()
+
+    monkeypatch.setattr(ingest, "insert_rows", lambda *args, **kwargs: None)
+    monkeypatch.setattr(ingest, "mark_dirty", lambda cur, session_ids: None)
+    writer = EventWriter(transaction=transaction, retry_backoff_ms=0)
+    writer._flush([batch("s1")])
+    stats = writer.stats()
+    assert (len(attempts), stats["flush_retries"], stats["rows_lost"]) == (3, 2, 0)
+    assert stats["mouse_rows_written"] == 2
+
+
+def test_writer_thread_drains_on_stop(rejected):
+    cursors = []
+    writer = EventWriter(transaction=fake_transaction(cursors), flush_ms=10000)
+    events = [{"type": "mousemove", "t": 0, "x": 0, "y": 0}, {"type": "keydown", "t": 5, "key": "a"}]
+    assert writer.submit("s1", events)
+    assert writer.submit("s2", events)
+    writer.stop()
+    stats = writer.stats()
+    assert (stats["flushes"], stats["mouse_rows_written"], stats["keystroke_rows_written"]) == (1, 2, 2)
+
+
+@pytest.fixture
+def upserts(monkeypatch):
+    """Values passed to each session_features upsert; raises for session 'bad'"""
+    calls = []
+
+    def execute_values(cur, sql, values, template=None):
+        calls.append(list(values))
+        if any(value[0] == "bad" for value in values):
+            raise psycopg2.DataError("invalid byte sequence")
+
+    monkeypatch.setattr(aggregator, "transaction", fake_transaction([]))
+    monkeypatch.setattr(aggregator, "execute_values", execute_values)
+    monkeypatch.setattr(aggregator, "mark_dirty", lambda cur, session_ids: None)
+    return calls
+
+
+def test_session_features_keep_latest_snapshot(upserts):
+    failed = aggregator.write_session_features([("s1", {"n": 1}), ("s2", {"n": 1}), ("s1", {"n": 2})])
+    assert failed == 0
+    assert len(upserts) == 1
+    assert [(session_id, snapshot) for session_id, snapshot, _ in upserts[0]] == [
+        ("s1", '{"n": 2}'), ("s2", '{"n": 1}')]
+
+
+def test_session_features_isolate_bad_snapshot(upserts):
+    failed = aggregator.write_session_features([("s1", {}), ("bad", {}), ("s2", {})])
+    assert failed == 1
+    # The failed batch, then one upsert per snapshot
+    assert [len(values) for values in upserts] == [3, 1, 1, 1]
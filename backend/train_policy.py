@@ -0,0 +1,360 @@
+"""
+Offline training of the challenge policy from rl_experience.
+
+    python train_policy.py [--out policy.npz] [--workers 4] [--iterations 10]
+        [--gamma 0.9] [--ridge 1.0] [--chunk-size 10000] [--max-rows 0]
+        [--dataset DIR] [--checkpoint-dir train_checkpoints] [--resume]
+
+Fitted Q iteration with the linear action values LinearPolicy already
+serves: each iteration regresses r + gamma * (1 - done) * max_a' Q(s', a')
+on the standardized state, separately per action, with a ridge penalty.
+A transition is done when it has no next state or is the last one of its
+session. --max-rows keeps the newest transitions.
+
+Experience is read a chunk at a time (server-side cursor, or the files of
+export_dataset.py with --dataset) straight into shared-memory arrays. Each
+iteration, a process pool computes per-action normal equations
+(X^T X, X^T y) over its shard of those arrays; only the current weights go
+to the workers and only (actions x dim^2) sums come back, whatever the
+number of transitions. The parent adds them up and solves.
+
+The weights are checkpointed after every iteration (--resume continues
+from the last one), and the result is written with LinearPolicy.save() to
+--out, which scoring.MicroBatcher picks up without a restart.
+"""
+import argparse
+import json
+import os
+import time
+from multiprocessing import Pool, shared_memory
+
+import numpy as np
+
+from features import FEATURE_NAMES
+from policy import ACTIONS, LinearPolicy
+from scoring import DEFAULT_POLICY_PATH
+from state_codec import decode_states
+
+STATE_DIM = len(FEATURE_NAMES)
+N_ACTIONS = len(ACTIONS)
+# Actions never taken in the data get this value, so they are never chosen
+UNSEEN_ACTION_BIAS = -1e3
+
+_FIELDS = {
+    "states": (STATE_DIM, np.float32),
+    "next_states": (STATE_DIM, np.float32),
+    "actions": (None, np.int8),
+    "rewards": (None, np.float32),
+    "done": (None, np.bool_),
+}
+
+
+class SharedExperience:
+    """Transition arrays in named shared memory blocks that workers attach to by name"""
+
+    def __init__(self, capacity, names=None):
+        self.capacity = capacity
+        self.size = 0
+        self.blocks = {}
+        self.arrays = {}
+        for field, (width, dtype) in _FIELDS.items():
+            shape = (capacity, width) if width else (capacity,)
+            nbytes = max(int(np.prod(shape)) * np.dtype(dtype).itemsize, 1)
+            if names is None:
+                block = shared_memory.SharedMemory(create=True, size=nbytes)
+            else:
+                # Pool workers share the parent's resource tracker, so
+                # attaching does not make them unlink the block on exit
+                block = shared_memory.SharedMemory(name=names[field])
+            self.blocks[field] = block
+            self.arrays[field] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+    def names(self):
+        return {field: block.name for field, block in self.blocks.items()}
+
+    def append(self, states, actions, rewards, next_states, done):
+        n = min(len(actions), self.capacity - self.size)
+        end = self.size + n
+        self.arrays["states"][self.size:end] = states[:n]
+        self.arrays["next_states"][self.size:end] = next_states[:n]
+        self.arrays["actions"][self.size:end] = actions[:n]
+        self.arrays["rewards"][self.size:end] = rewards[:n]
+        self.arrays["done"][self.size:end] = done[:n]
+        self.size = end
+        return n
+
+    def close(self, unlink=False):
+        self.arrays.clear()
+        for block in self.blocks.values():
+            block.close()
+            if unlink:
+                block.unlink()
+
+
+def load_from_db(capacity_limit=0, chunk_size=10000):
+    """Stream rl_experience (the newest `capacity_limit` rows, if set) into a new SharedExperience"""
+    from db import get_connection
+
+    action_index = {name: i for i, name in enumerate(ACTIONS)}
+    conn = get_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM rl_experience")
+            capacity = cur.fetchone()[0]
+        if capacity_limit:
+            capacity = min(capacity, capacity_limit)
+        experience = SharedExperience(capacity)
+        with conn.cursor(name="train_policy") as cur:
+            cur.itersize = chunk_size
+            # A session's later transitions are newer, so they are all among
+            # the kept rows and "last of its session" holds after the LIMIT
+            cur.execute("""
+                WITH recent AS (
+                    SELECT * FROM rl_experience
+                    ORDER BY created_at DESC, experience_id DESC
+                    LIMIT %s
+                )
+                SELECT state_bin, state, next_state_bin, next_state, action_taken, reward,
+                       (next_state_bin IS NULL AND next_state IS NULL)
+                       OR lead(experience_id) OVER (PARTITION BY session_id
+                                                    ORDER BY created_at, experience_id) IS NULL
+                FROM recent
+            """, (capacity,))
+            while experience.size < capacity:
+                rows = cur.fetchmany(chunk_size)
+                if not rows:
+                    break
+                rows = [row for row in rows if row[4] in action_index]
+                if not rows:
+                    continue
+                experience.append(
+                    decode_states([row[0] if row[0] is not None else row[1] for row in rows]),
+                    np.fromiter((action_index[row[4]] for row in rows), dtype=np.int8, count=len(rows)),
+                    np.fromiter((row[5] or 0.0 for row in rows), dtype=np.float32, count=len(rows)),
+                    decode_states([row[2] if row[2] is not None else row[3] for row in rows]),
+                    np.fromiter((row[6] for row in rows), dtype=np.bool_, count=len(rows)),
+                )
+        conn.rollback()
+    finally:
+        conn.close()
+    return experience
+
+
+def mark_session_ends(done, session_ids):
+    """Set done for the last of each session's transitions (session_ids in time order)"""
+    last = {}
+    for i, session_id in enumerate(session_ids):
+        last[session_id] = i
+    done[list(last.values())] = True
+
+
+def load_from_dataset(path, capacity_limit=0, chunk_size=10000):
+    """
+    Read the files written by export_dataset.py (the newest `capacity_limit`
+    rows, if set) into a new SharedExperience.
+
+    Files are read in path order, which is export order, i.e. by created_at.
+    Exports from before has_next_state existed only mark session ends done.
+    """
+    from export_dataset import open_dataset
+
+    dataset = open_dataset(path)
+    total = dataset.count_rows()
+    capacity = min(total, capacity_limit) if capacity_limit else total
+    skip = total - capacity
+    has_next = "has_next_state" in dataset.schema.names
+    experience = SharedExperience(capacity)
+    state_columns = [f"state_{name}" for name in FEATURE_NAMES]
+    next_columns = [f"next_state_{name}" for name in FEATURE_NAMES]
+    columns = state_columns + next_columns + ["action", "reward", "session_id"]
+    session_ids = []
+    for batch in dataset.to_batches(columns=columns + (["has_next_state"] if has_next else []),
+                                    batch_size=chunk_size):
+        if skip >= batch.num_rows:
+            skip -= batch.num_rows
+            continue
+        batch, skip = batch.slice(skip), 0
+        actions = batch.column("action").to_numpy(zero_copy_only=False)
+        keep = actions >= 0
+        states = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False) for c in state_columns])
+        next_states = np.column_stack([batch.column(c).to_numpy(zero_copy_only=False) for c in next_columns])
+        if has_next:
+            done = ~batch.column("has_next_state").to_numpy(zero_copy_only=False).astype(bool)
+        else:
+            done = np.zeros(batch.num_rows, dtype=bool)
+        experience.append(states[keep], actions[keep].astype(np.int8),
+                          batch.column("reward").to_numpy(zero_copy_only=False)[keep], next_states[keep],
+                          done[keep])
+        session_ids.extend(np.asarray(batch.column("session_id").to_pylist(), dtype=object)[keep])
+    mark_session_ends(experience.arrays["done"][:experience.size], session_ids)
+    return experience
+
+
+_worker_experience = None
+
+
+def _attach(names, capacity):
+    global _worker_experience
+    _worker_experience = SharedExperience(capacity, names=names)
+
+
+def _design(states, mean, scale):
+    """Standardized states with a trailing bias column"""
+    X = np.empty((len(states), STATE_DIM + 1), dtype=np.float64)
+    np.subtract(states, mean, out=X[:, :-1])
+    X[:, :-1] /= scale
+    X[:, -1] = 1.0
+    return X
+
+
+def shard_normal_equations(start, end, weights, mean, scale, gamma):
+    """
+    Per-action X^T X and X^T y over transitions [start, end), where y uses
+    the current (dim + 1, actions) weights for the bootstrapped next value.
+    """
+    arrays = _worker_experience.arrays
+    X = _design(arrays["states"][start:end], mean, scale)
+    y = arrays["rewards"][start:end].astype(np.float64)
+    if gamma:
+        # Terminal transitions have nothing to bootstrap from
+        next_values = (_design(arrays["next_states"][start:end], mean, scale) @ weights).max(axis=1)
+        next_values[arrays["done"][start:end]] = 0.0
+        y += gamma * next_values
+    actions = arrays["actions"][start:end]
+
+    gram = np.zeros((N_ACTIONS, STATE_DIM + 1, STATE_DIM + 1))
+    moment = np.zeros((N_ACTIONS, STATE_DIM + 1))
+    counts = np.bincount(actions, minlength=N_ACTIONS)
+    for a in np.flatnonzero(counts):
+        Xa = X[actions == a]
+        gram[a] = Xa.T @ Xa
+        moment[a] = Xa.T @ y[actions == a]
+    return gram, moment, counts
+
+
+def solve(gram, moment, counts, ridge):
+    """(dim + 1, actions) weights from summed normal equations; the bias is not penalized"""
+    penalty = np.eye(STATE_DIM + 1) * ridge
+    penalty[-1, -1] = 0.0
+    weights = np.zeros((STATE_DIM + 1, N_ACTIONS))
+    for a in range(N_ACTIONS):
+        if counts[a]:
+            weights[:, a] = np.linalg.lstsq(gram[a] + penalty, moment[a], rcond=None)[0]
+        else:
+            weights[-1, a] = UNSEEN_ACTION_BIAS
+    return weights
+
+
+def rebase_bot_weights(policy, mean, scale):
+    """The policy's bot-score model re-expressed for a new standardization"""
+    weights = policy.bot_weights * scale / policy.scale
+    bias = policy.bot_bias + float(np.sum(policy.bot_weights * (mean - policy.mean) / policy.scale))
+    return weights.astype(np.float32), bias
+
+
+def save_checkpoint(directory, iteration, weights, mean, scale, rows):
+    os.makedirs(directory, exist_ok=True)
+    tmp = os.path.join(directory, "checkpoint.npz.tmp")
+    with open(tmp, "wb") as f:
+        np.savez(f, iteration=iteration, weights=weights, mean=mean, scale=scale, rows=rows)
+    os.replace(tmp, os.path.join(directory, "checkpoint.npz"))
+
+
+def load_checkpoint(directory):
+    path = os.path.join(directory, "checkpoint.npz")
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return int(data["iteration"]), data["weights"], data["mean"], data["scale"], int(data["rows"])
+
+
+def train(experience, workers=4, iterations=10, gamma=0.9, ridge=1.0, shard_rows=50000,
+          checkpoint_dir=None, resume=False, log=print):
+    """Run fitted Q iteration on `experience`; returns (weights, mean, scale, action counts)"""
+    n = experience.size
+    states = experience.arrays["states"][:n]
+    mean = states.mean(axis=0, dtype=np.float64)
+    scale = states.std(axis=0, dtype=np.float64)
+    scale[scale < 1e-6] = 1.0
+    weights = np.zeros((STATE_DIM + 1, N_ACTIONS))
+    first = 0
+
+    if resume and checkpoint_dir:
+        checkpoint = load_checkpoint(checkpoint_dir)
+        if checkpoint is not None and checkpoint[4] == n:
+            first, weights, mean, scale, _ = checkpoint
+            log(f"Resuming after iteration {first}")
+
+    shards = [(start, min(start + shard_rows, n)) for start in range(0, n, shard_rows)]
+    counts = np.zeros(N_ACTIONS, dtype=np.int64)
+    with Pool(workers, initializer=_attach, initargs=(experience.names(), experience.capacity)) as pool:
+        for iteration in range(first + 1, iterations + 1):
+            started = time.perf_counter()
+            results = pool.starmap(shard_normal_equations,
+                                   [(start, end, weights, mean, scale, gamma) for start, end in shards])
+            gram = sum(r[0] for r in results)
+            moment = sum(r[1] for r in results)
+            counts = sum(r[2] for r in results)
+            new_weights = solve(gram, moment, counts, ridge)
+            change = float(np.abs(new_weights - weights).max())
+            weights = new_weights
+            if checkpoint_dir:
+                save_checkpoint(checkpoint_dir, iteration, weights, mean, scale, n)
+            log(f"Iteration {iteration}/{iterations}: max weight change {change:.4g} "
+                f"({time.perf_counter() - started:.2f}s)")
+            if gamma == 0:
+                break  # no bootstrapping: one regression is the answer
+    return weights, mean, scale, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=DEFAULT_POLICY_PATH, help="where to write the policy the app loads")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--gamma", type=float, default=0.9, help="discount for next-state values (0 = bandit)")
+    parser.add_argument("--ridge", type=float, default=1.0, help="L2 penalty on the action weights")
+    parser.add_argument("--chunk-size", type=int, default=10000, help="rows per fetch while loading")
+    parser.add_argument("--shard-rows", type=int, default=50000, help="transitions per worker task")
+    parser.add_argument("--max-rows", type=int, default=0,
+                        help="train on the newest this many transitions (0 = all)")
+    parser.add_argument("--dataset", help="read an export_dataset.py directory instead of the database")
+    parser.add_argument("--checkpoint-dir", default="train_checkpoints")
+    parser.add_argument("--resume", action="store_true", help="continue from the last checkpoint")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    if args.dataset:
+        experience = load_from_dataset(args.dataset, args.max_rows, args.chunk_size)
+    else:
+        experience = load_from_db(args.max_rows, args.chunk_size)
+    try:
+        print(f"Loaded {experience.size} transitions in {time.perf_counter() - started:.1f}s")
+        if experience.size == 0:
+            print("Nothing to train on")
+            return
+        weights, mean, scale, counts = train(
+            experience, workers=args.workers, iterations=args.iterations, gamma=args.gamma,
+            ridge=args.ridge, shard_rows=args.shard_rows, checkpoint_dir=args.checkpoint_dir,
+            resume=args.resume
+        )
+    finally:
+        experience.close(unlink=True)
+
+    base = LinearPolicy.load(args.out) if os.path.exists(args.out) else LinearPolicy.default()
+    bot_weights, bot_bias = rebase_bot_weights(base, mean.astype(np.float32), scale.astype(np.float32))
+    policy = LinearPolicy(mean, scale, bot_weights, bot_bias,
+                          action_weights=weights[:-1], action_bias=weights[-1],
+                          version=int(time.time()))
+    policy.save(args.out)
+    print(json.dumps({
+        "policy": args.out,
+        "version": policy.version,
+        "transitions": int(sum(counts)),
+        "transitions_per_action": {name: int(c) for name, c in zip(ACTIONS, counts)},
+        "seconds": round(time.perf_counter() - started, 1),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+"""
+Feature extraction throughput (events/sec).
+
+    python benchmarks/bench_features.py [--sessions 200] [--events 400] [--seed 0]
+
+Times features.extract_features() over seeded synthetic sessions, split into
+the dict-to-array conversion and the NumPy feature math.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import features  # noqa: E402
+from synthetic import sessions  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--events", type=int, default=400, help="mouse events per session")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    batches = [events for _, events in sessions(args.seed, args.sessions, n_mouse=args.events)]
+    total = sum(len(b) for b in batches)
+
+    started = time.perf_counter()
+    arrays = [features.events_to_arrays(b) for b in batches]
+    convert_s = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for a in arrays:
+        features.extract_features_from_arrays(a)
+    compute_s = time.perf_counter() - started
+
+    print(json.dumps({
+        "sessions": len(batches),
+        "events": total,
+        "convert_events_per_s": round(total / convert_s),
+        "compute_events_per_s": round(total / compute_s),
+        "end_to_end_events_per_s": round(total / (convert_s + compute_s)),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+"""
+Side-by-side /api/events benchmark: Flask app (main.py) vs asyncio app (asgi.py).
+
+    python benchmarks/bench_ingest_servers.py [--requests 3000] [--concurrency 64]
+
+Starts both servers from backend/ as subprocesses, sends the same seeded
+synthetic session batches to each and prints one JSON report. Both
+servers use the .env database settings; without a reachable Postgres the
+writers just count failed flushes, and the numbers then measure the
+request path only.
+"""
+import argparse
+import asyncio
+import json
+
+from loadgen import json_request, run_load
+from servers import fetch_json, start_server, stop_server
+from synthetic import sessions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--events", type=int, default=50, help="mouse events per batch")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    batches = [
+        {"session_id": f"bench-{i}", "events": events}
+        for i, (_, events) in enumerate(sessions(args.seed, 200, n_mouse=args.events, n_keys=10))
+    ]
+
+    def make_request(i):
+        return json_request("POST", "/api/events", batches[i % len(batches)])
+
+    servers = {
+        "flask": (["flask", "--app", "main", "run", "--port", "18080", "--no-reload"], 18080),
+        "asgi": (["uvicorn", "asgi:app", "--port", "18081", "--log-level", "warning"], 18081),
+    }
+    report = {"requests": args.requests, "concurrency": args.concurrency, "servers": {}}
+    for name, (command, port) in servers.items():
+        proc = start_server(command, port)
+        try:
+            result = asyncio.run(run_load("127.0.0.1", port, make_request, args.concurrency, args.requests))
+            result["writer"] = fetch_json(port, "/api/events/stats")
+            report["servers"][name] = result
+        finally:
+            stop_server(proc)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
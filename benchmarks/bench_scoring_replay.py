@@ -0,0 +1,236 @@
+"""
+Offline replay of sessions through the whole scoring path, in-process.
+
+    python benchmarks/bench_scoring_replay.py [--sessions 1000] [--events 400] [--seed 0]
+        [--bot-ratio 0.5] [--ambiguous-ratio 0.3] [--batch 64] [--repeat 3] [--recorded sessions.jsonl]
+        [--rules backend/rules.json] [--policy backend/policy.npz]
+        [--output result.json] [--compare baseline.json] [--max-regression 10]
+        [--max-accuracy-drop 0]
+
+Each session's raw events (seeded synthetic human and scripted-bot mouse
+traces, keystrokes and honeypot clicks, or --recorded JSON lines of
+{"is_bot": ..., "events": [...]}) go through the same steps as
+POST /api/score, a --batch of sessions at a time like scoring.MicroBatcher.
+--ambiguous-ratio of the synthetic sessions are noisy humans and humanized
+bots that no rule in rules.json decides, so the policy's decisions count
+towards accuracy.
+
+  decode     features.events_to_arrays()
+  features   features.extract_features_from_arrays()
+  vector     features.feature_vector(), stacked into a matrix
+  prefilter  rules.RuleSet.match() (rules.json)
+  policy     policy.LinearPolicy.act()
+
+The policy is timed on the whole batch, including rows a rule already
+decided (the app skips those), so its cost is measured whatever the rules
+catch; a matching rule's decision still wins.
+
+The report has decisions/s and the time per stage (fastest of --repeat
+runs), peak traced memory and max RSS, and detection accuracy against the
+labels. "decisions_digest" hashes every decision, so a change that alters
+outcomes for the same seed shows up even when accuracy does not move.
+--compare prints the change against an earlier report and exits non-zero
+when decisions/s dropped by more than --max-regression percent or accuracy
+by more than --max-accuracy-drop.
+"""
+import argparse
+import hashlib
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import features  # noqa: E402
+from policy import ACTIONS, LinearPolicy  # noqa: E402
+from rules import DEFAULT_RULES_PATH, RuleSet  # noqa: E402
+from synthetic import sessions  # noqa: E402
+
+STAGES = ("decode", "features", "vector", "prefilter", "policy")
+# Per-session columns of mouseDynamics / keystrokeDynamics (create_database.py)
+TABLE_FEATURES = ("movement_speed", "pause_duration", "honeypot_clicked", "typing_speed")
+BOT_SCORE_CUTOFF = 0.5
+
+
+def load_recorded(path):
+    with open(path) as f:
+        return [(bool(r["is_bot"]), r["events"]) for r in map(json.loads, f) if r.get("events")]
+
+
+def replay(fixture, prefilter, policy, batch_size):
+    """Run every session through the pipeline; returns (stage seconds, scores, actions, rule index, X)"""
+    times = dict.fromkeys(STAGES, 0.0)
+    scores = np.empty(len(fixture), dtype=np.float32)
+    actions = np.empty(len(fixture), dtype=np.int64)
+    rule_index = np.empty(len(fixture), dtype=np.int64)
+    matrices = []
+    clock = time.perf_counter
+    for start in range(0, len(fixture), batch_size):
+        batch = fixture[start:start + batch_size]
+        end = start + len(batch)
+
+        t0 = clock()
+        arrays = [features.events_to_arrays(events) for _, events in batch]
+        t1 = clock()
+        values = [features.extract_features_from_arrays(a) for a in arrays]
+        t2 = clock()
+        X = np.stack([features.feature_vector(v) for v in values])
+        t3 = clock()
+        matched = prefilter.match(X)
+        t4 = clock()
+        scores[start:end], actions[start:end] = policy.act(X)
+        t5 = clock()
+
+        decided = matched >= 0
+        scores[start:end][decided] = prefilter.bot_score[matched[decided]]
+        actions[start:end][decided] = prefilter.action_index[matched[decided]]
+        rule_index[start:end] = matched
+        matrices.append(X)
+        for stage, elapsed in zip(STAGES, (t1 - t0, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            times[stage] += elapsed
+    return times, scores, actions, rule_index, np.concatenate(matrices)
+
+
+def accuracy(labels, scores, actions):
+    bots = labels
+    humans = ~labels
+    predicted_bot = scores >= BOT_SCORE_CUTOFF
+    allowed = actions == ACTIONS.index("allow")
+    true_positive = int((predicted_bot & bots).sum())
+    return {
+        "accuracy": round(float((predicted_bot == bots).mean()), 4),
+        "precision": round(true_positive / max(int(predicted_bot.sum()), 1), 4),
+        "recall": round(true_positive / max(int(bots.sum()), 1), 4),
+        # What the served action does to each class, which is what users see
+        "bots_not_allowed": round(float((~allowed[bots]).mean()), 4) if bots.any() else None,
+        "humans_allowed": round(float(allowed[humans].mean()), 4) if humans.any() else None,
+        "actions": {
+            label: {name: int((actions[mask] == i).sum()) for i, name in enumerate(ACTIONS)}
+            for label, mask in (("bot", bots), ("human", humans))
+        },
+    }
+
+
+def compare(report, baseline):
+    lines = []
+    for label, new_value, old_value in [
+        ("decisions_per_s", report["decisions_per_s"], baseline["decisions_per_s"]),
+        *((f"{stage}_us", report["stage_us_per_decision"][stage], baseline["stage_us_per_decision"][stage])
+          for stage in STAGES),
+        ("peak_traced_mb", report["memory"]["peak_traced_mb"], baseline["memory"]["peak_traced_mb"]),
+        ("accuracy", report["accuracy"]["accuracy"], baseline["accuracy"]["accuracy"]),
+    ]:
+        change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+        lines.append(f"{label:18s} {old_value:>12} -> {new_value:>12} ({change:+.1f}%)")
+    if report["decisions_digest"] != baseline.get("decisions_digest"):
+        lines.append("decisions differ from the baseline (same seed and settings?)")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=1000)
+    parser.add_argument("--events", type=int, default=400, help="mouse events per session")
+    parser.add_argument("--keys", type=int, default=40, help="keystrokes per session")
+    parser.add_argument("--bot-ratio", type=float, default=0.5)
+    parser.add_argument("--ambiguous-ratio", type=float, default=0.3,
+                        help="share of synthetic sessions no prefilter rule decides")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch", type=int, default=64, help="sessions per prefilter/policy call")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs; the fastest is reported")
+    parser.add_argument("--recorded", help="JSON lines of recorded sessions instead of synthetic ones")
+    parser.add_argument("--rules", default=DEFAULT_RULES_PATH, help="prefilter rules (empty = none)")
+    parser.add_argument("--policy", help="LinearPolicy .npz (default: the built-in policy)")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    parser.add_argument("--max-regression", type=float, default=10.0,
+                        help="with --compare, fail if decisions/s dropped by more than this percent")
+    parser.add_argument("--max-accuracy-drop", type=float, default=0.0,
+                        help="with --compare, fail if accuracy dropped by more than this (0-1)")
+    args = parser.parse_args()
+
+    if args.recorded:
+        fixture = load_recorded(args.recorded)
+    else:
+        fixture = list(sessions(args.seed, args.sessions, bot_ratio=args.bot_ratio,
+                                n_mouse=args.events, n_keys=args.keys, ambiguous_ratio=args.ambiguous_ratio))
+    labels = np.array([is_bot for is_bot, _ in fixture], dtype=bool)
+    prefilter = RuleSet.load(args.rules) if args.rules else RuleSet([])
+    policy = LinearPolicy.load(args.policy) if args.policy else LinearPolicy.default()
+
+    # Warm-up, then timed runs; memory is traced in a separate run since
+    # tracemalloc slows every allocation down
+    replay(fixture[:args.batch], prefilter, policy, args.batch)
+    runs = [replay(fixture, prefilter, policy, args.batch) for _ in range(max(args.repeat, 1))]
+    times, scores, actions, rule_index, X = min(runs, key=lambda run: sum(run[0].values()))
+    tracemalloc.start()
+    replay(fixture, prefilter, policy, args.batch)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    n = len(fixture)
+    total_s = sum(times.values())
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (np.round(scores, 4), actions, rule_index):
+        digest.update(np.ascontiguousarray(part).tobytes())
+    columns = [features.FEATURE_NAMES.index(name) for name in TABLE_FEATURES]
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "fixture": {
+            "sessions": n,
+            "bots": int(labels.sum()),
+            "honeypot_sessions": int((X[:, features.FEATURE_NAMES.index("honeypot_clicked")] > 0).sum()),
+            "events": sum(len(events) for _, events in fixture),
+            "table_feature_means": {
+                label: {name: round(float(X[mask, c].mean()), 4) if mask.any() else None
+                        for name, c in zip(TABLE_FEATURES, columns)}
+                for label, mask in (("bot", labels), ("human", ~labels))
+            },
+        },
+        "decisions_per_s": round(n / total_s),
+        "stage_us_per_decision": {stage: round(s / n * 1e6, 2) for stage, s in times.items()},
+        "stage_share": {stage: round(s / total_s, 3) for stage, s in times.items()},
+        "decided_by_rules": {
+            "total": int((rule_index >= 0).sum()),
+            **{rule.name: int((rule_index == i).sum()) for i, rule in enumerate(prefilter.rules)},
+        },
+        "memory": {
+            "peak_traced_mb": round(peak / 2**20, 2),
+            # ru_maxrss is KiB on Linux, bytes on macOS
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                                / (2**20 if sys.platform == "darwin" else 2**10), 1),
+        },
+        "accuracy": accuracy(labels, scores, actions),
+        "decisions_digest": digest.hexdigest(),
+    }
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(compare(report, baseline), file=sys.stderr)
+        failures = []
+        drop = (1 - report["decisions_per_s"] / baseline["decisions_per_s"]) * 100
+        if drop > args.max_regression:
+            failures.append(f"decisions/s dropped {drop:.1f}% (limit {args.max_regression}%)")
+        accuracy_drop = baseline["accuracy"]["accuracy"] - report["accuracy"]["accuracy"]
+        if accuracy_drop > args.max_accuracy_drop + 1e-9:
+            failures.append(f"accuracy dropped {accuracy_drop:.4f} (limit {args.max_accuracy_drop})")
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
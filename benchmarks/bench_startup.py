@@ -0,0 +1,70 @@
+"""
+Cold-start time of both backends, from `python -X importtime`.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 15]
+
+Each run is a fresh interpreter that imports the app module and calls its
+create_app() factory, i.e. what a new worker does before it can serve.
+Reports the median wall time and import time per app, and the slowest
+imports (cumulative, from the median run) so regressions can be traced to a
+module.
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+
+from servers import BACKEND_DIR, TICKETMONARCH_DIR
+
+APPS = {
+    "rlcaptcha": (BACKEND_DIR, "main"),
+    "ticketmonarch": (TICKETMONARCH_DIR, "app"),
+}
+
+
+def parse_importtime(stderr):
+    """[(module, self_us, cumulative_us)] from -X importtime output; nested modules keep their indent"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        imports.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return imports
+
+
+def run_once(cwd, module):
+    code = f"import {module}; {module}.create_app()"
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=cwd,
+                            capture_output=True, text=True, check=True)
+    wall_ms = (time.perf_counter() - started) * 1000
+    imports = parse_importtime(result.stderr)
+    # Top-level entries (no leading indentation) add up to the total
+    total_us = sum(cumulative for name, _, cumulative in imports if not name.startswith(" "))
+    return wall_ms, total_us / 1000, imports
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15, help="slowest imports to list per app")
+    args = parser.parse_args()
+
+    report = {}
+    for name, (cwd, module) in APPS.items():
+        runs = sorted((run_once(cwd, module) for _ in range(args.runs)), key=lambda r: r[0])
+        wall_ms, import_ms, imports = runs[len(runs) // 2]
+        slowest = sorted(imports, key=lambda i: i[2], reverse=True)[:args.top]
+        report[name] = {
+            "wall_ms_median": round(wall_ms, 1),
+            "import_ms": round(import_ms, 1),
+            "slowest_imports_ms": {n.strip(): round(c / 1000, 1) for n, _, c in slowest},
+            "pandas_loaded": any(n.strip() == "pandas" for n, _, _ in imports),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+/api/events wire formats: request bytes and server-side decode time.
+
+    python benchmarks/bench_wire_format.py [--sessions 200] [--events 400] [--seed 0]
+
+Encodes seeded synthetic batches as plain JSON events and as the columnar
+format rounded to 0.1 ms / 0.1 px (JSON and, if msgpack is installed,
+MessagePack with whole-unit int32 bin columns), each with and without gzip,
+and times decoding them to the arrays the feature code consumes.
+"""
+import argparse
+import gzip
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import event_codec  # noqa: E402
+import features  # noqa: E402
+from synthetic import sessions  # noqa: E402
+
+
+def to_arrays(body, encoding, content_type):
+    data = event_codec.decode_body(body, encoding, content_type)
+    if event_codec.is_columnar(data):
+        return event_codec.columns_to_arrays(data)
+    return features.events_to_arrays(data["events"])
+
+
+def msgpack_body(batch):
+    import msgpack
+
+    packed = dict(batch)
+    for name in ("t", "x", "y"):
+        packed[name] = np.rint(batch[name]).astype("<i4").tobytes()
+    return msgpack.packb(packed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--events", type=int, default=400, help="mouse events per session")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    batches = [(f"bench-{i}", events)
+               for i, (_, events) in enumerate(sessions(args.seed, args.sessions, n_mouse=args.events))]
+    total_events = sum(len(events) for _, events in batches)
+
+    plain = [json.dumps({"session_id": s, "events": events}).encode() for s, events in batches]
+    columnar = [event_codec.encode_columnar(s, events, decimals=1) for s, events in batches]
+    formats = {
+        "json": (plain, None, "application/json"),
+        "json+gzip": ([gzip.compress(b) for b in plain], "gzip", "application/json"),
+        "columnar": ([json.dumps(c).encode() for c in columnar], None, "application/json"),
+    }
+    formats["columnar+gzip"] = ([gzip.compress(b) for b in formats["columnar"][0]], "gzip", "application/json")
+    try:
+        packed = [msgpack_body(c) for c in columnar]
+        formats["msgpack"] = (packed, None, "application/msgpack")
+        formats["msgpack+gzip"] = ([gzip.compress(b) for b in packed], "gzip", "application/msgpack")
+    except ImportError:
+        pass
+
+    report = {"events": total_events, "formats": {}}
+    for name, (bodies, encoding, content_type) in formats.items():
+        size = sum(len(b) for b in bodies)
+        started = time.perf_counter()
+        for body in bodies:
+            to_arrays(body, encoding, content_type)
+        elapsed = time.perf_counter() - started
+        report["formats"][name] = {
+            "bytes_per_event": round(size / total_events, 2),
+            "decode_us_per_event": round(elapsed / total_events * 1e6, 3),
+            "events_per_s": round(total_events / elapsed),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""
+Minimal asyncio HTTP/1.1 load generator used by the benchmark scripts.
+
+Keeps `concurrency` keep-alive connections busy (reconnecting when the
+server closes them), optionally paced to a total request rate, and reports
+throughput, latency percentiles and error rate.
+"""
+import asyncio
+import json
+import time
+
+import numpy as np
+
+
+class _Connection:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        lines = [f"{method} {path} HTTP/1.1", f"Host: {self.host}:{self.port}",
+                 f"Content-Length: {len(body)}"]
+        for name, value in (headers or {}).items():
+            lines.append(f"{name}: {value}")
+        self.writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("server closed the connection")
+        status = int(status_line.split()[1])
+        length = 0
+        close = status_line.startswith(b"HTTP/1.0")
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            name = name.strip().lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection":
+                close = value.strip().lower() == "close"
+        payload = await self.reader.readexactly(length) if length else b""
+        if close:
+            self.close()
+        return status, payload
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run_load(host, port, make_request, concurrency=32, requests=2000, rate=None, timeout=10.0):
+    """
+    Send `requests` requests built by make_request(i) -> (method, path, body_bytes, headers).
+
+    With `rate` (requests/s) set, request i is not started before
+    i / rate seconds into the run; latency is still measured from the actual
+    send. Returns a summary dict.
+    """
+    latencies = np.zeros(requests)
+    statuses = {}
+    errors = 0
+    counter = iter(range(requests))
+    started = time.perf_counter()
+
+    async def worker():
+        nonlocal errors
+        conn = _Connection(host, port)
+        for i in counter:
+            if rate:
+                delay = started + i / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            method, path, body, headers = make_request(i)
+            t0 = time.perf_counter()
+            try:
+                status, _ = await asyncio.wait_for(conn.request(method, path, body, headers), timeout)
+                statuses[status] = statuses.get(status, 0) + 1
+                if status >= 500:
+                    errors += 1
+            except Exception:
+                errors += 1
+                statuses["error"] = statuses.get("error", 0) + 1
+                conn.close()
+            latencies[i] = time.perf_counter() - t0
+        conn.close()
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return summarize(latencies, elapsed, errors, statuses, concurrency)
+
+
+def summarize(latencies, elapsed, errors, statuses, concurrency):
+    ms = latencies * 1000
+    return {
+        "requests": int(latencies.size),
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_rps": round(latencies.size / elapsed, 1),
+        "latency_ms": {
+            "p50": round(float(np.percentile(ms, 50)), 3),
+            "p95": round(float(np.percentile(ms, 95)), 3),
+            "p99": round(float(np.percentile(ms, 99)), 3),
+            "max": round(float(ms.max()), 3),
+        },
+        "error_rate": round(errors / latencies.size, 4),
+        "status_counts": {str(k): v for k, v in sorted(statuses.items(), key=str)},
+    }
+
+
+def json_request(method, path, payload):
+    body = json.dumps(payload).encode()
+    return method, path, body, {"Content-Type": "application/json"}
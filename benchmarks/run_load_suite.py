@@ -0,0 +1,249 @@
+"""
+Reproducible HTTP load test for both backends.
+
+    python benchmarks/run_load_suite.py [--scenario events checkout]
+        [--concurrency 32] [--requests 3000] [--rate 0] [--seed 0]
+        [--use-env-db] [--output result.json] [--compare baseline.json]
+
+Starts the RL-CAPTCHA Flask app (backend/main.py) and the TicketMonarch app
+(TicketMonarch/backend/app.py) locally and drives them with seeded synthetic
+traffic:
+
+  events    POST /api/events batches cut from simulated human and bot
+            sessions (mouse traces, keystrokes, honeypot clicks)
+  checkout  POST /api/checkout form submissions
+
+TicketMonarch always runs against a fresh SQLite file in a temp directory
+(created with `flask init-db`).
+The RL-CAPTCHA app runs against a temporary cluster created with
+initdb/pg_ctl (must be on PATH), initialised with create_database.py and
+seeded with the benchmark's users and sessions. --use-env-db targets the
+.env Postgres settings instead; the benchmark's users, sessions and events
+(session ids bench-<seed>-<n>) are then written to that database and left
+there.
+
+The report (JSON) records the git commit, settings and, per scenario,
+throughput, p50/p95/p99 latency and error rate. A 202 only means the batch
+was queued, so the run fails (exit 1) if the event writer's stats show
+failed flushes or lost rows afterwards. --compare prints the change against
+an earlier report.
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from loadgen import json_request, run_load
+from servers import BACKEND_DIR, ROOT_DIR, TICKETMONARCH_DIR, fetch_json, start_server, stop_server
+from synthetic import sessions
+
+RL_PORT = 18090
+TICKETMONARCH_PORT = 18091
+PG_PORT = 55432
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def event_batches(seed, session_count, batch_size=50):
+    """Cut each synthetic session into the batches a browser would post"""
+    batches = []
+    for i, (is_bot, events) in enumerate(sessions(seed, session_count)):
+        session_id = f"bench-{seed}-{i}"
+        for start in range(0, len(events), batch_size):
+            batches.append({"session_id": session_id, "events": events[start:start + batch_size]})
+    # Interleave sessions the way concurrent clients would
+    order = np.random.default_rng(seed).permutation(len(batches))
+    return [batches[i] for i in order]
+
+
+def checkout_forms(seed, count):
+    rng = np.random.default_rng(seed)
+    forms = []
+    for i in range(count):
+        forms.append({
+            "full_name": f"Bench User {i}",
+            "email": f"user{i}@example.com",
+            "card_number": "".join(str(d) for d in rng.integers(0, 10, 16)),
+            "card_expiry": f"{rng.integers(1, 13):02d}/{rng.integers(26, 32)}",
+            "card_cvv": f"{rng.integers(0, 1000):03d}",
+            "billing_address": f"{rng.integers(1, 9999)} Main St",
+            "city": "San Jose",
+            "state": "CA",
+            "zip_code": f"{rng.integers(90000, 96000)}",
+        })
+    return forms
+
+
+class ThrowawayPostgres:
+    """Temporary local Postgres cluster with trust auth"""
+
+    def __init__(self, port=PG_PORT):
+        self.port = port
+        self.dir = tempfile.mkdtemp(prefix="rlcaptcha-pg-")
+        self.data = os.path.join(self.dir, "data")
+
+    def __enter__(self):
+        if not shutil.which("initdb") or not shutil.which("pg_ctl"):
+            raise RuntimeError("the events scenario needs initdb and pg_ctl on PATH (or --use-env-db)")
+        subprocess.run(["initdb", "-D", self.data, "-U", "postgres", "--auth=trust"],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run(["pg_ctl", "-D", self.data, "-l", os.path.join(self.dir, "log"), "-w",
+                        "-o", f"-p {self.port} -k {self.dir}", "start"], check=True, stdout=subprocess.DEVNULL)
+        return self
+
+    def env(self):
+        return {"PSQL_HOST": "127.0.0.1", "PSQL_PORT": str(self.port), "PSQL_USER": "postgres",
+                "PSQL_DBNAME": "postgres", "PSQL_PASSWORD": ""}
+
+    def __exit__(self, *exc):
+        subprocess.run(["pg_ctl", "-D", self.data, "-m", "fast", "stop"], stdout=subprocess.DEVNULL)
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+def seed_postgres(env, session_ids, create_schema=True):
+    """Create the schema (throwaway cluster) and the users/sessions the event batches refer to"""
+    if create_schema:
+        subprocess.run([sys.executable, "create_database.py"], cwd=BACKEND_DIR, env={**os.environ, **env},
+                       check=True)
+        connect = dict(host=env["PSQL_HOST"], port=env["PSQL_PORT"], user=env["PSQL_USER"],
+                       dbname=env["PSQL_DBNAME"], password=env["PSQL_PASSWORD"])
+    else:
+        # The app's own .env settings
+        sys.path.insert(0, BACKEND_DIR)
+        from db import connect_kwargs
+        connect = connect_kwargs()
+    import psycopg2
+    from psycopg2.extras import execute_values
+    conn = psycopg2.connect(**connect)
+    with conn, conn.cursor() as cur:
+        execute_values(cur, """
+            INSERT INTO webUser (user_id, username, email) VALUES %s ON CONFLICT DO NOTHING
+        """, [(f"user-{s}", f"user-{s}", f"{s}@bench.local") for s in session_ids])
+        execute_values(cur, """
+            INSERT INTO sessions (session_id, user_id, session_status) VALUES %s ON CONFLICT DO NOTHING
+        """, [(s, f"user-{s}", "active") for s in session_ids])
+    conn.close()
+
+
+def run_scenario(port, make_request, args, count):
+    return asyncio.run(run_load("127.0.0.1", port, make_request, args.concurrency, count, args.rate or None))
+
+
+def compare(report, baseline):
+    lines = []
+    for name, result in report["scenarios"].items():
+        old = baseline.get("scenarios", {}).get(name)
+        if not old:
+            continue
+        for label, new_value, old_value in (
+            ("throughput_rps", result["throughput_rps"], old["throughput_rps"]),
+            ("p50_ms", result["latency_ms"]["p50"], old["latency_ms"]["p50"]),
+            ("p99_ms", result["latency_ms"]["p99"], old["latency_ms"]["p99"]),
+            ("error_rate", result["error_rate"], old["error_rate"]),
+        ):
+            change = (new_value - old_value) / old_value * 100 if old_value else 0.0
+            lines.append(f"{name:10s} {label:15s} {old_value:>12} -> {new_value:>12} ({change:+.1f}%)")
+    return "\n".join(lines)
+
+
+def writer_failures(stats):
+    """Reasons the event writer did not store everything it accepted"""
+    return [f"{key}={stats[key]}" for key in ("flushes_failed", "rows_lost") if stats.get(key, 0) > 0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scenario", nargs="+", choices=("events", "checkout"), default=["events", "checkout"])
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=3000, help="requests per scenario")
+    parser.add_argument("--rate", type=float, default=0, help="target requests/s per scenario (0 = open loop)")
+    parser.add_argument("--sessions", type=int, default=100, help="synthetic sessions for the events scenario")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--use-env-db", action="store_true",
+                        help="write the events scenario to the .env database instead of a temporary cluster")
+    parser.add_argument("--output", help="also write the report to this file")
+    parser.add_argument("--compare", help="earlier report to compare against")
+    args = parser.parse_args()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+        "scenarios": {},
+    }
+
+    pg = ThrowawayPostgres() if "events" in args.scenario and not args.use_env_db else None
+    tmp = tempfile.mkdtemp(prefix="ticketmonarch-bench-")
+    failures = []
+    try:
+        if "events" in args.scenario:
+            batches = event_batches(args.seed, args.sessions)
+            session_ids = sorted({b["session_id"] for b in batches})
+            env = {}
+            if pg is not None:
+                pg.__enter__()
+                env = pg.env()
+                seed_postgres(env, session_ids)
+            else:
+                print(f"Writing {len(session_ids)} benchmark sessions to the .env database", file=sys.stderr)
+                seed_postgres(env, session_ids, create_schema=False)
+            proc = start_server(["flask", "--app", "main", "run", "--port", str(RL_PORT), "--no-reload"],
+                                RL_PORT, cwd=BACKEND_DIR, env=env)
+            try:
+                result = run_scenario(
+                    RL_PORT, lambda i: json_request("POST", "/api/events", batches[i % len(batches)]),
+                    args, args.requests)
+                time.sleep(0.5)  # let the writer finish its last flush before reading stats
+                result["writer"] = fetch_json(RL_PORT, "/api/events/stats")
+                failures += [f"events: writer {reason}" for reason in writer_failures(result["writer"])]
+                report["scenarios"]["events"] = result
+            finally:
+                stop_server(proc)
+
+        if "checkout" in args.scenario:
+            forms = checkout_forms(args.seed, args.requests)
+            env = {"CHECKOUTS_DB_PATH": os.path.join(tmp, "checkouts.db")}
+            subprocess.run([sys.executable, "-m", "flask", "--app", "app", "init-db"], cwd=TICKETMONARCH_DIR,
+                           env={**os.environ, **env}, check=True, stdout=subprocess.DEVNULL)
+            proc = start_server(["flask", "--app", "app", "run", "--port", str(TICKETMONARCH_PORT), "--no-reload"],
+                                TICKETMONARCH_PORT, cwd=TICKETMONARCH_DIR, env=env, ready_path="/api/checkout")
+            try:
+                report["scenarios"]["checkout"] = run_scenario(
+                    TICKETMONARCH_PORT, lambda i: json_request("POST", "/api/checkout", forms[i]),
+                    args, args.requests)
+            finally:
+                stop_server(proc)
+    finally:
+        if pg is not None and os.path.exists(pg.data):
+            pg.__exit__(None, None, None)
+        shutil.rmtree(tmp, ignore_errors=True)
+
+    report["failures"] = failures
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if args.compare:
+        with open(args.compare) as f:
+            print(compare(report, json.load(f)), file=sys.stderr)
+    if failures:
+        for failure in failures:
+            print(failure, file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
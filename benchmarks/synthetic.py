@@ -0,0 +1,106 @@
+"""Seeded synthetic /api/events sessions shared by the benchmark scripts."""
+import numpy as np
+
+KEYS = list("abcdefghijklmnopqrstuvwxyz ")
+
+
+def human_session(rng, n_mouse=400, n_keys=40):
+    """Curved, jittery mouse path with irregular pauses and uneven typing"""
+    gaps = 4 + rng.gamma(2.0, 6.0, n_mouse)
+    pauses = rng.random(n_mouse) < 0.05
+    gaps[pauses] += rng.uniform(150, 900, int(pauses.sum()))
+    t = np.cumsum(gaps)
+    angle = np.cumsum(rng.normal(0, 0.25, n_mouse))
+    step = rng.gamma(2.0, 3.0, n_mouse)
+    x = 200 + np.cumsum(step * np.cos(angle))
+    y = 200 + np.cumsum(step * np.sin(angle))
+    events = [
+        {"type": "mousemove", "t": float(t[i]), "x": float(x[i]), "y": float(y[i])}
+        for i in range(n_mouse)
+    ]
+    events.append({"type": "click", "t": float(t[-1] + 80), "x": float(x[-1]), "y": float(y[-1])})
+    events.extend(_typing(rng, t[-1] + 500, n_keys, interval=(0.08, 0.35), dwell=(0.05, 0.15)))
+    return events
+
+
+def bot_session(rng, n_mouse=400, n_keys=40, honeypot=None):
+    """Straight, evenly sampled mouse path and machine-regular typing"""
+    if honeypot is None:
+        honeypot = rng.random() < 0.5
+    t = np.arange(n_mouse) * 10.0
+    x = np.linspace(0, 800, n_mouse)
+    y = np.linspace(0, 400, n_mouse)
+    events = [
+        {"type": "mousemove", "t": float(t[i]), "x": float(x[i]), "y": float(y[i])}
+        for i in range(n_mouse)
+    ]
+    click = {"type": "click", "t": float(t[-1] + 1), "x": float(x[-1]), "y": float(y[-1])}
+    if honeypot:
+        click = {"type": "honeypot_click", "t": float(t[-1] + 1), "x": float(x[-1]), "y": float(y[-1])}
+    events.append(click)
+    events.extend(_typing(rng, t[-1] + 5, n_keys, interval=(0.010, 0.012), dwell=(0.004, 0.005)))
+    return events
+
+
+def noisy_human_session(rng, n_mouse=400, n_keys=40):
+    """Human mouse path with almost no pauses and steady touch typing; no rule should decide it"""
+    gaps = 4 + rng.gamma(2.0, 6.0, n_mouse)
+    pauses = rng.random(n_mouse) < 0.003
+    gaps[pauses] += rng.uniform(150, 400, int(pauses.sum()))
+    t = np.cumsum(gaps)
+    angle = np.cumsum(rng.normal(0, 0.12, n_mouse))
+    step = rng.gamma(2.0, 3.0, n_mouse)
+    x = 200 + np.cumsum(step * np.cos(angle))
+    y = 200 + np.cumsum(step * np.sin(angle))
+    events = [
+        {"type": "mousemove", "t": float(t[i]), "x": float(x[i]), "y": float(y[i])}
+        for i in range(n_mouse)
+    ]
+    events.append({"type": "click", "t": float(t[-1] + 80), "x": float(x[-1]), "y": float(y[-1])})
+    events.extend(_typing(rng, t[-1] + 500, n_keys, interval=(0.09, 0.13), dwell=(0.06, 0.09)))
+    return events
+
+
+def humanized_bot_session(rng, n_mouse=400, n_keys=40):
+    """Scripted path with jittered timing and position, typing at a plausible pace, no honeypot"""
+    t = np.cumsum(rng.uniform(8.0, 14.0, n_mouse))
+    progress = np.linspace(0, 1, n_mouse)
+    x = 100 + 600 * progress + rng.normal(0, 1.5, n_mouse)
+    y = 100 + 300 * progress + rng.normal(0, 1.5, n_mouse)
+    events = [
+        {"type": "mousemove", "t": float(t[i]), "x": float(x[i]), "y": float(y[i])}
+        for i in range(n_mouse)
+    ]
+    events.append({"type": "click", "t": float(t[-1] + 40), "x": float(x[-1]), "y": float(y[-1])})
+    events.extend(_typing(rng, t[-1] + 200, n_keys, interval=(0.07, 0.10), dwell=(0.03, 0.05)))
+    return events
+
+
+def _typing(rng, start_ms, n_keys, interval, dwell):
+    down = start_ms + np.cumsum(rng.uniform(*interval, n_keys) * 1000)
+    up = down + rng.uniform(*dwell, n_keys) * 1000
+    keys = rng.choice(KEYS, n_keys)
+    events = []
+    for key, d, u in zip(keys, down, up):
+        events.append({"type": "keydown", "t": float(d), "key": str(key)})
+        events.append({"type": "keyup", "t": float(u), "key": str(key)})
+    return events
+
+
+def sessions(seed=0, count=100, bot_ratio=0.5, n_mouse=400, n_keys=40, ambiguous_ratio=0.0):
+    """
+    Yield (is_bot, events) pairs, reproducible for a given seed.
+
+    ambiguous_ratio of the sessions are noisy humans / humanized bots
+    instead of the easy kinds.
+    """
+    rng = np.random.default_rng(seed)
+    for _ in range(count):
+        is_bot = bool(rng.random() < bot_ratio)
+        # Only drawn when asked for, so existing seeds yield the same sessions
+        ambiguous = ambiguous_ratio > 0 and rng.random() < ambiguous_ratio
+        if ambiguous:
+            make = humanized_bot_session if is_bot else noisy_human_session
+        else:
+            make = bot_session if is_bot else human_session
+        yield is_bot, make(rng, n_mouse=n_mouse, n_keys=n_keys)
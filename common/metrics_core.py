@@ -0,0 +1,257 @@
+"""
+Metrics core shared by the RL-CAPTCHA backend and TicketMonarch: Prometheus
+histogram/counter/gauge types, request timing and GET /metrics, stats
+collectors, and the sampling profiler behind /debug/profiler.
+
+Each app's metrics.py puts this directory on sys.path, re-exports what it
+uses and adds only its database hooks (cursor/engine classes that call
+record_query()).
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+from flask import Response, g, request
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (128, 512, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+
+class Histogram:
+    """Prometheus-style cumulative histogram keyed by a tuple of label values"""
+
+    def __init__(self, name, help_text, labels, buckets):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = series[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            series[1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(k, list(v[0]), v[1]) for k, v in self._series.items()]
+        for label_values, counts, total in items:
+            labels = _labels(self.labels, label_values)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{{{labels + ',' if labels else ''}{le}}} {cumulative}")
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {cumulative}")
+        return lines
+
+
+class Counter:
+    """Monotonic counter keyed by a tuple of label values"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values = collections.Counter()
+        self._lock = threading.Lock()
+
+    def inc(self, label_values=(), amount=1):
+        with self._lock:
+            self._values[label_values] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for label_values, value in items:
+            labels = _labels(self.labels, label_values)
+            lines.append(f"{self.name}{{{labels}}} {value}" if labels else f"{self.name} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    """Counter that may also go down"""
+
+    kind = "gauge"
+
+    def dec(self, label_values=(), amount=1):
+        self.inc(label_values, -amount)
+
+
+def _labels(names, values):
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"') for v in values)
+    return ",".join(f'{n}="{v}"' for n, v in zip(names, escaped))
+
+
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "Request latency by route",
+                            ("method", "route", "status"), LATENCY_BUCKETS)
+REQUEST_SIZE = Histogram("http_request_size_bytes", "Request body size by route", ("route",), SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram("http_response_size_bytes", "Response body size by route", ("route",), SIZE_BUCKETS)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests currently being handled")
+DB_LATENCY = Histogram("db_query_duration_seconds", "Database statement time by operation",
+                       ("operation",), LATENCY_BUCKETS)
+DB_ROWS = Counter("db_rows_total", "Rows returned or affected by operation", ("operation",))
+
+METRICS = [REQUEST_LATENCY, REQUEST_SIZE, RESPONSE_SIZE, IN_FLIGHT, DB_LATENCY, DB_ROWS]
+
+# name -> callable returning a dict; numeric values are exported as gauges
+_collectors = {}
+
+
+def register_stats(prefix, stats_fn):
+    """Export the numeric values of stats_fn() as <prefix>_<key> gauges"""
+    _collectors[prefix] = stats_fn
+
+
+def _operation(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode("utf-8", "replace")
+    words = str(sql).split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+def record_query(sql, seconds, rows):
+    operation = _operation(sql)
+    DB_LATENCY.observe((operation,), seconds)
+    if rows and rows > 0:
+        DB_ROWS.inc((operation,), rows)
+
+
+class SamplingProfiler:
+    """
+    Samples every thread's Python stack at a fixed interval while enabled.
+
+    Results are collapsed stacks ("a;b;c count" per line), the input format
+    of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval_s=0.005):
+        self.interval_s = interval_s
+        self.samples = collections.Counter()
+        self._samples_lock = threading.Lock()
+        self._thread = None
+        self._running = threading.Event()
+
+    @property
+    def enabled(self):
+        return self._running.is_set()
+
+    def start(self):
+        if self.enabled:
+            return
+        self._running.set()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running.clear()
+
+    def _run(self):
+        own = threading.get_ident()
+        while self._running.is_set():
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+                    frame = frame.f_back
+                with self._samples_lock:
+                    self.samples[";".join(reversed(stack))] += 1
+            time.sleep(self.interval_s)
+
+    def clear(self):
+        with self._samples_lock:
+            self.samples.clear()
+
+    def collapsed(self):
+        with self._samples_lock:
+            top = self.samples.most_common()
+        return "\n".join(f"{stack} {count}" for stack, count in top)
+
+
+profiler = SamplingProfiler()
+
+
+def render():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    for prefix, stats_fn in list(_collectors.items()):
+        try:
+            stats = stats_fn()
+        except Exception:
+            continue
+        for key, value in stats.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"# TYPE {prefix}_{key} gauge")
+                lines.append(f"{prefix}_{key} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def init_app(app):
+    """
+    Time every request and add GET /metrics (Prometheus text format).
+
+    With PROFILER_ALLOWED=1, POST /debug/profiler/start and
+    POST /debug/profiler/stop switch the sampling profiler on and off and
+    GET /debug/profiler returns the collapsed stacks collected so far.
+    """
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_start = time.perf_counter()
+        IN_FLIGHT.inc()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("_metrics_start", None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+            REQUEST_LATENCY.observe((request.method, route, response.status_code), time.perf_counter() - start)
+            REQUEST_SIZE.observe((route,), request.content_length or 0)
+            if response.content_length is not None:
+                RESPONSE_SIZE.observe((route,), response.content_length)
+        return response
+
+    @app.teardown_request
+    def _finish(exc):
+        IN_FLIGHT.dec()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        return Response(render(), mimetype="text/plain; version=0.0.4")
+
+    if os.getenv("PROFILER_ALLOWED") == "1":
+        @app.route("/debug/profiler", methods=["GET"])
+        def debug_profiler():
+            return Response(profiler.collapsed() or f"profiler enabled={profiler.enabled}\n", mimetype="text/plain")
+
+        @app.route("/debug/profiler/start", methods=["POST"])
+        def debug_profiler_start():
+            profiler.clear()
+            profiler.start()
+            return Response(f"profiler enabled={profiler.enabled}\n", mimetype="text/plain")
+
+        @app.route("/debug/profiler/stop", methods=["POST"])
+        def debug_profiler_stop():
+            profiler.stop()
+            return Response(f"profiler enabled={profiler.enabled}\n", mimetype="text/plain")